@@ -0,0 +1,165 @@
+"""Dashboard figures for /admin/stats, kept in a Redis hash.
+
+A read is a single HGETALL. Status updates apply deltas (`on_status_change`);
+new orders are not written through this API and show up with the next
+reconcile. A full reconcile recomputes everything from PostgreSQL every
+ADMIN_STATS_RECONCILE_S (whichever worker first finds the hash that old,
+under a Redis lock) and whenever a read finds the hash older than
+ADMIN_STATS_MAX_STALENESS_S. Deltas that land while a reconcile is computing
+can be overwritten by it; the next reconcile restores them, which is what the
+staleness bound covers. Without Redis the figures are computed live.
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Optional
+
+from .deps import state, run_cpu
+
+
+logger = logging.getLogger(__name__)
+
+KEY = "admin_stats"
+LOCK_KEY = "admin_stats:reconcile_lock"
+# delete the lock only if it still holds our token (it may have expired and been taken)
+_RELEASE_LOCK = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+Stats = Dict[str, Any]
+
+
+def _status_field(status: Optional[str]) -> str:
+    return f"status:{status or ''}"
+
+
+def max_staleness() -> float:
+    return float(os.getenv("ADMIN_STATS_MAX_STALENESS_S", "300"))
+
+
+def _encode(stats: Stats) -> Dict[str, str]:
+    fields = {
+        "total_orders": str(stats["total_orders"]),
+        "total_revenue": repr(float(stats["total_revenue"])),
+        "orders_today": str(stats["orders_today"]),
+        "today": date.today().isoformat(),
+        "top_products": json.dumps(stats["top_products"], ensure_ascii=False),
+        "recent_orders": json.dumps(stats["recent_orders"], ensure_ascii=False),
+        "reconciled_at": repr(time.time()),
+    }
+    for status, n in stats["orders_by_status"].items():
+        fields[_status_field(status)] = str(n)
+    return fields
+
+
+def _decode(raw: Dict[str, str]) -> Stats:
+    reconciled_at = float(raw.get("reconciled_at") or 0)
+    return {
+        "total_orders": int(raw.get("total_orders") or 0),
+        "total_revenue": round(float(raw.get("total_revenue") or 0), 2),
+        "orders_today": int(raw.get("orders_today") or 0) if raw.get("today") == date.today().isoformat() else 0,
+        "orders_by_status": {
+            (k[len("status:"):] or None): int(v)
+            for k, v in raw.items() if k.startswith("status:") and int(v) > 0
+        },
+        "top_products": json.loads(raw.get("top_products") or "[]"),
+        "recent_orders": json.loads(raw.get("recent_orders") or "[]"),
+        "as_of": datetime.fromtimestamp(reconciled_at).isoformat(timespec="seconds") if reconciled_at else None,
+    }
+
+
+def reconcile(compute: Callable[[], Stats], min_age: float = 0.0) -> Optional[Stats]:
+    """Recompute from the database and replace the hash. Returns None when
+    another worker holds the reconcile lock or reconciled less than `min_age`
+    seconds ago."""
+    r = state.redis
+    lock_ttl_ms = int(max(30.0, max_staleness()) * 1000)
+    token = uuid.uuid4().hex
+    if r is not None and not r.set(LOCK_KEY, token, nx=True, px=lock_ttl_ms):
+        return None
+    try:
+        if r is not None and min_age > 0 and time.time() - float(r.hget(KEY, "reconciled_at") or 0) < min_age:
+            return None
+        stats = compute()
+        if r is not None:
+            pipe = r.pipeline(transaction=True)
+            pipe.delete(KEY)
+            pipe.hset(KEY, mapping=_encode(stats))
+            pipe.execute()
+        state.metrics["admin_stats_reconciles"] = state.metrics.get("admin_stats_reconciles", 0) + 1
+        return stats
+    finally:
+        if r is not None:
+            r.eval(_RELEASE_LOCK, 1, LOCK_KEY, token)
+
+
+def read(compute: Callable[[], Stats]) -> Stats:
+    """Stats no older than ADMIN_STATS_MAX_STALENESS_S (plus one reconcile)."""
+    r = state.redis
+    if r is None:
+        return compute()
+    try:
+        raw = r.hgetall(KEY)
+        if raw and time.time() - float(raw.get("reconciled_at") or 0) <= max_staleness():
+            return _decode(raw)
+        if reconcile(compute) is not None:
+            return _decode(r.hgetall(KEY))
+        # another worker is reconciling: a slightly stale answer beats a second full scan
+        return _decode(raw) if raw else compute()
+    except Exception as e:
+        logger.warning("Admin stats: redis unavailable, computing live: %s", e)
+        return compute()
+
+
+def _apply(fn: Callable[[Any], None]):
+    """Run a delta against the hash; a missing hash is left for the next reconcile."""
+    r = state.redis
+    if r is None:
+        return
+    try:
+        if not r.exists(KEY):
+            return
+        fn(r)
+    except Exception as e:
+        logger.debug("Admin stats: delta not applied: %s", e)
+
+
+def on_status_change(order_no: str, old: Optional[str], new: Optional[str]):
+    if old == new:
+        return
+
+    def txn(pipe):
+        # WATCH KEY (redis-py `transaction`): read recent_orders, then MULTI/EXEC;
+        # a concurrent write to the hash makes EXEC fail and the whole delta is retried
+        recent = json.loads(pipe.hget(KEY, "recent_orders") or "[]")
+        touched = False
+        for o in recent:
+            if o.get("order_no") == order_no:
+                o["status"] = new
+                touched = True
+        pipe.multi()
+        pipe.hincrby(KEY, _status_field(old), -1)
+        pipe.hincrby(KEY, _status_field(new), 1)
+        if touched:
+            pipe.hset(KEY, "recent_orders", json.dumps(recent, ensure_ascii=False))
+
+    _apply(lambda r: r.transaction(txn, KEY))
+
+
+async def reconcile_loop(compute: Callable[[], Stats]):
+    """Background reconciliation every ADMIN_STATS_RECONCILE_S (0 disables).
+
+    Every worker runs the loop, but only one recomputes per interval: the
+    others find a hash younger than the interval and skip.
+    """
+    interval = float(os.getenv("ADMIN_STATS_RECONCILE_S", "60"))
+    if interval <= 0:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_cpu(reconcile, compute, interval)
+        except Exception as e:
+            logger.warning("Admin stats: reconcile failed: %s", e)
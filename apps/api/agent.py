@@ -8,7 +8,7 @@ from .deps import state
 ToolDecision = Literal["none", "orders_status", "db_analytics", "rag_read"]
 
 
-def plan_tools(question: str, is_admin: bool) -> List[ToolDecision]:
+async def plan_tools(question: str, is_admin: bool) -> List[ToolDecision]:
     """Decide which tools to call: orders status (public), DB analytics (admin), RAG read, or none.
     Returns a list of tool decisions (0..n). Typical cases:
       - ["orders_status"]
@@ -29,7 +29,7 @@ def plan_tools(question: str, is_admin: bool) -> List[ToolDecision]:
             "Реши, нужен ли вызов БД, чтобы ответить на вопрос.\n"
             "Ответ строго одним словом: DB_ANALYTICS или NONE."
         )
-        resp = state.client.chat.completions.create(
+        resp = await state.client.chat.completions.create(
             model=os.getenv("CHAT_MODEL"),
             messages=[
                 {"role": "system", "content": prompt},
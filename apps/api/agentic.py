@@ -1,15 +1,28 @@
 import json
 import os
-from typing import Any, Dict, List, Optional, Tuple
+import time
+import asyncio
+import logging
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
 
 from .deps import state
-from .rag import retrieve
+from .rag import aretrieve
+from .partitions import partition_for_mode
 from .customer_tools import order_status_tool
 from .db_tool import db_tool_query
+from .intent import route_request
+from .context import pack_sources, tool_content
+from .generators import system_prompt, llm_stream_answer, context_event, token_event, done_event
+from kits.kit_bm25 import tokenize
 
 
+logger = logging.getLogger(__name__)
+
 # DB execution is delegated to db_tool_query (schema-aware, with retry)
 
+# Default per-tool timeouts (seconds); TOOL_TIMEOUT_<NAME>_S overrides one tool, TOOL_TIMEOUT_S the rest
+_TOOL_TIMEOUTS = {"db_analytics_query": 30.0}
+
 
 def _tools_schema(is_admin: bool) -> List[Dict[str, Any]]:
     tools: List[Dict[str, Any]] = [
@@ -61,147 +74,420 @@ def _tools_schema(is_admin: bool) -> List[Dict[str, Any]]:
     return tools
 
 
-def run_agentic(question: str, is_admin: bool) -> Tuple[str, List[dict], List[str], Optional[dict]]:
-    """Runs an agentic tool-calling loop using OpenAI tools.
-    Returns: (final_answer, sources, labels, tool_info)
+def _tool_timeout(name: str) -> float:
+    env = os.getenv(f"TOOL_TIMEOUT_{name.upper()}_S")
+    if env:
+        return float(env)
+    return _TOOL_TIMEOUTS.get(name, float(os.getenv("TOOL_TIMEOUT_S", "15")))
+
+
+def _count(key: str):
+    state.metrics[key] = state.metrics.get(key, 0) + 1
+
+
+class RagPrefetch:
+    """Speculative retrieval for the raw question, started alongside the first completion.
+
+    A later rag_read reuses it when its query is lexically close to the question
+    (token Jaccard >= RAG_PREFETCH_MIN_SIMILARITY) and asks for no more sources.
+    Outcomes are counted in state.metrics as rag_prefetch_{hits,misses,wasted}.
     """
-    client = state.client
-    model = os.getenv("CHAT_MODEL")
-    tools = _tools_schema(is_admin)
 
-    messages: List[Dict[str, Any]] = [
-        {
-            "role": "system",
-            "content": (
-                "Ты ассистент поддержки. Доступные инструменты:\n"
-                "- rag_read(question, top_k): найти релевантные фрагменты документации (RAG).\n"
-                "- orders_status(order_no): статус конкретного заказа.\n"
-                "- db_analytics_query(sql): аналитический SQL (ТОЛЬКО SELECT, ТОЛЬКО для админа).\n\n"
-                "Правила выбора инструментов:\n"
-                "1) Информационные/политики/FAQ — сперва вызови rag_read, затем отвечай на основе источников.\n"
-                "2) Про конкретный заказ — вызови orders_status.\n"
-                "3) Агрегации/метрики по БД (и если есть права) — db_analytics_query (SELECT).\n"
-                "Отвечай после того, как получишь данные инструментов. Если инструмент не нужен, отвечай сразу."
-            ),
-        },
-        {"role": "user", "content": question},
-    ]
+    def __init__(self, question: str, top_k: int, partition: Optional[str]):
+        self.question = question
+        self.top_k = top_k
+        self.partition = partition
+        self.requested = False
+        self.task = asyncio.ensure_future(aretrieve(question, top_k=top_k, partition=partition))
+        # consume the outcome so an unused, failed prefetch is not reported as never retrieved
+        self.task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    def matches(self, query: str, top_k: int) -> bool:
+        if top_k > self.top_k:
+            return False
+        a, b = set(tokenize(query)), set(tokenize(self.question))
+        if not a or not b:
+            return query.strip().lower() == self.question.strip().lower()
+        return len(a & b) / len(a | b) >= float(os.getenv("RAG_PREFETCH_MIN_SIMILARITY", "0.6"))
+
+    async def retrieve(self, query: str, top_k: int) -> List[dict]:
+        self.requested = True
+        if self.matches(query, top_k):
+            try:
+                # shielded: a tool timeout must not cancel the shared prefetch
+                sources = await asyncio.shield(self.task)
+                _count("rag_prefetch_hits")
+                return sources[:top_k]
+            except Exception as e:
+                logger.warning("RAG prefetch failed, retrieving again: %s", e)
+        _count("rag_prefetch_misses")
+        return await aretrieve(query, top_k=top_k, partition=self.partition)
+
+    def close(self):
+        if not self.requested:
+            _count("rag_prefetch_wasted")
+        if not self.task.done():
+            self.task.cancel()
+
+
+async def _call_tool(name: str, args: dict, question: str, is_admin: bool, partition: Optional[str], prefetch: Optional[RagPrefetch] = None) -> Tuple[Optional[str], Any]:
+    """Execute one tool call. Returns (label, payload); label None means the tool is not available."""
+    if name == "rag_read":
+        q = args.get("question") or question
+        top_k = int(args.get("top_k") or int(os.getenv("RAG_TOP_K", "5")))
+        if prefetch is not None:
+            return "RAG", await prefetch.retrieve(q, top_k)
+        return "RAG", await aretrieve(q, top_k=top_k, partition=partition)
+    if name == "orders_status":
+        order_no = (args.get("order_no") or "").strip()
+        return "Tool-call", await order_status_tool(f"#{order_no}" if order_no else question)
+    if name == "db_analytics_query" and is_admin:
+        q = (args.get("question") or question).strip()
+        return "DB Tool", await db_tool_query(q)
+    return None, {"error": "tool_not_available"}
+
+
+async def _timed_tool(name: str, args: dict, question: str, is_admin: bool, partition: Optional[str], prefetch: Optional[RagPrefetch] = None) -> Tuple[Optional[str], Any, int]:
+    """`_call_tool` under its timeout; failures become an error payload for the model. Adds latency_ms."""
+    t0 = time.perf_counter()
+    try:
+        label, payload = await asyncio.wait_for(_call_tool(name, args, question, is_admin, partition, prefetch), _tool_timeout(name))
+    except asyncio.TimeoutError:
+        _count("tool_timeouts")
+        label, payload = None, {"error": "timeout"}
+    except Exception as e:
+        logger.warning("Tool %s failed: %s", name, e)
+        label, payload = None, {"error": str(e)}
+    latency = int((time.perf_counter() - t0) * 1000)
+    logger.info("tool %s: %d ms", name, latency)
+    return label, payload, latency
+
+
+_AGENT_SYSTEM = (
+    "Ты ассистент поддержки. Доступные инструменты:\n"
+    "- rag_read(question, top_k): найти релевантные фрагменты документации (RAG).\n"
+    "- orders_status(order_no): статус конкретного заказа.\n"
+    "- db_analytics_query(sql): аналитический SQL (ТОЛЬКО SELECT, ТОЛЬКО для админа).\n\n"
+    "Правила выбора инструментов:\n"
+    "1) Информационные/политики/FAQ — сперва вызови rag_read, затем отвечай на основе источников.\n"
+    "2) Про конкретный заказ — вызови orders_status.\n"
+    "3) Агрегации/метрики по БД (и если есть права) — db_analytics_query (SELECT).\n"
+    "Отвечай после того, как получишь данные инструментов. Если инструмент не нужен, отвечай сразу."
+)
+
+MAX_TURNS = 3
+
+
+def single_pass_enabled() -> bool:
+    """AGENT_SINGLE_PASS: the tool loop's last completion is the answer (no separate answer call)."""
+    return os.getenv("AGENT_SINGLE_PASS", "false").lower() == "true"
+
+
+def _source_key(src: dict) -> tuple:
+    return (src.get("path") or src.get("filename"), src.get("chunk") or src.get("snippet"))
+
+
+class AgentRun:
+    """State of one chat's tool loop, shared by `run_agentic` and `stream_agentic`."""
+
+    def __init__(self, question: str, is_admin: bool, mode: str = "faq", single_pass: bool = False):
+        self.question = question
+        self.is_admin = is_admin
+        self.mode = mode
+        self.partition = partition_for_mode(mode, state.partitions)
+        self.tools = _tools_schema(is_admin)
+        self.messages: List[Dict[str, Any]] = [{"role": "system", "content": _AGENT_SYSTEM}]
+        if single_pass:
+            # the model writes the user-facing answer itself: same style and [dN] citations as llm_answer
+            self.messages.append({"role": "system", "content": system_prompt("faq", False)})
+        self.messages.append({"role": "user", "content": question})
+        self.labels: List[str] = []
+        self.sources: List[dict] = []
+        self.tool_info: Optional[dict] = None
+        self.executed: set[str] = set()
+        self.tool_latencies: List[dict] = []
+        self.tool_wall_ms = 0
+        self.prefetch: Optional[RagPrefetch] = None
+        self.routed_by = "llm"
+        self.single_pass = single_pass
 
-    labels: List[str] = []
-    sources: List[dict] = []
-    tool_info: Optional[dict] = None
-
-    executed: set[str] = set()
-    for _ in range(3):
-        resp = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            tools=tools,
-            tool_choice="auto",
-            temperature=0.2,
-        )
-        msg = resp.choices[0].message
-        tool_calls = getattr(msg, "tool_calls", None)
-        if not tool_calls:
-            # No more tools; accept this as final reasoning but we will craft final answer with our template
-            break
-
-        # Execute tools in order
-        # 1) Append assistant message that requested tool calls
+    def completion_args(self, final: bool = False) -> Dict[str, Any]:
+        """Arguments for one loop completion; `final` forces a text answer instead of tool calls."""
+        return {
+            "model": os.getenv("CHAT_MODEL"),
+            "messages": self.messages,
+            "tools": self.tools,
+            "tool_choice": "none" if final else "auto",
+            "temperature": 0.2,
+        }
+
+    async def route(self) -> bool:
+        """Fast path: a confidently routed request goes straight to its tool,
+        skipping the tool-selection completions (a failing tool falls back to the LLM loop).
+        Returns True when the tool loop is not needed."""
+        route = await route_request(self.question, self.mode, self.is_admin)
+        if route is not None:
+            label, payload, latency = await _timed_tool(route.tool, route.args, self.question, self.is_admin, self.partition)
+            self.tool_latencies.append({"name": route.tool, "latency_ms": latency})
+            self.tool_wall_ms += latency
+            _count("tool_calls")
+            if label is not None:
+                self.routed_by = route.source
+                self._merge(label, payload)
+        _count("router_llm" if self.routed_by == "llm" else "router_fast_path")
+        if self.routed_by != "llm":
+            return True
+        # Most chats end up retrieving for the question anyway: start that now so it
+        # overlaps the tool-selection completion instead of following it
+        if os.getenv("RAG_PREFETCH", "true").lower() == "true":
+            self.prefetch = RagPrefetch(self.question, int(os.getenv("RAG_TOP_K", "5")), self.partition)
+        if self.single_pass:
+            await self.preload_context()
+        return False
+
+    async def preload_context(self):
+        """Single pass: any turn may become the answer, so the model gets the retrieved
+        context up front; the sources (and their [dN] ids) are the ones it actually saw."""
+        top_k = int(os.getenv("RAG_TOP_K", "5"))
         try:
-            tc_payload = []
-            for tc in tool_calls:
-                tc_payload.append({
-                    "id": getattr(tc, "id", None),
-                    "type": "function",
-                    "function": {
-                        "name": tc.function.name,
-                        "arguments": tc.function.arguments or "{}",
-                    },
-                })
-            messages.append({
-                "role": "assistant",
-                "content": msg.content or "",
-                "tool_calls": tc_payload,
-            })
-        except Exception:
-            # non-fatal; proceed with tool messages only
-            pass
+            if self.prefetch is not None:
+                sources = await self.prefetch.retrieve(self.question, top_k)
+            else:
+                sources = await aretrieve(self.question, top_k=top_k, partition=self.partition)
+        except Exception as e:
+            logger.warning("RAG context preload failed: %s", e)
+            return
+        if not sources:
+            return
+        self._merge("RAG", sources)
+        ctx = "\n".join(f"[{s['id']}] {s['filename']}: {s['text']}" for s in pack_sources(sources))
+        # before the user message, like the other system instructions
+        self.messages.insert(len(self.messages) - 1, {"role": "system", "content": f"Контекст:\n---\n{ctx}\n---"})
+
+    def _merge(self, label: Optional[str], payload: Any) -> Any:
+        """Record a tool result; returns the payload to show the model."""
+        if label == "RAG":
+            # the model sees budgeted chunks, not the full documents kept for the UI
+            payload = {"sources": pack_sources(self._add_sources(payload))}
+        elif label is not None:
+            # prefer the most impactful tool_info (orders/status or db)
+            self.tool_info = payload
+        if label is not None:
+            self.labels.append(label)
+        return payload
 
-        # 2) Run tools and append tool outputs
-        for tc in tool_calls:
-            name = tc.function.name
-            if name in executed:
-                continue
-            args = {}
+    def _add_sources(self, new: List[dict]) -> List[dict]:
+        """Append retrieved sources after those the model has already seen.
+
+        New documents are renumbered d{n}, d{n+1}, ... so one [dN] citation always
+        means one document (single pass preloads context before any rag_read);
+        a repeated chunk keeps its first id. Returns `new` with the final ids.
+        """
+        known = {_source_key(s): s for s in self.sources}
+        out = []
+        for src in new:
+            key = _source_key(src)
+            if key not in known:
+                known[key] = {**src, "id": f"d{len(self.sources)}"}
+                self.sources.append(known[key])
+            out.append(known[key])
+        return out
+
+    async def run_tools(self, tool_calls: List[dict], content: str = ""):
+        """Execute one turn's tool calls ({"id", "name", "arguments"}) concurrently,
+        appending the assistant request and the tool outputs in call order."""
+        self.messages.append({
+            "role": "assistant",
+            "content": content,
+            "tool_calls": [
+                {"id": c["id"], "type": "function", "function": {"name": c["name"], "arguments": c["arguments"] or "{}"}}
+                for c in tool_calls
+            ],
+        })
+        calls = []
+        for c in tool_calls:
             try:
-                args = json.loads(tc.function.arguments or "{}")
+                args = json.loads(c["arguments"] or "{}")
             except Exception:
                 args = {}
+            # a tool runs at most once per chat (repeats in this turn included)
+            run = c["name"] not in self.executed
+            self.executed.add(c["name"])
+            calls.append((c, args, run))
+
+        t_turn = time.perf_counter()
+        results = await asyncio.gather(*[
+            _timed_tool(c["name"], args, self.question, self.is_admin, self.partition, self.prefetch)
+            for c, args, run in calls if run
+        ])
+        self.tool_wall_ms += int((time.perf_counter() - t_turn) * 1000)
+        state.metrics["tool_calls"] = state.metrics.get("tool_calls", 0) + len(results)
 
-            if name == "rag_read":
-                q = args.get("question") or question
-                top_k = int(args.get("top_k") or int(os.getenv("RAG_TOP_K", "5")))
-                sources = retrieve(q, top_k=top_k)
-                labels.append("RAG")
-                messages.append({
-                    "role": "tool",
-                    "tool_call_id": tc.id,
-                    "name": name,
-                    "content": json.dumps({"sources": sources}, ensure_ascii=False, default=str),
-                })
-            elif name == "orders_status":
-                order_no = (args.get("order_no") or "").strip()
-                ti = order_status_tool(f"#{order_no}" if order_no else question)
-                # prefer the most impactful tool_info (orders/status or db)
-                tool_info = ti
-                labels.append("Tool-call")
-                messages.append({
-                    "role": "tool",
-                    "tool_call_id": tc.id,
-                    "name": name,
-                    "content": json.dumps(ti, ensure_ascii=False, default=str),
-                })
-            elif name == "db_analytics_query" and is_admin:
-                q = (args.get("question") or question).strip()
-                ti = db_tool_query(q)
-                tool_info = ti
-                labels.append("DB Tool")
-                messages.append({
-                    "role": "tool",
-                    "tool_call_id": tc.id,
-                    "name": name,
-                    "content": json.dumps(ti, ensure_ascii=False, default=str),
-                })
-                executed.add(name)
-                # let the model finalize using tool results (don't immediately break outer loop)
+        it = iter(results)
+        for c, _args, run in calls:
+            if not run:
+                payload: Any = {"error": "already_executed"}
             else:
-                messages.append({
-                    "role": "tool",
-                    "tool_call_id": tc.id,
-                    "name": name,
-                    "content": json.dumps({"error": "tool_not_available"}, ensure_ascii=False, default=str),
-                })
-            executed.add(name)
-
-        # loop continues for potential follow-up tool calls
-
-    # Safety fallback: if модель не вызвала rag_read и других tools нет, подгрузи контекст для ответа
-    if not sources and not tool_info:
+                label, payload, latency = next(it)
+                self.tool_latencies.append({"name": c["name"], "latency_ms": latency})
+                payload = self._merge(label, payload)
+            self.messages.append({
+                "role": "tool",
+                "tool_call_id": c["id"],
+                "name": c["name"],
+                "content": tool_content(payload),
+            })
+
+    async def fallback_context(self):
+        # Safety fallback: if модель не вызвала rag_read и других tools нет, подгрузи контекст для ответа
+        if self.sources or self.tool_info:
+            return
         try:
-            sources = retrieve(question, top_k=int(os.getenv("RAG_TOP_K", "5")))
-            if sources:
-                labels.append("RAG")
+            top_k = int(os.getenv("RAG_TOP_K", "5"))
+            if self.prefetch is not None:
+                self.sources = await self.prefetch.retrieve(self.question, top_k)
+            else:
+                self.sources = await aretrieve(self.question, top_k=top_k, partition=self.partition)
+            if self.sources:
+                self.labels.append("RAG")
         except Exception:
             pass
 
-    # Final answer text will be produced by our answer generator using sources + tool_info
-    # dedupe labels preserve order
-    seen = set()
-    labels_unique = []
-    for l in labels:
-        if l not in seen:
-            labels_unique.append(l)
-            seen.add(l)
+    def close(self):
+        """Release the RAG prefetch and record its outcome; safe to call more than once."""
+        if self.prefetch is not None:
+            self.prefetch.close()
+            self.prefetch = None
+
+    def finish(self, trace: Optional[dict] = None) -> Tuple[List[dict], List[str], Optional[dict]]:
+        """Release the prefetch and return (sources, labels, tool_info)."""
+        self.close()
+        if trace is not None:
+            trace["route"] = self.routed_by
+            trace["tools"] = self.tool_latencies
+            trace["tool_latency_ms"] = self.tool_wall_ms if self.tool_latencies else None
+        # dedupe labels preserve order
+        seen = set()
+        labels_unique = []
+        for l in self.labels:
+            if l not in seen:
+                labels_unique.append(l)
+                seen.add(l)
+        return self.sources, labels_unique, self.tool_info
+
+
+def _call_dict(tc: Any) -> dict:
+    return {"id": getattr(tc, "id", None), "name": tc.function.name, "arguments": tc.function.arguments or "{}"}
+
+
+async def run_agentic(question: str, is_admin: bool, mode: str = "faq", trace: Optional[dict] = None) -> Tuple[str, List[dict], List[str], Optional[dict]]:
+    """Runs an agentic tool-calling loop using OpenAI tools.
+    `mode` (ChatRequest.mode) selects the knowledge-base partition searched by rag_read.
+    Tool calls of one turn run concurrently; when `trace` is given it receives
+    per-tool latencies ("tools") and the wall time spent in tools ("tool_latency_ms").
+    With AGENT_SINGLE_PASS the model's final message is returned as the answer;
+    otherwise final_answer is "" and the caller generates it from sources + tool_info.
+    Returns: (final_answer, sources, labels, tool_info)
+    """
+    single_pass = single_pass_enabled()
+    run = AgentRun(question, is_admin, mode, single_pass=single_pass)
     final_answer = ""
-    return final_answer, sources, labels_unique, tool_info
+    try:
+        if not await run.route():
+            for turn in range(MAX_TURNS):
+                final = single_pass and turn == MAX_TURNS - 1
+                resp = await state.client.chat.completions.create(**run.completion_args(final))
+                msg = resp.choices[0].message
+                tool_calls = getattr(msg, "tool_calls", None)
+                if not tool_calls:
+                    if single_pass:
+                        final_answer = msg.content or ""
+                    break
+                await run.run_tools([_call_dict(tc) for tc in tool_calls], msg.content or "")
+                # loop continues for potential follow-up tool calls
+            await run.fallback_context()
+        sources, labels, tool_info = run.finish(trace)
+    finally:
+        # a failed completion or tool must not leak the prefetch task or skip its metrics
+        run.close()
+    return final_answer, sources, labels, tool_info
+
+
+def _holdback_chars() -> int:
+    return int(os.getenv("AGENT_STREAM_HOLDBACK_CHARS", "160"))
+
+
+async def stream_agentic(question: str, is_admin: bool, mode: str = "faq") -> AsyncGenerator[dict, None]:
+    """Single-pass streaming: the tool loop's last completion is streamed to the client.
+
+    Each turn is a streamed completion; tool-call deltas are collected for the whole
+    turn and executed. Text is held back until it passes AGENT_STREAM_HOLDBACK_CHARS
+    (or the turn ends) with no tool call in sight, so a preamble such as
+    "Сейчас проверю…" before tool calls is dropped rather than streamed. Once a turn
+    is the answer, the `context` event (the sources the model saw) is sent, then
+    `token`s and `done`, exactly as `llm_stream_answer` does. Routed requests and
+    turns that end without text fall back to `llm_stream_answer` on the gathered context.
+    """
+    run = AgentRun(question, is_admin, mode, single_pass=True)
+    try:
+        if not await run.route():
+            for turn in range(MAX_TURNS):
+                final = turn == MAX_TURNS - 1
+                holdback = 0 if final else _holdback_chars()  # tool_choice "none": no tool calls can follow
+                calls: Dict[int, dict] = {}
+                pending: List[str] = []
+                answering = False
+                finished = False
+                stream = await state.client.chat.completions.create(**run.completion_args(final), stream=True)
+                try:
+                    async for chunk in stream:
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta
+                        for tcd in getattr(delta, "tool_calls", None) or []:
+                            c = calls.setdefault(tcd.index, {"id": None, "name": "", "arguments": ""})
+                            if tcd.id:
+                                c["id"] = tcd.id
+                            if tcd.function is not None:
+                                c["name"] += tcd.function.name or ""
+                                c["arguments"] += tcd.function.arguments or ""
+                        if not delta.content:
+                            continue
+                        if answering:
+                            yield token_event(delta.content)
+                            continue
+                        pending.append(delta.content)
+                        if not calls and sum(len(p) for p in pending) > holdback:
+                            answering = True
+                            sources, labels, tool_info = run.finish()
+                            yield context_event(sources, labels, tool_info)
+                            yield token_event("".join(pending))
+                    finished = True
+                finally:
+                    if answering and not finished:
+                        state.metrics["streams_cancelled"] = state.metrics.get("streams_cancelled", 0) + 1
+                    await stream.close()
+                if not answering and pending and not calls:
+                    # short answer that ended within the hold-back window
+                    answering = True
+                    sources, labels, tool_info = run.finish()
+                    yield context_event(sources, labels, tool_info)
+                    yield token_event("".join(pending))
+                if answering:
+                    if calls:
+                        # the answer was already streamed; tool calls after that much text are dropped
+                        logger.warning("Ignoring %d tool call(s) that followed a streamed answer", len(calls))
+                        _count("stream_late_tool_calls")
+                    yield done_event()
+                    return
+                if not calls:
+                    break
+                # any preamble text in `pending` is discarded with the tool-call turn
+                await run.run_tools([calls[i] for i in sorted(calls)])
+            await run.fallback_context()
+        sources, labels, tool_info = run.finish()
+        async for ev in llm_stream_answer(question, sources, tool_info, labels):
+            yield ev
+    finally:
+        # also runs when the client disconnects (the generator is closed mid-stream)
+        run.close()
@@ -0,0 +1,66 @@
+"""Token budgets for what goes into prompts: retrieved chunks, tool results, DB rows."""
+import os
+from typing import Any, Dict, List, Optional
+
+from kits.kit_context import count_tokens, pack_texts, cap_json, compact_rows
+
+
+def _model() -> str:
+    return os.getenv("CHAT_MODEL") or ""
+
+
+def _budget(name: str, default: int) -> int:
+    return int(os.getenv(name, str(default)))
+
+
+def pack_sources(sources: List[dict]) -> List[Dict[str, str]]:
+    """Fit retrieved sources (ordered by relevance) into CONTEXT_TOKEN_BUDGET.
+
+    Uses the retrieved chunk (falling back to the snippet), never the full
+    document `content`; near-duplicate chunks are dropped.
+    """
+    packed = pack_texts(
+        sources,
+        lambda s: s.get("chunk") or s.get("snippet") or "",
+        budget=_budget("CONTEXT_TOKEN_BUDGET", 1500),
+        per_item=_budget("CONTEXT_CHUNK_MAX_TOKENS", 400),
+        model=_model(),
+        dedupe=float(os.getenv("CONTEXT_DEDUPE_THRESHOLD", "0.8")),
+    )
+    return [{"id": s.get("id", ""), "filename": s.get("filename", ""), "text": text} for s, text in packed]
+
+
+def _optional_int(name: str, default: str) -> Optional[int]:
+    raw = os.getenv(name, default).strip()
+    return int(raw) if raw else None
+
+
+def compact_tool_payload(payload: Any) -> Any:
+    """Prompt-facing form of a columnar tool result (`{"columns", "rows"}`):
+    floats rounded to TOOL_RESULT_FLOAT_DIGITS, strings cut at TOOL_RESULT_MAX_TEXT
+    characters (empty value disables either)."""
+    if not (isinstance(payload, dict) and isinstance(payload.get("columns"), list) and payload.get("rows")):
+        return payload
+    rows = compact_rows(
+        payload["rows"],
+        digits=_optional_int("TOOL_RESULT_FLOAT_DIGITS", "2"),
+        max_text=_optional_int("TOOL_RESULT_MAX_TEXT", "200"),
+    )
+    return {**payload, "rows": rows}
+
+
+def tool_content(payload: Any) -> str:
+    """Tool result as a JSON string of at most TOOL_RESULT_MAX_TOKENS."""
+    return cap_json(compact_tool_payload(payload), _budget("TOOL_RESULT_MAX_TOKENS", 1500), _model())
+
+
+def fit_rows(rows: List[Any]) -> List[Any]:
+    """Longest prefix of `rows` within DB_ROWS_MAX_TOKENS (at least one row is kept)."""
+    budget = _budget("DB_ROWS_MAX_TOKENS", 1000)
+    model = _model()
+    used = 0
+    for i, row in enumerate(rows):
+        used += count_tokens(str(row), model)
+        if used > budget and i > 0:
+            return rows[:i]
+    return rows
@@ -0,0 +1,106 @@
+import os
+import asyncio
+import weakref
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+
+_engine: Optional[AsyncEngine] = None
+_analytics_engine: Optional[AsyncEngine] = None
+# one semaphore per event loop (asyncio primitives are loop-bound)
+_analytics_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+class AnalyticsBusy(RuntimeError):
+    """All analytics slots stayed taken for ANALYTICS_QUEUE_TIMEOUT_S."""
+
+
+def async_db_url(url: str) -> str:
+    """Rewrite a sync PostgreSQL URL (`postgresql://`, `+psycopg2`) to the asyncpg driver."""
+    u = make_url(url)
+    if u.get_backend_name() == "postgresql" and u.get_driver_name() != "asyncpg":
+        u = u.set(drivername="postgresql+asyncpg")
+    return u.render_as_string(hide_password=False)
+
+
+def _db_url() -> str:
+    db_url = os.getenv("DB_URL")
+    if not db_url:
+        raise RuntimeError("DB_URL is not set")
+    return async_db_url(db_url)
+
+
+# read-only role created by db/init.sql
+ANALYTICS_ROLE = ("support_ro", "readonly")
+
+
+def analytics_db_url() -> str:
+    """ANALYTICS_DB_URL, or DB_URL with its credentials swapped for the read-only role."""
+    url = os.getenv("ANALYTICS_DB_URL")
+    if url:
+        return async_db_url(url)
+    user, password = ANALYTICS_ROLE
+    return make_url(_db_url()).set(username=user, password=password).render_as_string(hide_password=False)
+
+
+def get_async_engine() -> AsyncEngine:
+    """Shared async engine for the chat tools' hot path (order status)."""
+    global _engine
+    if _engine is None:
+        _engine = create_async_engine(
+            _db_url(),
+            pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+            max_overflow=int(os.getenv("DB_POOL_OVERFLOW", "10")),
+            pool_pre_ping=True,
+        )
+    return _engine
+
+
+def analytics_max_concurrency() -> int:
+    return max(1, int(os.getenv("ANALYTICS_MAX_CONCURRENCY", "2")))
+
+
+def get_analytics_engine() -> AsyncEngine:
+    """Separate pool for LLM-generated analytics SQL.
+
+    It connects as the read-only role (`analytics_db_url`), so write access is
+    denied by grants rather than by a session setting a statement could flip;
+    sessions also default to read-only transactions and every statement runs under
+    ANALYTICS_STATEMENT_TIMEOUT_MS; the pool holds at most
+    ANALYTICS_MAX_CONCURRENCY connections and never borrows from the
+    order-lookup pool.
+    """
+    global _analytics_engine
+    if _analytics_engine is None:
+        settings: Dict[str, str] = {
+            "statement_timeout": os.getenv("ANALYTICS_STATEMENT_TIMEOUT_MS", "5000"),
+            "default_transaction_read_only": "on",
+        }
+        _analytics_engine = create_async_engine(
+            analytics_db_url(),
+            pool_size=analytics_max_concurrency(),
+            max_overflow=0,
+            pool_pre_ping=True,
+            connect_args={"server_settings": settings},
+        )
+    return _analytics_engine
+
+
+@asynccontextmanager
+async def analytics_slot() -> AsyncIterator[None]:
+    """Bound concurrent analytics statements; waiters give up after ANALYTICS_QUEUE_TIMEOUT_S."""
+    loop = asyncio.get_running_loop()
+    slots = _analytics_slots.get(loop)
+    if slots is None:
+        slots = _analytics_slots[loop] = asyncio.Semaphore(analytics_max_concurrency())
+    try:
+        await asyncio.wait_for(slots.acquire(), float(os.getenv("ANALYTICS_QUEUE_TIMEOUT_S", "10")))
+    except asyncio.TimeoutError:
+        raise AnalyticsBusy("Аналитика перегружена, попробуйте позже") from None
+    try:
+        yield
+    finally:
+        slots.release()
@@ -1,19 +1,20 @@
 import os
 import re
+import json
+import asyncio
 from time import time
-from typing import List, Dict, Any, Optional
+from typing import Awaitable, Callable, List, Dict, Any, Optional, Tuple
 from decimal import Decimal
 from datetime import date, datetime, time as dtime
 from uuid import UUID
 
-from sqlalchemy import create_engine, text
 from sqlalchemy.exc import SQLAlchemyError
 
-from .deps import state
-
-
-_engine = None
-_schema_cache: Optional[str] = None
+from .deps import state, run_cpu
+from .db import get_analytics_engine, analytics_slot
+from .context import fit_rows
+from .sql_cache import schema_fingerprint
+from .schema_catalog import get_schema_catalog, schema_context
 
 
 def _jsonify_value(v: Any) -> Any:
@@ -61,15 +62,15 @@ def safe_sql(sql: str) -> str:
     return s
 
 
-def extract_sql(question: str) -> str:
+async def extract_sql(question: str) -> str:
     # Ask LLM to produce a single-line SQL SELECT statement for PostgreSQL
     prompt = (
         "Ты помощник по аналитике БД. Твоя задача — составить один корректный SQL SELECT для PostgreSQL. "
         "Ограничения: только SELECT (никаких INSERT/UPDATE/DELETE/DDL), никаких точек с запятой, без бэктиков. "
         "Опирайся на схему БД ниже и используй только существующие таблицы/поля."
     )
-    schema = get_db_schema()
-    resp = state.client.chat.completions.create(
+    schema = await schema_context(question)
+    resp = await state.client.chat.completions.create(
         model=os.getenv("CHAT_MODEL"),
         messages=[
             {"role": "system", "content": prompt},
@@ -82,13 +83,13 @@ def extract_sql(question: str) -> str:
     return _coerce_to_sql(raw)
 
 
-def extract_sql_strict(question: str) -> str:
+async def extract_sql_strict(question: str) -> str:
     prompt = (
         "Выведи только один корректный SQL SELECT (PostgreSQL) без пояснений и без бэктиков. "
         "Никакого текста вокруг. Только запрос."
     )
-    schema = get_db_schema()
-    resp = state.client.chat.completions.create(
+    schema = await schema_context(question)
+    resp = await state.client.chat.completions.create(
         model=os.getenv("CHAT_MODEL"),
         messages=[
             {"role": "system", "content": prompt},
@@ -121,9 +122,10 @@ def _coerce_to_sql(text: str) -> str:
     return t
 
 
-def summarize_rows(rows: List[Dict[str, Any]]) -> str:
-    body = str(rows[:5]) if rows else "Пустой результат"
-    resp = state.client.chat.completions.create(
+async def summarize_rows(table: Dict[str, list]) -> str:
+    rows = table.get("rows") or []
+    body = json.dumps({"columns": table.get("columns"), "rows": rows[:5]}, ensure_ascii=False, default=str) if rows else "Пустой результат"
+    resp = await state.client.chat.completions.create(
         model=os.getenv("CHAT_MODEL"),
         messages=[
             {"role": "system", "content": "Сделай краткое русскоязычное резюме набора строк БД."},
@@ -134,129 +136,236 @@ def summarize_rows(rows: List[Dict[str, Any]]) -> str:
     return resp.choices[0].message.content or ""
 
 
-def db_tool_query(question: str) -> dict:
+class QueryTooExpensive(ValueError):
+    pass
+
+
+def _iso(v: Any) -> Any:
+    return v.isoformat()
+
+
+def _decimal(v: Any) -> Any:
+    try:
+        return float(v)
+    except Exception:
+        return str(v)
+
+
+def _bytes(v: Any) -> Any:
+    return bytes(v).decode("utf-8", errors="replace")
+
+
+def _same(v: Any) -> Any:
+    return v
+
+
+# PostgreSQL type name -> JSON-ready converter; other types go through _jsonify_value
+_CONVERTERS: Dict[str, Callable[[Any], Any]] = {
+    **dict.fromkeys(("int2", "int4", "int8", "oid", "float4", "float8", "bool"), _same),
+    **dict.fromkeys(("text", "varchar", "bpchar", "char", "name", "json", "jsonb"), _same),
+    **dict.fromkeys(("date", "time", "timetz", "timestamp", "timestamptz"), _iso),
+    "numeric": _decimal,
+    "uuid": str,
+    "interval": str,
+    "money": str,
+    "bytea": _bytes,
+}
+
+
+def _converter(type_name: str) -> Callable[[Any], Any]:
+    conv = _CONVERTERS.get(type_name, _jsonify_value)
+    return lambda v: None if v is None else conv(v)
+
+
+def max_rows() -> int:
+    return max(1, int(os.getenv("DB_TOOL_MAX_ROWS", "20")))
+
+
+def cap_limit(sql: str, cap: int) -> str:
+    """Push the returned-row cap into the statement: lower a trailing LIMIT, else wrap."""
+    m = re.search(r"\blimit\s+(\d+)(\s+offset\s+\d+)?\s*$", sql, flags=re.IGNORECASE)
+    if m:
+        return sql[: m.start(1)] + str(min(int(m.group(1)), cap)) + sql[m.end(1):]
+    return f"SELECT * FROM ({sql}) AS capped LIMIT {cap}"
+
+
+def prepare_sql(sql: str) -> str:
+    return cap_limit(safe_sql(sql), max_rows())
+
+
+async def _run_sql(sql: str) -> Dict[str, list]:
+    """The single execution path for analytics SQL; returns a columnar
+    `{"columns": [...], "rows": [[...], ...]}` table.
+
+    Runs on a server-side cursor in a read-only transaction and fetches in
+    batches until DB_TOOL_MAX_ROWS; cell converters are chosen once per column
+    from the statement's result types.
+    """
+    cap = max_rows()
+    batch_size = int(os.getenv("DB_TOOL_FETCH_BATCH", "50"))
+    rows: List[list] = []
+    async with analytics_slot(), get_analytics_engine().connect() as conn:
+        driver = (await conn.get_raw_connection()).driver_connection
+        async with driver.transaction(readonly=True):
+            stmt = await driver.prepare(sql)
+            attrs = stmt.get_attributes()
+            convs = [_converter(a.type.name) for a in attrs]
+            cur = await stmt.cursor()
+            while len(rows) < cap:
+                batch = await cur.fetch(min(batch_size, cap - len(rows)))
+                if not batch:
+                    break
+                rows.extend([conv(v) for conv, v in zip(convs, r)] for r in batch)
+    return {"columns": [a.name for a in attrs], "rows": rows}
+
+
+async def _explain(sql: str) -> float:
+    """Plan without executing; raises on syntax errors, unknown columns, missing grants,
+    and QueryTooExpensive when the planner's total cost exceeds SQL_MAX_COST.
+    Returns the estimated cost."""
+    async with analytics_slot(), get_analytics_engine().connect() as conn:
+        # raw asyncpg like _run_sql: ":name" in generated SQL must not become a bind parameter
+        driver = (await conn.get_raw_connection()).driver_connection
+        plan = await driver.fetchval(f"EXPLAIN (FORMAT JSON) {sql}")
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    cost = float(plan[0]["Plan"]["Total Cost"])
+    max_cost = float(os.getenv("SQL_MAX_COST", "1000000"))
+    if cost > max_cost:
+        state.metrics["sql_rejected_cost"] = state.metrics.get("sql_rejected_cost", 0) + 1
+        raise QueryTooExpensive(
+            f"Запрос слишком тяжёлый (оценка стоимости {cost:.0f} > {max_cost:.0f}): "
+            "сузь период, добавь фильтры или агрегируй по индексированным полям"
+        )
+    return cost
+
+
+async def _candidate(generate: Callable[[str], Awaitable[str]], question: str) -> str:
+    sql = prepare_sql(await generate(question))
+    await _explain(sql)
+    return sql
+
+
+async def _first_valid(generators: List[Callable[[str], Awaitable[str]]], question: str) -> Tuple[Optional[str], List[Exception]]:
+    """Run candidate pipelines concurrently; returns (first validated SQL, errors of the failed ones).
+
+    On ties the earlier generator wins; candidates still running are cancelled.
+    """
+    tasks = [asyncio.ensure_future(_candidate(g, question)) for g in generators]
+    errors: List[Exception] = []
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for t in (t for t in tasks if t in done):
+                if t.exception() is None:
+                    return t.result(), errors
+                errors.append(t.exception())
+    finally:
+        for t in pending:
+            t.cancel()
+    return None, errors
+
+
+async def _cached_sql(question: str, schema_fp: str) -> Optional[Tuple[str, Dict[str, list]]]:
+    """Run the cached SQL for this question, if any; a failing entry is dropped."""
+    cache = state.sql_cache
+    if cache is None:
+        return None
+    sql = await run_cpu(cache.get, question, schema_fp)
+    if not sql:
+        return None
+    try:
+        sql = prepare_sql(sql)
+        await _explain(sql)  # data growth can push a once-cheap query over the cost limit
+        return sql, await _run_sql(sql)
+    except Exception:
+        await run_cpu(cache.discard, question, schema_fp)
+        return None
+
+
+async def db_tool_query(question: str) -> dict:
     # rely on caller for admin checks
     t0 = time()
-    rows: List[Dict[str, Any]] = []
+    table: Dict[str, list] = {"columns": [], "rows": []}
     sql_used = ""
-    global _engine
-    if _engine is None:
-        db_url = os.getenv("DB_URL")
-        if not db_url:
-            raise RuntimeError("DB_URL is not set")
-        _engine = create_engine(db_url)
+    schema_fp = schema_fingerprint(await get_db_schema())
 
-    try:
-        sql = extract_sql(question)
-        sql = safe_sql(sql)
-        with _engine.connect() as conn:
-            result = conn.execute(text(sql))
-            cols = result.keys()
-            for r in result.fetchall():
-                row_obj = {c: (getattr(r, c) if hasattr(r, c) else r[i]) for i, c in enumerate(cols)}
-                rows.append({k: _jsonify_value(v) for k, v in row_obj.items()})
-        sql_used = sql
-    except Exception as e1:
+    hit = await _cached_sql(question, schema_fp)
+    if hit is not None:
+        sql_used, table = hit
+        latency = int((time() - t0) * 1000)
+        state.metrics["db_queries"] = state.metrics.get("db_queries", 0) + 1
+        return {
+            "name": "db_analytics.query",
+            "sql": sql_used,
+            "columns": table["columns"],
+            "rows": fit_rows(table["rows"]),
+            "summary": None,
+            "latency_ms": latency,
+            "cached": True,
+        }
+
+    # Normal and strict generations run concurrently; the first candidate that
+    # passes safe_sql and EXPLAIN is executed. The repair call only runs when
+    # every candidate (or the chosen one's execution) failed.
+    errors: List[str] = []
+    sql, gen_errors = await _first_valid([extract_sql, extract_sql_strict], question)
+    errors += [str(e) for e in gen_errors]
+    if sql is not None:
+        try:
+            table = await _run_sql(sql)
+            sql_used = sql
+        except Exception as e:
+            errors.append(str(e))
+    if not sql_used:
         try:
-            # Try strict extraction
-            sql = extract_sql_strict(question)
-            sql = safe_sql(sql)
-            with _engine.connect() as conn:
-                result = conn.execute(text(sql))
-                cols = result.keys()
-                for r in result.fetchall():
-                    row_obj = {c: (getattr(r, c) if hasattr(r, c) else r[i]) for i, c in enumerate(cols)}
-                    rows.append({k: _jsonify_value(v) for k, v in row_obj.items()})
+            # Last try: repair based on the errors seen so far
+            sql = prepare_sql(await extract_sql_with_error(question, "\n".join(errors)))
+            await _explain(sql)
+            table = await _run_sql(sql)
             sql_used = sql
-        except Exception as e2:
-            try:
-                # Last try: repair based on error
-                sql = extract_sql_with_error(question, f"{e1}")
-                sql = safe_sql(sql)
-                with _engine.connect() as conn:
-                    result = conn.execute(text(sql))
-                    cols = result.keys()
-                    for r in result.fetchall():
-                        row_obj = {c: (getattr(r, c) if hasattr(r, c) else r[i]) for i, c in enumerate(cols)}
-                        rows.append({k: _jsonify_value(v) for k, v in row_obj.items()})
-                sql_used = sql
-            except Exception as e3:
-                # Return graceful error info
-                latency = int((time() - t0) * 1000)
-                state.metrics["db_queries"] = state.metrics.get("db_queries", 0) + 1
-                return {
-                    "name": "db_analytics.query",
-                    "sql": sql_used or "",
-                    "rows": [],
-                    "summary": f"Ошибка SQL: {str(e3)}",
-                    "latency_ms": latency,
-                }
+        except Exception as e3:
+            # Return graceful error info
+            latency = int((time() - t0) * 1000)
+            state.metrics["db_queries"] = state.metrics.get("db_queries", 0) + 1
+            return {
+                "name": "db_analytics.query",
+                "sql": sql_used or "",
+                "columns": [],
+                "rows": [],
+                "summary": f"Ошибка SQL: {str(e3)}",
+                "latency_ms": latency,
+            }
 
+    # only SQL that passed safe_sql and executed gets here
+    if state.sql_cache is not None:
+        await run_cpu(state.sql_cache.put, question, schema_fp, sql_used)
     latency = int((time() - t0) * 1000)
     state.metrics["db_queries"] = state.metrics.get("db_queries", 0) + 1
     return {
         "name": "db_analytics.query",
         "sql": sql_used,
-        "rows": rows[:20],
+        "columns": table["columns"],
+        "rows": fit_rows(table["rows"]),
         "summary": None,
         "latency_ms": latency,
     }
 
 
-def get_db_schema() -> str:
-    """Return cached public schema description (tables and columns)."""
-    global _schema_cache, _engine
-    if _schema_cache:
-        return _schema_cache
-    if _engine is None:
-        db_url = os.getenv("DB_URL")
-        if not db_url:
-            return default_schema_hint()
-        _engine = create_engine(db_url)
-    try:
-        q = text(
-            """
-            SELECT table_name, column_name, data_type
-            FROM information_schema.columns
-            WHERE table_schema = 'public'
-            ORDER BY table_name, ordinal_position
-            """
-        )
-        rows = []
-        with _engine.connect() as conn:
-            res = conn.execute(q)
-            for r in res:
-                rows.append((r[0], r[1], r[2]))
-        tables: Dict[str, List[str]] = {}
-        for t, c, dt in rows:
-            tables.setdefault(t, []).append(f"- {c}: {dt}")
-        parts = []
-        for t, cols in tables.items():
-            parts.append(f"{t}:\n" + "\n".join(cols))
-        _schema_cache = "\n\n".join(parts) if parts else default_schema_hint()
-        return _schema_cache
-    except Exception:
-        _schema_cache = default_schema_hint()
-        return _schema_cache
-
-
-def default_schema_hint() -> str:
-    # Fallback minimal schema (kept in sync with admin_api models)
-    return (
-        "orders: id (int), order_no (text), created_at (timestamp), status (text), total (numeric), customer_id (int)\n"
-        "order_items: id (int), order_id (int), product_id (int), qty (int), price (numeric)\n"
-        "customers: id (int), email (text), city (text), zip (text)\n"
-        "products: id (int), sku (text), name (text), category (text), price (numeric), active (boolean)"
-    )
+async def get_db_schema() -> str:
+    """Full public schema description (tables, columns, FK joins); its
+    fingerprint keys the SQL cache. Prompts get `schema_context(question)`."""
+    return (await get_schema_catalog()).render()
 
 
-def extract_sql_with_error(question: str, err: str) -> str:
+async def extract_sql_with_error(question: str, err: str) -> str:
     prompt = (
         "Твой предыдущий SQL SELECT вызвал ошибку исполнения. Исправь запрос с учётом ошибки и схемы. "
         "Ограничения: только SELECT, без точки с запятой, без бэктиков."
     )
-    schema = get_db_schema()
-    resp = state.client.chat.completions.create(
+    schema = await schema_context(question)
+    resp = await state.client.chat.completions.create(
         model=os.getenv("CHAT_MODEL"),
         messages=[
             {"role": "system", "content": prompt},
@@ -1,29 +1,101 @@
 import os
 import time
+import asyncio
 import logging
+import weakref
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional, List
+from typing import Any, Callable, Optional, List, Iterable, Dict, TypeVar
 
-from openai import OpenAI
+from openai import AsyncOpenAI
 from redis import Redis
 from sentence_transformers import SentenceTransformer
 from langchain_community.vectorstores import FAISS
 
-from kits.kit_common import normalize_text
-from kits.kit_chunker import split_markdown, split_text
+from .docstore import DocStore, docstore_from_env
+from .sql_cache import SqlCache
+from .embed_cache import EmbeddingCache, binary_redis
+from .embed_batcher import EmbeddingBatcher, batcher_from_env
+from .manifest import (
+    load_manifest,
+    save_manifest,
+    new_manifest,
+    is_compatible,
+    scan_corpus,
+    diff_corpus,
+    chunk_id,
+)
+from .ingest import ingest, ingest_workers
+from .faiss_engine import FaissEngine, IndexSpec, backend, engine_dir, ensure_engine
+from .partitions import Partition, build_partitions
+from kits.kit_bm25 import BM25Index
+from kits.kit_context import load_encoder
 
 
 logger = logging.getLogger(__name__)
 
 
 class STEmbedding:
-    def __init__(self, model: str):
+    def __init__(self, model: str, cache: Optional[EmbeddingCache] = None, batcher: Optional[EmbeddingBatcher] = None):
+        self.model_name = model
         self.m = SentenceTransformer(model)
+        self.cache = cache
+        self.batcher = batcher
 
     def embed_documents(self, texts: List[str]):
         return self.m.encode(texts, normalize_embeddings=True).tolist()
 
     def embed_query(self, text: str):
+        if self.cache is None:
+            return self._encode_one(text)
+        norm = self.cache.normalize(text)
+        vec = self.cache.get(norm)
+        if vec is None:
+            vec = self._encode_one(norm)
+            self.cache.put(norm, vec)
+        return vec
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed several queries with one encoder call (or one batcher round) for all cache misses."""
+        norms, out = self._cached(texts)
+        missing = sorted({n for n, v in zip(norms, out) if v is None})
+        if missing:
+            if self.batcher is not None:
+                vecs = [f.result() for f in [self.batcher.submit(n) for n in missing]]
+            else:
+                vecs = self.m.encode(missing, normalize_embeddings=True).tolist()
+            self._fill(norms, out, dict(zip(missing, vecs)))
+        return out  # type: ignore[return-value]
+
+    async def aembed_queries(self, texts: List[str]) -> List[List[float]]:
+        """`embed_queries` for the event loop: cache misses wait on the batcher via
+        `aembed`, so concurrent chats share one encode without each holding a CPU worker."""
+        if self.batcher is None:
+            return await run_cpu(self.embed_queries, texts)
+        norms, out = await run_cpu(self._cached, texts)
+        missing = sorted({n for n, v in zip(norms, out) if v is None})
+        if missing:
+            vecs = await asyncio.gather(*(self.batcher.aembed(n) for n in missing))
+            await run_cpu(self._fill, norms, out, dict(zip(missing, vecs)))
+        return out  # type: ignore[return-value]
+
+    def _cached(self, texts: List[str]):
+        norms = [self.cache.normalize(t) if self.cache is not None else t for t in texts]
+        return norms, [self.cache.get(n) if self.cache is not None else None for n in norms]
+
+    def _fill(self, norms: List[str], out: List[Optional[List[float]]], encoded: Dict[str, List[float]]):
+        for i, n in enumerate(norms):
+            if out[i] is None:
+                out[i] = encoded[n]
+        if self.cache is not None:
+            for n, v in encoded.items():
+                self.cache.put(n, v)
+
+    def _encode_one(self, text: str) -> List[float]:
+        # concurrent callers are coalesced into one encode() when a batcher is configured
+        if self.batcher is not None:
+            return self.batcher.embed(text)
         return self.m.encode([text], normalize_embeddings=True)[0].tolist()
 
     # Some vectorstore constructors (older/newer variants) expect a callable
@@ -34,11 +106,17 @@ class STEmbedding:
 
 
 class AppState:
-    client: Optional[OpenAI] = None
+    client: Optional[AsyncOpenAI] = None
     redis: Optional[Redis] = None
     faiss: Optional[FAISS] = None
+    engine: Optional[FaissEngine] = None
+    bm25: Optional[BM25Index] = None
+    partitions: Dict[str, Partition] = {}
     embedder: Optional[STEmbedding] = None
+    docstore: Optional[DocStore] = None
+    sql_cache: Optional[SqlCache] = None
     faiss_ready: bool = False
+    index_version: str = "0"
     metrics: dict = {
         "tool_calls": 0,
         "db_queries": 0,
@@ -51,6 +129,36 @@ class AppState:
 state = AppState()
 
 
+T = TypeVar("T")
+
+_executor: Optional[ThreadPoolExecutor] = None
+# one semaphore per event loop (asyncio primitives are loop-bound)
+_cpu_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def cpu_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        workers = int(os.getenv("CPU_WORKERS", str(min(4, os.cpu_count() or 1))))
+        _executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="cpu")
+    return _executor
+
+
+async def run_cpu(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run CPU-bound work (embedding, FAISS search) off the event loop.
+
+    The pool is small and fixed; CPU_QUEUE_MAX bounds how many calls may be
+    queued on it at once so a burst of chats waits here instead of piling up
+    work the executor cannot drain.
+    """
+    loop = asyncio.get_running_loop()
+    slots = _cpu_slots.get(loop)
+    if slots is None:
+        slots = _cpu_slots[loop] = asyncio.Semaphore(int(os.getenv("CPU_QUEUE_MAX", "64")))
+    async with slots:
+        return await loop.run_in_executor(cpu_executor(), functools.partial(fn, *args, **kwargs))
+
+
 def init_clients():
     # Load .env from repo root if present (best-effort)
     try:
@@ -63,17 +171,39 @@ def init_clients():
     except Exception as e:
         logger.debug("dotenv not loaded: %s", e)
     # LLM client
-    state.client = OpenAI(
+    state.client = AsyncOpenAI(
         api_key=os.getenv("OPENAI_API_KEY"),
         base_url=os.getenv("OPENAI_BASE_URL"),
     )
+    # Prompt token budgets count with the chat model's tokenizer, loaded (maybe downloaded) here once
+    chat_model = os.getenv("CHAT_MODEL") or ""
+    if load_encoder(chat_model, os.getenv("CONTEXT_TOKENIZER") or None) is None:
+        logger.info("No tokenizer for %s; prompt token counts are estimates", chat_model or "default model")
     # Redis
     redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
     state.redis = Redis.from_url(redis_url, decode_responses=True)
 
     # Embeddings + FAISS
     embed_model = os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
-    state.embedder = STEmbedding(embed_model)
+    cache = None
+    if os.getenv("EMBED_CACHE", "true").lower() == "true":
+        cache = EmbeddingCache(
+            embed_model,
+            redis=binary_redis(state.redis),
+            max_items=int(os.getenv("EMBED_CACHE_SIZE", "4096")),
+            ttl=int(os.getenv("EMBED_CACHE_TTL_S", str(7 * 24 * 3600))),
+        )
+    state.embedder = STEmbedding(embed_model, cache=cache)
+    state.embedder.batcher = batcher_from_env(state.embedder.embed_documents)
+    state.docstore = docstore_from_env()
+    if os.getenv("SQL_CACHE", "true").lower() == "true":
+        similar = os.getenv("SQL_CACHE_SIMILARITY", "false").lower() == "true"
+        state.sql_cache = SqlCache(
+            binary_redis(state.redis),
+            ttl=int(os.getenv("SQL_CACHE_TTL_S", str(7 * 24 * 3600))),
+            embed=state.embedder.embed_query if similar else None,
+            min_similarity=float(os.getenv("SQL_CACHE_MIN_SIMILARITY", "0.92")),
+        )
 
     _ensure_faiss_index()
 
@@ -102,46 +232,192 @@ def _ensure_faiss_index():
             faq_dir = rel_faq
     Path(faiss_dir).mkdir(parents=True, exist_ok=True)
     logger.info("FAISS using faiss_dir=%s, faq_dir=%s", faiss_dir, faq_dir)
-    logger.info("FAISS using faiss_dir=%s, faq_dir=%s", faiss_dir, faq_dir)
+
+    force_rebuild = os.getenv("FAISS_FORCE_REBUILD", "false").lower() == "true"
+    params = _index_params()
+    manifest = load_manifest(faiss_dir)
+
+    # Direct engine fast path: corpus unchanged and engine built from the current index,
+    # so only the memory-mapped engine is opened (the langchain pickle is not loaded at all)
+    if backend() == "faiss" and not force_rebuild and is_compatible(manifest, params):
+        try:
+            spec = IndexSpec.from_env()
+            d = engine_dir(faiss_dir)
+            if diff_corpus(manifest["files"], scan_corpus(faq_dir)).empty and FaissEngine.is_current(d, spec, _index_file_version(faiss_dir)):
+                _activate(None, faiss_dir, engine=FaissEngine.load(d, spec, mmap=True))
+                logger.info("FAISS engine opened from %s", d)
+                return
+        except Exception as e:
+            logger.warning("FAISS engine open failed, falling back to full load: %s", e)
 
     try:
-        force_rebuild = os.getenv("FAISS_FORCE_REBUILD", "false").lower() == "true"
-        if (not force_rebuild) and any(Path(faiss_dir).iterdir()):
-            state.faiss = FAISS.load_local(faiss_dir, state.embedder, allow_dangerous_deserialization=True)
-            state.faiss_ready = True
+        if (Path(faiss_dir) / "index.faiss").exists() and (not force_rebuild or is_compatible(manifest, params)):
+            vs = FAISS.load_local(faiss_dir, state.embedder, allow_dangerous_deserialization=True)
+            if is_compatible(manifest, params):
+                # Re-embed only what changed since the manifest was written
+                _sync_index(vs, faiss_dir, faq_dir, manifest, verify_hash=force_rebuild)
+            else:
+                logger.info("FAISS index has no compatible manifest; set FAISS_FORCE_REBUILD=true to rebuild")
+            _activate(vs, faiss_dir)
             logger.info("FAISS index loaded from %s (force_rebuild=%s)", faiss_dir, force_rebuild)
             return
     except Exception as e:
         logger.warning("FAISS load failed, will rebuild: %s", e)
 
-    # Build index from scratch
-    texts = []
-    metadatas = []
-    max_tokens = int(os.getenv("CHUNK_MAX_TOKENS", "512"))
-    overlap = int(os.getenv("CHUNK_OVERLAP", "64"))
-
-    if faq_dir.exists():
-        for p in faq_dir.rglob("*"):
-            if not p.is_file():
-                continue
-            if p.suffix.lower() in {".md", ".txt"}:
-                raw = p.read_text(encoding="utf-8", errors="ignore")
-                clean = normalize_text(raw)
-                chunks = split_markdown(clean, max_tokens, overlap) if p.suffix.lower() == ".md" else split_text(clean, max_tokens, overlap)
-                for ch in chunks:
-                    texts.append(ch)
-                    metadatas.append({"filename": p.name, "path": str(p)})
-            # PDF support omitted for MVP; can be added with pypdf
-
-    if not texts:
+    # Build index from scratch, streaming chunks through the ingestion pipeline
+    logger.info("Building FAISS index from %s", faq_dir)
+    t0 = time.time()
+    holder: dict = {}
+
+    def sink(texts: List[str], metadatas: List[dict], ids: List[str]):
+        vectors = state.embedder.embed_documents(texts)
+        if "vs" not in holder:
+            holder["vs"] = FAISS.from_embeddings(list(zip(texts, vectors)), state.embedder, metadatas=metadatas, ids=ids)
+        else:
+            holder["vs"].add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=ids)
+
+    manifest = new_manifest(params)
+    # PDF support omitted for MVP; can be added with pypdf
+    entries, n_chunks = ingest(sorted(scan_corpus(faq_dir).items()), params, sink, chunk_id, **_ingest_opts())
+    manifest["files"].update(entries)
+
+    if "vs" not in holder:
         # ensure non-empty index
-        texts = ["Добро пожаловать в базу знаний Support Copilot."]
-        metadatas = [{"filename": "welcome.txt", "path": str(faq_dir / "welcome.txt")}]
+        sink(
+            ["Добро пожаловать в базу знаний Support Copilot."],
+            [{"filename": "welcome.txt", "path": str(faq_dir / "welcome.txt")}],
+            [WELCOME_ID],
+        )
+    vs = holder["vs"]
+    vs.save_local(faiss_dir)
+    save_manifest(faiss_dir, manifest)
+    _activate(vs, faiss_dir)
+    logger.info("FAISS built with %d chunks from %d files in %.2fs", n_chunks, len(entries), time.time() - t0)
+
+
+WELCOME_ID = "__welcome__"
+
+
+def _index_params() -> dict:
+    return {
+        "embed_model": os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2"),
+        "chunk_max_tokens": int(os.getenv("CHUNK_MAX_TOKENS", "512")),
+        "chunk_overlap": int(os.getenv("CHUNK_OVERLAP", "64")),
+    }
+
+
+def _ingest_opts() -> dict:
+    return {
+        "workers": ingest_workers(),
+        "batch_size": int(os.getenv("INGEST_BATCH_SIZE", "64")),
+        "queue_size": int(os.getenv("INGEST_QUEUE_SIZE", "4")),
+    }
+
+
+def _sync_index(vs: FAISS, faiss_dir: Path, faq_dir: Path, manifest: dict, verify_hash: bool = False) -> bool:
+    """Apply added/changed/removed corpus files to a loaded index. Returns True if the index changed."""
+    files = manifest["files"]
+    corpus = scan_corpus(faq_dir)
+    diff = diff_corpus(files, corpus, verify_hash=verify_hash)
+    files.update(diff.touched)
+    if diff.empty:
+        if diff.touched:
+            save_manifest(faiss_dir, manifest)
+        logger.info("FAISS index up to date (%d files)", len(files))
+        return False
 
-    logger.info("Building FAISS index with %d chunks", len(texts))
     t0 = time.time()
-    vs = FAISS.from_texts(texts=texts, embedding=state.embedder, metadatas=metadatas)
+    stale: List[str] = []
+    for rel in diff.removed + diff.changed:
+        stale.extend(files.pop(rel, {}).get("chunk_ids", []))
+    if corpus and WELCOME_ID in vs.index_to_docstore_id.values():
+        stale.append(WELCOME_ID)
+    if stale:
+        vs.delete(stale)
+
+    def sink(texts: List[str], metadatas: List[dict], ids: List[str]):
+        vs.add_embeddings(list(zip(texts, state.embedder.embed_documents(texts))), metadatas=metadatas, ids=ids)
+
+    todo = [(rel, corpus[rel]) for rel in diff.added + diff.changed]
+    entries, n_chunks = ingest(todo, manifest["params"], sink, chunk_id, **_ingest_opts())
+    files.update(entries)
+    if state.docstore is not None:
+        for rel in diff.removed:
+            state.docstore.discard(str(faq_dir / rel))
+        for _, p in todo:
+            state.docstore.put(str(p))
+
     vs.save_local(faiss_dir)
-    state.faiss = vs
+    save_manifest(faiss_dir, manifest)
+    logger.info(
+        "FAISS incremental update: +%d ~%d -%d files, %d stale vectors removed, %d chunks embedded in %.2fs",
+        len(diff.added), len(diff.changed), len(diff.removed), len(stale), n_chunks, time.time() - t0,
+    )
+    return True
+
+
+def _activate(vs: Optional[FAISS], faiss_dir: Path, engine: Optional[FaissEngine] = None):
+    """Publish the loaded index on `state`; with RAG_BACKEND=faiss the direct engine replaces the langchain store."""
+    _set_index_version(faiss_dir)
+    if engine is None and vs is not None and backend() == "faiss":
+        engine = ensure_engine(vs, faiss_dir, state.index_version)
+    state.engine = engine
+    state.faiss = vs if engine is None else None
+    state.bm25 = _ensure_bm25(vs, engine, faiss_dir) if os.getenv("RAG_HYBRID", "true").lower() == "true" else None
+    if engine is not None:
+        chunk_ids, metadatas = engine.ids, engine.metadatas
+    else:
+        chunk_ids = [vs.index_to_docstore_id[i] for i in range(vs.index.ntotal)]
+        metadatas = [vs.docstore.search(cid).metadata for cid in chunk_ids]
+    state.partitions = build_partitions(metadatas, state.bm25.ids if state.bm25 else None, chunk_ids)
     state.faiss_ready = True
-    logger.info("FAISS built in %.2fs", time.time() - t0)
+    _preload_docstore(m.get("path") for m in metadatas)
+
+
+def _ensure_bm25(vs: Optional[FAISS], engine: Optional[FaissEngine], faiss_dir: Path) -> Optional[BM25Index]:
+    """Load the BM25 index matching the current index version, rebuilding it from the chunks if stale."""
+    d = Path(faiss_dir) / "bm25"
+    try:
+        idx, meta = BM25Index.load(d)
+        if meta.get("source_version") == state.index_version:
+            return idx
+    except Exception:
+        pass
+    try:
+        if engine is not None:
+            docs = zip(engine.ids, engine.texts)
+        elif vs is not None:
+            docs = ((doc_id, vs.docstore.search(doc_id).page_content) for doc_id in vs.index_to_docstore_id.values())
+        else:
+            return None
+        t0 = time.time()
+        idx = BM25Index.build(docs)
+        idx.save(d, source_version=state.index_version)
+        logger.info("BM25 index built: %d chunks, %d terms in %.2fs", len(idx), len(idx.vocab), time.time() - t0)
+        return idx
+    except Exception as e:
+        logger.warning("BM25 index unavailable, dense retrieval only: %s", e)
+        return None
+
+
+def _preload_docstore(paths: Iterable[Optional[str]]):
+    """Warm the document store with every source file referenced by the index."""
+    if state.docstore is None:
+        return
+    n = state.docstore.preload({p for p in paths if p})
+    logger.info("DocStore preloaded %d documents (%d bytes)", n, state.docstore.nbytes)
+
+
+def _index_file_version(faiss_dir: Path) -> str:
+    try:
+        st = (Path(faiss_dir) / "index.faiss").stat()
+        return f"{st.st_mtime_ns:x}{st.st_size:x}"
+    except OSError:
+        return "0"
+
+
+def _set_index_version(faiss_dir: Path):
+    """Derive a version tag from the saved index file; embedding cache keys include it."""
+    state.index_version = _index_file_version(faiss_dir)
+    if state.embedder is not None and getattr(state.embedder, "cache", None) is not None:
+        state.embedder.cache.version = state.index_version
@@ -0,0 +1,160 @@
+import os
+import mmap
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Iterable
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Entry:
+    mtime_ns: int
+    size: int
+    sha256: str
+    text: Optional[str] = None
+    mm: Optional[mmap.mmap] = None
+    checked_at: float = 0.0
+
+    def read(self) -> str:
+        if self.text is not None:
+            return self.text
+        if self.mm is not None:
+            return self.mm[:].decode("utf-8", errors="ignore")
+        return ""
+
+    def close(self):
+        if self.mm is not None:
+            try:
+                self.mm.close()
+            except Exception:
+                pass
+            self.mm = None
+
+
+class DocStore:
+    """In-memory store of full source documents used to fill `content` in RAG sources.
+
+    Documents are loaded once at index time and served from memory afterwards.
+    Entries are keyed by path and revalidated by (mtime, size) at most once per
+    `check_interval` seconds; the content hash decides whether a changed stat
+    actually requires replacing the cached text. Memory is bounded by `max_bytes`
+    with LRU eviction. With `use_mmap` the text is not copied into the heap:
+    files are mapped read-only and decoded on access.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, check_interval: float = 30.0, use_mmap: bool = False):
+        self.max_bytes = max_bytes
+        self.check_interval = check_interval
+        self.use_mmap = use_mmap
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, path: str) -> bool:
+        return str(path) in self._entries
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def preload(self, paths: Iterable[str]) -> int:
+        n = 0
+        for p in paths:
+            if self.put(p) is not None:
+                n += 1
+        return n
+
+    def put(self, path: str, raw: Optional[bytes] = None) -> Optional[str]:
+        """Load (or reload) a document. `raw` may be passed when the caller already read the file."""
+        key = str(path)
+        try:
+            st = os.stat(key)
+        except OSError:
+            self.discard(key)
+            return None
+        with self._lock:
+            cur = self._entries.get(key)
+            if cur is not None and cur.mtime_ns == st.st_mtime_ns and cur.size == st.st_size:
+                cur.checked_at = time.monotonic()
+                self._entries.move_to_end(key)
+                return cur.read()
+        entry = self._load(key, st, raw)
+        if entry is None:
+            return None
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+                if old.sha256 == entry.sha256 and old.mm is None and entry.mm is None:
+                    # touched but unchanged: keep the already decoded text
+                    entry.text = old.text
+                old.close()
+            self._entries[key] = entry
+            self._bytes += entry.size
+            self._evict()
+            return entry.read()
+
+    def get(self, path: str) -> Optional[str]:
+        """Return cached document text; the filesystem is only touched on a miss or a due revalidation."""
+        key = str(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                if time.monotonic() - entry.checked_at < self.check_interval:
+                    return entry.read()
+        return self.put(key)
+
+    def discard(self, path: str):
+        with self._lock:
+            old = self._entries.pop(str(path), None)
+            if old is not None:
+                self._bytes -= old.size
+                old.close()
+
+    def clear(self):
+        with self._lock:
+            for e in self._entries.values():
+                e.close()
+            self._entries.clear()
+            self._bytes = 0
+
+    def _load(self, key: str, st: os.stat_result, raw: Optional[bytes]) -> Optional[_Entry]:
+        try:
+            if self.use_mmap and raw is None and st.st_size > 0:
+                with open(key, "rb") as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                digest = hashlib.sha256(mm).hexdigest()
+                return _Entry(st.st_mtime_ns, st.st_size, digest, mm=mm, checked_at=time.monotonic())
+            data = raw if raw is not None else Path(key).read_bytes()
+            digest = hashlib.sha256(data).hexdigest()
+            text = data.decode("utf-8", errors="ignore")
+            return _Entry(st.st_mtime_ns, st.st_size, digest, text=text, checked_at=time.monotonic())
+        except Exception as e:
+            logger.debug("DocStore failed to load %s: %s", key, e)
+            return None
+
+    def _evict(self):
+        # keep at least the most recent entry even if it alone exceeds the budget
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, old = self._entries.popitem(last=False)
+            self._bytes -= old.size
+            old.close()
+
+
+def docstore_from_env() -> DocStore:
+    return DocStore(
+        max_bytes=int(os.getenv("DOCSTORE_MAX_MB", "64")) * 1024 * 1024,
+        check_interval=float(os.getenv("DOCSTORE_CHECK_INTERVAL_S", "30")),
+        use_mmap=os.getenv("DOCSTORE_MMAP", "false").lower() == "true",
+    )
@@ -0,0 +1,109 @@
+import os
+import time
+import queue
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Callable, List, Sequence
+
+
+logger = logging.getLogger(__name__)
+
+EncodeFn = Callable[[List[str]], Sequence[Sequence[float]]]
+
+
+class EmbeddingBatcher:
+    """Coalesces concurrent single-query encodes into one batched encoder call.
+
+    Callers (request threads or the event loop via `aembed`) enqueue a text and
+    wait on a future. A single worker thread takes the first pending item, then
+    keeps collecting until `window_ms` elapses or `max_batch` items are queued,
+    and encodes the whole batch at once.
+    """
+
+    def __init__(self, encode: EncodeFn, window_ms: float = 5.0, max_batch: int = 32):
+        self.encode = encode
+        self.window = max(0.0, window_ms) / 1000.0
+        self.max_batch = max(1, max_batch)
+        self._q: "queue.Queue[tuple[str, Future]]" = queue.Queue()
+        self._closed = False
+        self.batches = 0
+        self.items = 0
+        self._worker = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, text: str) -> Future:
+        if self._closed:
+            raise RuntimeError("EmbeddingBatcher is closed")
+        fut: Future = Future()
+        self._q.put((text, fut))
+        return fut
+
+    def embed(self, text: str) -> List[float]:
+        return self.submit(text).result()
+
+    async def aembed(self, text: str) -> List[float]:
+        return await asyncio.wrap_future(self.submit(text))
+
+    def close(self):
+        self._closed = True
+        self._q.put(None)  # type: ignore[arg-type]
+        self._worker.join(timeout=5)
+
+    def stats(self) -> dict:
+        return {
+            "embed_batches": self.batches,
+            "embed_batch_avg": round(self.items / self.batches, 2) if self.batches else 0.0,
+        }
+
+    def _collect(self, first) -> list:
+        batch = [first]
+        deadline = None
+        while len(batch) < self.max_batch:
+            try:
+                if self.window <= 0:
+                    item = self._q.get_nowait()
+                else:
+                    if deadline is None:
+                        deadline = time.monotonic() + self.window
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    item = self._q.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self._q.put(None)  # re-post shutdown marker for the outer loop
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._q.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            live = [(t, f) for t, f in batch if f.set_running_or_notify_cancel()]
+            if not live:
+                continue
+            try:
+                vecs = self.encode([t for t, _ in live])
+                if len(vecs) != len(live):
+                    raise ValueError(f"encoder returned {len(vecs)} vectors for {len(live)} texts")
+                for (_, f), v in zip(live, vecs):
+                    f.set_result(list(v))
+            except Exception as e:
+                logger.warning("Embedding batch of %d failed: %s", len(live), e)
+                for _, f in live:
+                    f.set_exception(e)
+            self.batches += 1
+            self.items += len(live)
+
+
+def batcher_from_env(encode: EncodeFn) -> "EmbeddingBatcher | None":
+    window_ms = float(os.getenv("EMBED_BATCH_WINDOW_MS", "0"))
+    if window_ms <= 0:
+        return None
+    return EmbeddingBatcher(encode, window_ms=window_ms, max_batch=int(os.getenv("EMBED_BATCH_MAX", "32")))
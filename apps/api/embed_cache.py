@@ -0,0 +1,119 @@
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, List
+
+import numpy as np
+from redis import Redis, ConnectionPool
+
+from kits.kit_common import normalize_text
+
+
+logger = logging.getLogger(__name__)
+
+
+def binary_redis(r: Optional[Redis]) -> Optional[Redis]:
+    """Clone a (decode_responses=True) client into one that returns raw bytes, sharing its settings."""
+    if r is None:
+        return None
+    pool = r.connection_pool
+    kwargs = dict(pool.connection_kwargs)
+    kwargs["decode_responses"] = False
+    return Redis(connection_pool=ConnectionPool(connection_class=pool.connection_class, **kwargs))
+
+
+class EmbeddingCache:
+    """Two-tier cache of query embeddings: process-local LRU in front of Redis.
+
+    Keys are built from the model name, the index version and a hash of the
+    normalized query text. Redis values are float16 vectors (2 bytes per dim).
+    A Redis error disables the remote tier for `redis_backoff` seconds so a
+    missing Redis never slows down the request path.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        redis: Optional[Redis] = None,
+        max_items: int = 4096,
+        ttl: int = 7 * 24 * 3600,
+        version: str = "0",
+        redis_backoff: float = 30.0,
+    ):
+        self.model = model
+        self.redis = redis
+        self.max_items = max_items
+        self.ttl = ttl
+        self.version = version
+        self.redis_backoff = redis_backoff
+        self._lru: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._redis_off_until = 0.0
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return normalize_text(text or "")
+
+    def key(self, norm_text: str) -> str:
+        h = hashlib.sha1(norm_text.encode("utf-8")).hexdigest()
+        return f"emb:{self.model}:{self.version}:{h}"
+
+    def get(self, norm_text: str) -> Optional[List[float]]:
+        k = self.key(norm_text)
+        with self._lock:
+            vec = self._lru.get(k)
+            if vec is not None:
+                self._lru.move_to_end(k)
+                self.hits += 1
+                return vec
+        raw = self._redis_call("get", k)
+        if raw:
+            vec = np.frombuffer(raw, dtype=np.float16).astype(np.float32).tolist()
+            self._remember(k, vec)
+            with self._lock:
+                self.redis_hits += 1
+            return vec
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, norm_text: str, vec: List[float]):
+        k = self.key(norm_text)
+        self._remember(k, vec)
+        self._redis_call("setex", k, self.ttl, np.asarray(vec, dtype=np.float16).tobytes())
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.redis_hits + self.misses
+        return {
+            "embed_cache_hits": self.hits,
+            "embed_cache_redis_hits": self.redis_hits,
+            "embed_cache_misses": self.misses,
+            "embed_cache_hit_rate": round((self.hits + self.redis_hits) / total, 4) if total else 0.0,
+            "embed_cache_size": len(self._lru),
+        }
+
+    def _remember(self, k: str, vec: List[float]):
+        with self._lock:
+            self._lru[k] = vec
+            self._lru.move_to_end(k)
+            while len(self._lru) > self.max_items:
+                self._lru.popitem(last=False)
+
+    def _redis_call(self, op: str, *args):
+        if self.redis is None or time.monotonic() < self._redis_off_until:
+            return None
+        try:
+            return getattr(self.redis, op)(*args)
+        except Exception as e:
+            logger.debug("Embedding cache: redis %s failed, backing off: %s", op, e)
+            self._redis_off_until = time.monotonic() + self.redis_backoff
+            return None
@@ -0,0 +1,386 @@
+"""Direct FAISS retrieval backend.
+
+Vectors are searched with a native faiss index (no langchain wrapper, no
+pickle). Supported index types:
+
+    flat      exact inner product (IDMap2,Flat; PQ codes as a single IVF list)
+    hnsw      graph index, tuned with efSearch
+    ivf_flat  inverted lists over full vectors, tuned with nprobe
+    ivf_pq    inverted lists over product-quantized codes, tuned with nprobe
+
+Vectors can be stored compressed (FAISS_CODEC=int8 scalar quantization or
+pq product-quantized codes) and reduced in dimension beforehand
+(FAISS_DIM_REDUCTION=pca, or truncate for Matryoshka-style prefixes). Any
+lossy build is measured against an exact float32 search; the recall@k and
+memory ratio are logged and kept in the engine metadata.
+
+The index is opened read-only with IO_FLAG_MMAP. faiss maps only the
+inverted lists of IVF indexes, so for ivf_flat/ivf_pq the bulk of the codes
+stays in the shared page cache; flat and HNSW indexes, as well as the chunk
+texts and metadata from the JSON file, are still read into each process's heap.
+Embeddings are L2-normalized, so inner product equals cosine similarity.
+"""
+import os
+import json
+import math
+import logging
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "engine.faiss"
+META_FILE = "engine_meta.json"
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+CODECS = ("float32", "int8", "pq")
+DIM_REDUCTIONS = ("none", "pca", "truncate")
+
+
+@dataclass
+class IndexSpec:
+    kind: str = "flat"
+    hnsw_m: int = 32
+    ef_construction: int = 200
+    ef_search: int = 64
+    nlist: int = 0  # 0 = derive from corpus size
+    nprobe: int = 8
+    pq_m: int = 16
+    pq_nbits: int = 8
+    codec: str = "float32"
+    dim_reduction: str = "none"
+    target_dim: int = 0
+
+    def __post_init__(self):
+        if self.kind not in INDEX_TYPES:
+            raise ValueError(f"Unknown FAISS index type: {self.kind} (expected one of {', '.join(INDEX_TYPES)})")
+        if self.codec not in CODECS:
+            raise ValueError(f"Unknown FAISS codec: {self.codec} (expected one of {', '.join(CODECS)})")
+        if self.dim_reduction not in DIM_REDUCTIONS:
+            raise ValueError(f"Unknown dimensionality reduction: {self.dim_reduction} (expected one of {', '.join(DIM_REDUCTIONS)})")
+
+    @property
+    def lossy(self) -> bool:
+        return self.kind == "ivf_pq" or self.codec != "float32" or (self.dim_reduction != "none" and self.target_dim > 0)
+
+    def truncate_dim(self, dim: int) -> int:
+        """Prefix length kept by Matryoshka-style truncation (0 = keep all)."""
+        if self.dim_reduction == "truncate" and 0 < self.target_dim < dim:
+            return self.target_dim
+        return 0
+
+    @classmethod
+    def from_env(cls) -> "IndexSpec":
+        return cls(
+            kind=os.getenv("FAISS_INDEX_TYPE", "flat").lower(),
+            hnsw_m=int(os.getenv("FAISS_HNSW_M", "32")),
+            ef_construction=int(os.getenv("FAISS_EF_CONSTRUCTION", "200")),
+            ef_search=int(os.getenv("FAISS_EF_SEARCH", "64")),
+            nlist=int(os.getenv("FAISS_NLIST", "0")),
+            nprobe=int(os.getenv("FAISS_NPROBE", "8")),
+            pq_m=int(os.getenv("FAISS_PQ_M", "16")),
+            pq_nbits=int(os.getenv("FAISS_PQ_NBITS", "8")),
+            codec=os.getenv("FAISS_CODEC", "float32").lower(),
+            dim_reduction=os.getenv("FAISS_DIM_REDUCTION", "none").lower(),
+            target_dim=int(os.getenv("FAISS_TARGET_DIM", "0")),
+        )
+
+    def build_params(self) -> dict:
+        """Parameters that change the stored index (search-time knobs excluded)."""
+        d = asdict(self)
+        d.pop("ef_search")
+        d.pop("nprobe")
+        return d
+
+    def factory(self, dim: int, n: int) -> str:
+        """faiss.index_factory description, adapted to small corpora.
+
+        `dim` is the dimension after truncation; PCA is expressed in the
+        factory string as a trained pre-transform followed by renormalization.
+        """
+        prefix = ""
+        if self.dim_reduction == "pca" and 0 < self.target_dim < dim and n > self.target_dim:
+            prefix = f"PCA{self.target_dim},L2norm,"
+            dim = self.target_dim
+        codec = "pq" if self.kind == "ivf_pq" else self.codec
+        if codec == "pq" and n < 2:
+            codec = "float32"
+        nbits = max(1, min(self.pq_nbits, int(math.log2(max(n, 2)))))
+        m = _largest_divisor_at_most(dim, self.pq_m)
+        if self.kind == "hnsw":
+            if codec == "pq" and n < 256:
+                codec = "int8"  # HNSW-PQ always uses 8-bit codebooks (256 training points)
+            suffix = {"float32": "", "int8": ",SQ8", "pq": f",PQ{m}"}[codec]
+            return f"IDMap2,{prefix}HNSW{self.hnsw_m}{suffix}"
+        body = {"float32": "Flat", "int8": "SQ8", "pq": f"PQ{m}x{nbits}"}[codec]
+        if self.kind in ("ivf_flat", "ivf_pq") and n >= 2:
+            # faiss wants ~39 training points per centroid
+            nlist = self.nlist or int(4 * math.sqrt(n))
+            nlist = max(1, min(nlist, n // 39 or 1))
+            return f"{prefix}IVF{nlist},{body}"
+        if codec == "pq":
+            # IndexPQ rejects ID selectors (partition filters); a single inverted
+            # list scans the same codes exhaustively and supports them
+            return f"{prefix}IVF1,{body}"
+        return f"IDMap2,{prefix}{body}"
+
+
+def _largest_divisor_at_most(n: int, cap: int) -> int:
+    for m in range(min(cap, n), 0, -1):
+        if n % m == 0:
+            return m
+    return 1
+
+
+def _truncate(x: np.ndarray, dim: int) -> np.ndarray:
+    """Keep the first `dim` components and renormalize (Matryoshka-style prefix)."""
+    if not dim:
+        return x
+    x = np.ascontiguousarray(x[:, :dim])
+    faiss.normalize_L2(x)
+    return x
+
+
+def _find_hnsw(index: "faiss.Index"):
+    """Unwrap IDMap / pre-transform layers down to the HNSW index, if any."""
+    idx = faiss.downcast_index(index)
+    while idx is not None:
+        if hasattr(idx, "hnsw"):
+            return idx
+        inner = getattr(idx, "index", None)
+        idx = faiss.downcast_index(inner) if inner is not None else None
+    return None
+
+
+class FaissEngine:
+    def __init__(self, index: "faiss.Index", texts: List[str], metadatas: List[dict], ids: List[str], spec: IndexSpec,
+                 source_version: str = "", truncate: int = 0, report: Optional[dict] = None):
+        self.index = index
+        self.texts = texts
+        self.metadatas = metadatas
+        self.ids = ids
+        self.spec = spec
+        self.source_version = source_version
+        self.truncate = truncate
+        self.report = report or {}
+        self._pos = {doc_id: i for i, doc_id in enumerate(ids)}
+        self.apply_search_params()
+
+    @property
+    def ntotal(self) -> int:
+        return int(self.index.ntotal)
+
+    def apply_search_params(self):
+        ps = faiss.ParameterSpace()
+        if self.spec.kind == "hnsw":
+            ps.set_index_parameter(self.index, "efSearch", self.spec.ef_search)
+        elif self.spec.kind in ("ivf_flat", "ivf_pq") and _is_ivf(self.index):
+            ps.set_index_parameter(self.index, "nprobe", self.spec.nprobe)
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, texts: List[str], metadatas: List[dict], ids: List[str], spec: IndexSpec, source_version: str = "") -> "FaissEngine":
+        full = np.ascontiguousarray(vectors, dtype=np.float32)
+        n, dim = full.shape
+        truncate = spec.truncate_dim(dim)
+        x = _truncate(full, truncate)
+        desc = spec.factory(x.shape[1], n)
+        index = faiss.index_factory(x.shape[1], desc, faiss.METRIC_INNER_PRODUCT)
+        hnsw = _find_hnsw(index)
+        if hnsw is not None:
+            hnsw.hnsw.efConstruction = spec.ef_construction
+        if not index.is_trained:
+            index.train(x)
+        index.add_with_ids(x, np.arange(n, dtype=np.int64))
+        engine = cls(index, list(texts), list(metadatas), list(ids), spec, source_version, truncate)
+        if spec.lossy and n:
+            engine.report = evaluate_recall(engine, full)
+            logger.info(
+                "FAISS engine %s: recall@%d=%.3f vs float32, %d -> %d bytes (%.1fx smaller)",
+                desc, engine.report["k"], engine.report["recall"], engine.report["bytes_float32"],
+                engine.report["bytes"], engine.report["compression"],
+            )
+        logger.info("FAISS engine built: %s, %d vectors of dim %d", desc, n, dim)
+        return engine
+
+    @property
+    def nbytes(self) -> int:
+        return int(faiss.serialize_index(self.index).nbytes)
+
+    def save(self, directory: Path):
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        tmp = directory / (INDEX_FILE + ".tmp")
+        faiss.write_index(self.index, str(tmp))
+        os.replace(tmp, directory / INDEX_FILE)
+        meta = {
+            "source_version": self.source_version,
+            "spec": self.spec.build_params(),
+            "ids": self.ids,
+            "texts": self.texts,
+            "metadatas": self.metadatas,
+            "truncate": self.truncate,
+            "report": self.report,
+        }
+        tmp = directory / (META_FILE + ".tmp")
+        tmp.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, directory / META_FILE)
+
+    @classmethod
+    def load(cls, directory: Path, spec: IndexSpec, mmap: bool = True) -> "FaissEngine":
+        """Open a saved engine; `mmap` maps IVF inverted lists only (see module docstring)."""
+        directory = Path(directory)
+        meta = json.loads((directory / META_FILE).read_text(encoding="utf-8"))
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if mmap else 0
+        index = faiss.read_index(str(directory / INDEX_FILE), flags)
+        return cls(index, meta["texts"], meta["metadatas"], meta["ids"], spec, meta.get("source_version", ""),
+                   meta.get("truncate", 0), meta.get("report"))
+
+    @staticmethod
+    def is_current(directory: Path, spec: IndexSpec, source_version: str) -> bool:
+        """True if a saved engine was built from `source_version` with the same build parameters."""
+        try:
+            meta_path = Path(directory) / META_FILE
+            if not (Path(directory) / INDEX_FILE).exists():
+                return False
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except Exception:
+            return False
+        return meta.get("source_version") == source_version and meta.get("spec") == spec.build_params()
+
+    def get(self, doc_id: str) -> Optional[Tuple[str, dict]]:
+        i = self._pos.get(doc_id)
+        return None if i is None else (self.texts[i], self.metadatas[i])
+
+    def search_params(self, selector: Optional["faiss.IDSelector"] = None):
+        """Per-call search parameters carrying an ID-selector prefilter and the tuned knobs."""
+        if selector is None:
+            return None
+        if self.spec.kind == "hnsw":
+            params = faiss.SearchParametersHNSW()
+            params.efSearch = self.spec.ef_search
+        elif _is_ivf(self.index):
+            params = faiss.SearchParametersIVF()
+            params.nprobe = self.spec.nprobe
+        else:
+            params = faiss.SearchParameters()
+        params.sel = selector
+        return params
+
+    def search(self, query_vectors: Sequence[Sequence[float]], k: int, selector: Optional["faiss.IDSelector"] = None, limit: Optional[int] = None) -> List[List[Tuple[str, str, dict, float]]]:
+        """Batched search. Returns per query a list of (chunk_id, text, metadata, l2_distance).
+
+        `selector` restricts the search to a subset of positions (a partition);
+        `limit` is the size of that subset.
+
+        Inner products are converted to the squared L2 distance between unit
+        vectors (2 - 2*cos) so scores stay comparable with the langchain backend.
+        """
+        q = np.ascontiguousarray(query_vectors, dtype=np.float32)
+        if q.ndim == 1:
+            q = q[None, :]
+        q = _truncate(q, self.truncate)
+        k = max(1, min(k, self.ntotal if limit is None else limit))
+        try:
+            sims, labels = self.index.search(q, k, params=self.search_params(selector))
+        except RuntimeError:
+            if selector is None:
+                raise
+            # an index that does not take search params (flat PQ saved as IDMap2,PQ)
+            sims, labels = self._search_post_filtered(q, k, selector, limit)
+        out: List[List[Tuple[str, str, dict, float]]] = []
+        for row_s, row_l in zip(sims, labels):
+            hits = []
+            for s, i in zip(row_s, row_l):
+                if i < 0:
+                    continue
+                hits.append((self.ids[i], self.texts[i], self.metadatas[i], float(2.0 - 2.0 * s)))
+            out.append(hits)
+        return out
+
+
+    def _search_post_filtered(self, q: np.ndarray, k: int, selector: "faiss.IDSelector", limit: Optional[int]):
+        """Over-fetch without the selector and keep the first `k` members per query."""
+        share = max(1, limit or self.ntotal) / max(1, self.ntotal)
+        fetch = min(self.ntotal, max(k, int(math.ceil(2 * k / share))))
+        sims, labels = self.index.search(q, fetch)
+        out_s = np.full((len(q), k), -np.inf, dtype=np.float32)
+        out_l = np.full((len(q), k), -1, dtype=np.int64)
+        for r, (row_s, row_l) in enumerate(zip(sims, labels)):
+            keep = [j for j, i in enumerate(row_l) if i >= 0 and selector.is_member(int(i))][:k]
+            out_s[r, : len(keep)] = row_s[keep]
+            out_l[r, : len(keep)] = row_l[keep]
+        return out_s, out_l
+
+
+def evaluate_recall(engine: FaissEngine, vectors: np.ndarray, k: int = 10, n_queries: int = 200, seed: int = 0) -> dict:
+    """recall@k of `engine` against exact float32 inner-product search over the same vectors.
+
+    Queries are corpus vectors with a little gaussian noise, renormalized,
+    which approximates real questions landing near their answer chunks.
+    """
+    x = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, dim = x.shape
+    k = max(1, min(k, n))
+    rng = np.random.default_rng(seed)
+    q = x[rng.choice(n, size=min(n_queries, n), replace=False)] + rng.normal(scale=0.05, size=(min(n_queries, n), dim)).astype(np.float32)
+    faiss.normalize_L2(q)
+    exact = faiss.IndexFlatIP(dim)
+    exact.add(x)
+    _, truth = exact.search(q, k)
+    _, got = engine.index.search(_truncate(q, engine.truncate), k)
+    hits = sum(len(set(t[t >= 0]) & set(g[g >= 0])) for t, g in zip(truth, got))
+    bytes_f32 = int(faiss.serialize_index(exact).nbytes)
+    nbytes = engine.nbytes
+    return {
+        "k": k,
+        "recall": hits / float(k * len(q)),
+        "bytes_float32": bytes_f32,
+        "bytes": nbytes,
+        "compression": bytes_f32 / max(1, nbytes),
+    }
+
+
+def _is_ivf(index: "faiss.Index") -> bool:
+    try:
+        return faiss.extract_index_ivf(index) is not None
+    except Exception:
+        return False
+
+
+def export_langchain(vs) -> Tuple[np.ndarray, List[str], List[dict], List[str]]:
+    """Pull vectors, texts, metadatas and chunk ids out of a langchain FAISS store."""
+    n = vs.index.ntotal
+    vectors = vs.index.reconstruct_n(0, n) if n else np.zeros((0, vs.index.d), dtype=np.float32)
+    texts: List[str] = []
+    metadatas: List[dict] = []
+    ids: List[str] = []
+    for pos in range(n):
+        doc_id = vs.index_to_docstore_id[pos]
+        doc = vs.docstore.search(doc_id)
+        texts.append(doc.page_content)
+        metadatas.append(dict(doc.metadata))
+        ids.append(doc_id)
+    return vectors, texts, metadatas, ids
+
+
+def engine_dir(faiss_dir: Path) -> Path:
+    return Path(faiss_dir) / "engine"
+
+
+def backend() -> str:
+    return os.getenv("RAG_BACKEND", "langchain").lower()
+
+
+def ensure_engine(vs, faiss_dir: Path, source_version: str, spec: Optional[IndexSpec] = None) -> FaissEngine:
+    """Build (if stale) and open the engine for an index version (IVF lists memory-mapped)."""
+    spec = spec or IndexSpec.from_env()
+    d = engine_dir(faiss_dir)
+    if not FaissEngine.is_current(d, spec, source_version):
+        vectors, texts, metadatas, ids = export_langchain(vs)
+        FaissEngine.build(vectors, texts, metadatas, ids, spec, source_version).save(d)
+    return FaissEngine.load(d, spec, mmap=True)
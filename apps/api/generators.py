@@ -2,10 +2,12 @@ import os
 import json
 from typing import AsyncGenerator, Optional, List, Dict, Any
 
-from openai import OpenAI
+from openai import AsyncOpenAI
 from sse_starlette.sse import EventSourceResponse
+from starlette.background import BackgroundTask
 
 from .deps import state
+from .context import pack_sources, tool_content
 
 
 def system_prompt(mode: str, strict: bool) -> str:
@@ -21,13 +23,12 @@ def system_prompt(mode: str, strict: bool) -> str:
 
 def build_user_prompt(question: str, context_sources: list[dict], tool_block: Optional[dict] = None) -> str:
     ctx = []
-    for s in context_sources[:5]:
-        sid = s.get('id', '')
-        ctx.append(f"[{sid}] {s.get('filename','')}: {s.get('snippet','')}")
+    for s in pack_sources(context_sources):
+        ctx.append(f"[{s['id']}] {s['filename']}: {s['text']}")
     ctx_block = "\n".join(ctx)
     tb = ""
     if tool_block:
-        tb = f"\n\nИнструменты: {json.dumps(tool_block, ensure_ascii=False, default=str)}"
+        tb = f"\n\nИнструменты: {tool_content(tool_block)}"
     return f"Вопрос: {question}\n\nКонтекст:\n---\n{ctx_block}\n---{tb}"
 
 
@@ -39,15 +40,37 @@ def _public_tool_info(tool_info: Optional[Dict[str, Any]]) -> Optional[Dict[str,
     return {"name": name, "sql": sql}
 
 
+def public_sources(sources: list[dict], include_content: bool = True) -> list[dict]:
+    """Sources as sent to clients: the prompt-only `chunk` (and optionally the full `content`) removed."""
+    drop = {"chunk"} if include_content else {"chunk", "content"}
+    return [{k: v for k, v in s.items() if k not in drop} for s in sources]
+
+
+def context_event(sources: list[dict], labels: Optional[List[str]], tool_info: Optional[dict]) -> dict:
+    return {"event": "context", "data": json.dumps({
+        "sources": public_sources(sources),
+        "labels": labels or [],
+        "tool_info": _public_tool_info(tool_info) or {},
+    }, ensure_ascii=False, default=str)}
+
+
+def token_event(text: str) -> dict:
+    return {"event": "token", "data": json.dumps({"t": text}, ensure_ascii=False, default=str)}
+
+
+def done_event(finish_reason: str = "stop") -> dict:
+    return {"event": "done", "data": json.dumps({"finish_reason": finish_reason}, ensure_ascii=False, default=str)}
+
+
 def _llm_enabled() -> bool:
     return bool(state.client) and bool(os.getenv("OPENAI_API_KEY")) and bool(os.getenv("CHAT_MODEL"))
 
 
-def llm_answer(question: str, context_sources: list[dict], tool_info: Optional[dict] = None) -> str:
+async def llm_answer(question: str, context_sources: list[dict], tool_info: Optional[dict] = None) -> str:
     if not _llm_enabled():
         return "Режим офлайн: LLM недоступен. Проверьте настройки OpenAI."
-    client: OpenAI = state.client
-    resp = client.chat.completions.create(
+    client: AsyncOpenAI = state.client
+    resp = await client.chat.completions.create(
         model=os.getenv("CHAT_MODEL"),
         messages=[
             {"role": "system", "content": system_prompt("faq", False)},
@@ -59,61 +82,49 @@ def llm_answer(question: str, context_sources: list[dict], tool_info: Optional[d
 
 
 async def llm_stream_answer(question: str, context_sources: list[dict], tool_info: Optional[dict] = None, labels: Optional[List[str]] = None) -> AsyncGenerator[dict, None]:
-    client: OpenAI = state.client
+    client: AsyncOpenAI = state.client
     # send context first
-    context_event = {"event": "context", "data": json.dumps({
-        "sources": context_sources,
-        "labels": labels or [],
-        "tool_info": _public_tool_info(tool_info) or {},
-    }, ensure_ascii=False, default=str)}
-    yield context_event
+    yield context_event(context_sources, labels, tool_info)
 
     if not _llm_enabled():
         # Fallback: emit a short stub answer token-by-token
         stub = "Режим офлайн: LLM недоступен."
         for ch in stub:
-            token_event = {"event": "token", "data": json.dumps({"t": ch}, ensure_ascii=False, default=str)}
-            yield token_event
-        done_event = {"event": "done", "data": json.dumps({"finish_reason": "stop"}, ensure_ascii=False, default=str)}
-        yield done_event
+            yield token_event(ch)
+        yield done_event()
         return
 
+    # A plain streamed completion: tokens arrive one chunk each, and the
+    # underlying HTTP response can be closed to abort generation upstream.
+    stream = None
+    finished = False
     try:
-        with client.chat.completions.stream(
+        stream = await client.chat.completions.create(
             model=os.getenv("CHAT_MODEL"),
             messages=[
                 {"role": "system", "content": system_prompt("faq", False)},
                 {"role": "user", "content": build_user_prompt(question, context_sources, tool_info)},
             ],
             temperature=0.2,
-        ) as stream:
-            last_delta = None
-            for chunk in stream:
-                delta = None
-                try:
-                    if hasattr(chunk, 'choices') and chunk.choices:
-                        delta = chunk.choices[0].delta.content
-                    elif hasattr(chunk, 'content'):
-                        delta = chunk.content
-                    elif hasattr(chunk, 'delta') and hasattr(chunk.delta, 'content'):
-                        delta = chunk.delta.content
-                    elif hasattr(chunk, 'type') and chunk.type == 'content.delta':
-                        delta = getattr(chunk, 'delta', None)
-                    elif hasattr(chunk, 'type') and chunk.type == 'chunk':
-                        if hasattr(chunk, 'chunk') and hasattr(chunk.chunk, 'choices'):
-                            delta = chunk.chunk.choices[0].delta.content
-                except Exception:
-                    delta = None
-
-                if delta and delta != last_delta:
-                    token_event = {"event": "token", "data": json.dumps({"t": delta}, ensure_ascii=False, default=str)}
-                    yield token_event
-                    last_delta = delta
-            done_event = {"event": "done", "data": json.dumps({"finish_reason": "stop"}, ensure_ascii=False, default=str)}
-            yield done_event
+            stream=True,
+        )
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                yield token_event(delta)
+        finished = True
+        yield done_event()
     except Exception as e:
+        finished = True
         error_event = {"event": "error", "data": json.dumps({"message": str(e)}, default=str)}
         yield error_event
+    finally:
+        # Reached on client disconnect too (task cancellation or aclose()):
+        # closing the response stops the LLM from generating further tokens.
+        if not finished:
+            state.metrics["streams_cancelled"] = state.metrics.get("streams_cancelled", 0) + 1
+        if stream is not None:
+            await stream.close()
 
 
 def sse_from_generator(gen: AsyncGenerator[dict, None]) -> EventSourceResponse:
@@ -123,6 +134,13 @@ def sse_from_generator(gen: AsyncGenerator[dict, None]) -> EventSourceResponse:
                 yield ev
         except Exception as e:
             yield {"event": "error", "data": json.dumps({"message": str(e)}, default=str)}
-    return EventSourceResponse(event_gen())
+        finally:
+            await gen.aclose()
+
+    events = event_gen()
+    # On disconnect the response task group is cancelled while `events` may be
+    # parked at a yield; the background task runs afterwards and closes it, so
+    # the upstream completion is released instead of waiting for GC.
+    return EventSourceResponse(events, background=BackgroundTask(events.aclose))
 
 
@@ -0,0 +1,185 @@
+"""Staged ingestion pipeline for the FAQ corpus.
+
+    files ──► process pool (read / normalize / chunk) ──► bounded queue ──►
+    batches of chunks ──► sink (embed + incremental index add)
+
+The module only depends on the standard library and `kits` so worker
+processes start quickly; embedding and the vector store live in the sink
+supplied by the caller. At most `workers * 2` files are in flight and at most
+`queue_size` chunk batches are buffered, so memory stays flat regardless of
+corpus size.
+"""
+import os
+import queue
+import hashlib
+import logging
+import threading
+import multiprocessing as mp
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from kits.kit_common import normalize_text
+from kits.kit_chunker import split_markdown, split_text
+
+
+logger = logging.getLogger(__name__)
+
+# (corpus-relative path, absolute path, manifest entry without chunk_ids, chunks)
+Prepared = Tuple[str, str, dict, List[str]]
+# (texts, metadatas, ids, manifest entries of files completed by this batch)
+Batch = Tuple[List[str], List[dict], List[str], Dict[str, dict]]
+Sink = Callable[[List[str], List[dict], List[str]], None]
+
+
+DEFAULT_PARTITION = "faq"
+
+
+def split_front_matter(text: str) -> Tuple[Dict[str, str], str]:
+    """Parse a leading `---` block of `key: value` lines; returns (fields, remaining text)."""
+    if not text.startswith("---"):
+        return {}, text
+    lines = text.splitlines(keepends=True)
+    for i in range(1, len(lines)):
+        if lines[i].strip() == "---":
+            fields: Dict[str, str] = {}
+            for line in lines[1:i]:
+                if ":" in line:
+                    k, v = line.split(":", 1)
+                    fields[k.strip().lower()] = v.strip().strip("\"'")
+            return fields, "".join(lines[i + 1 :])
+    return {}, text
+
+
+def partition_of(rel: str, fields: Dict[str, str]) -> str:
+    """Front-matter `partition:` wins, then the first directory under the corpus root."""
+    if fields.get("partition"):
+        return fields["partition"].lower()
+    parts = rel.split("/")
+    return parts[0].lower() if len(parts) > 1 else DEFAULT_PARTITION
+
+
+def prepare_document(rel: str, path: str, max_tokens: int, overlap: int) -> Prepared:
+    """Read, normalize and chunk one file. Runs in a worker process."""
+    p = Path(path)
+    data = p.read_bytes()
+    st = p.stat()
+    fields, body = split_front_matter(data.decode("utf-8", errors="ignore"))
+    clean = normalize_text(body)
+    if p.suffix.lower() == ".md":
+        chunks = split_markdown(clean, max_tokens, overlap)
+    else:
+        chunks = split_text(clean, max_tokens, overlap)
+    entry = {
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "mtime_ns": st.st_mtime_ns,
+        "size": st.st_size,
+        "partition": partition_of(rel, fields),
+    }
+    return rel, str(p), entry, chunks
+
+
+def iter_prepared(items: Iterable[Tuple[str, Path]], params: dict, workers: int = 1) -> Iterator[Prepared]:
+    """Yield prepared documents in input order with a bounded number of files in flight."""
+    args = ((rel, str(p), params["chunk_max_tokens"], params["chunk_overlap"]) for rel, p in items)
+    if workers <= 1:
+        for a in args:
+            yield prepare_document(*a)
+        return
+    # spawn: the API process has native thread pools (torch, faiss) that do not survive fork
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) as ex:
+        inflight: deque = deque()
+        for a in args:
+            inflight.append(ex.submit(prepare_document, *a))
+            if len(inflight) >= workers * 2:
+                yield inflight.popleft().result()
+        while inflight:
+            yield inflight.popleft().result()
+
+
+def iter_batches(prepared: Iterable[Prepared], chunk_id: Callable[[str, int], str], batch_size: int = 64) -> Iterator[Batch]:
+    texts: List[str] = []
+    metas: List[dict] = []
+    ids: List[str] = []
+    done: Dict[str, dict] = {}
+    for rel, path, entry, chunks in prepared:
+        meta = {"filename": Path(path).name, "path": path, "partition": entry["partition"]}
+        cids = [chunk_id(rel, i) for i in range(len(chunks))]
+        for cid, ch in zip(cids, chunks):
+            texts.append(ch)
+            metas.append(meta)
+            ids.append(cid)
+            if len(texts) >= batch_size:
+                yield texts, metas, ids, done
+                texts, metas, ids, done = [], [], [], {}
+        # a file is recorded in the batch that carries its last chunk
+        done[rel] = {**entry, "chunk_ids": cids}
+    if texts or done:
+        yield texts, metas, ids, done
+
+
+def prefetch(it: Iterator, maxsize: int) -> Iterator:
+    """Run an iterator in a background thread, handing items over through a bounded queue."""
+    q: "queue.Queue" = queue.Queue(maxsize=max(1, maxsize))
+    end = object()
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in it:
+                while not stop.is_set():
+                    try:
+                        q.put(("item", item), timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+            q.put(("end", end))
+        except BaseException as e:  # surface worker errors in the consumer
+            q.put(("error", e))
+
+    t = threading.Thread(target=produce, name="ingest-prefetch", daemon=True)
+    t.start()
+    try:
+        while True:
+            kind, item = q.get()
+            if kind == "end":
+                return
+            if kind == "error":
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def ingest(
+    items: Iterable[Tuple[str, Path]],
+    params: dict,
+    sink: Sink,
+    chunk_id: Callable[[str, int], str],
+    workers: Optional[int] = None,
+    batch_size: int = 64,
+    queue_size: int = 4,
+) -> Tuple[Dict[str, dict], int]:
+    """Stream files through the pipeline into `sink`. Returns (manifest entries, chunk count)."""
+    workers = workers if workers is not None else ingest_workers()
+    if isinstance(items, (list, tuple)) and len(items) < 2:
+        workers = 1  # not worth spawning a pool
+    prepared = iter_prepared(items, params, workers=workers)
+    entries: Dict[str, dict] = {}
+    n_chunks = 0
+    for texts, metas, ids, done in prefetch(iter_batches(prepared, chunk_id, batch_size), queue_size):
+        if texts:
+            sink(texts, metas, ids)
+            n_chunks += len(texts)
+        entries.update(done)
+    return entries, n_chunks
+
+
+def ingest_workers() -> int:
+    env = os.getenv("INGEST_WORKERS")
+    if env:
+        return max(1, int(env))
+    return max(1, (os.cpu_count() or 1) - 1)
@@ -0,0 +1,105 @@
+"""Request routing ahead of the agentic loop.
+
+Regex rules (`router.fast_route`) catch the obvious cases; an optional
+nearest-centroid classifier over the query embedding (the same vector
+retrieval uses, so it is usually a cache hit) catches paraphrases. Anything
+not classified confidently goes to LLM tool-calling.
+"""
+import os
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .deps import state, run_cpu
+from .router import Route, fast_route
+
+
+# A handful of seed phrases per route; "other" absorbs small talk and mixed requests.
+SEED_EXAMPLES: Dict[str, List[str]] = {
+    "rag_read": [
+        "как вернуть товар",
+        "сколько идёт доставка",
+        "какие способы оплаты вы принимаете",
+        "есть ли гарантия на товар",
+        "условия возврата денег",
+        "в какое время работает поддержка",
+    ],
+    "db_analytics_query": [
+        "сколько заказов было за неделю",
+        "какая выручка за месяц",
+        "топ товаров по продажам",
+        "средний чек по городам",
+        "сколько новых клиентов за период",
+    ],
+    "other": [
+        "привет",
+        "спасибо",
+        "позови оператора",
+        "ты бот?",
+        "у меня проблема",
+    ],
+}
+
+
+class CentroidClassifier:
+    """Cosine nearest-centroid over normalized embeddings of the seed phrases."""
+
+    def __init__(self, embed_documents: Callable[[List[str]], List[List[float]]], examples: Dict[str, List[str]]):
+        labels = list(examples)
+        centroids = []
+        for label in labels:
+            v = np.asarray(embed_documents(examples[label]), dtype=np.float32).mean(axis=0)
+            centroids.append(v / (np.linalg.norm(v) or 1.0))
+        self.labels = labels
+        self.centroids = np.stack(centroids)
+
+    def classify(self, vector: List[float]) -> Tuple[str, float, float]:
+        """Returns (label, similarity, margin over the runner-up)."""
+        q = np.asarray(vector, dtype=np.float32)
+        q = q / (np.linalg.norm(q) or 1.0)
+        sims = self.centroids @ q
+        order = np.argsort(-sims)
+        best = float(sims[order[0]])
+        margin = best - float(sims[order[1]]) if len(order) > 1 else best
+        return self.labels[int(order[0])], best, margin
+
+
+_classifier: Optional[CentroidClassifier] = None
+_classifier_for: Optional[int] = None
+_lock = threading.Lock()
+
+
+def get_classifier() -> Optional[CentroidClassifier]:
+    """Built lazily per embedder (a model change rebuilds the centroids)."""
+    global _classifier, _classifier_for
+    emb = state.embedder
+    if emb is None:
+        return None
+    with _lock:
+        if _classifier is None or _classifier_for != id(emb):
+            _classifier = CentroidClassifier(emb.embed_documents, SEED_EXAMPLES)
+            _classifier_for = id(emb)
+        return _classifier
+
+
+def classify(question: str, is_admin: bool) -> Optional[Route]:
+    clf = get_classifier()
+    if clf is None:
+        return None
+    label, sim, margin = clf.classify(state.embedder.embed_query(question))
+    if sim < float(os.getenv("ROUTER_MIN_SIM", "0.5")) or margin < float(os.getenv("ROUTER_MIN_MARGIN", "0.1")):
+        return None
+    if label == "rag_read" or (label == "db_analytics_query" and is_admin):
+        return Route(label, {"question": question}, source="classifier")
+    return None
+
+
+async def route_request(question: str, mode: str, is_admin: bool) -> Optional[Route]:
+    """Pick a tool without an LLM round trip, or None to let the model decide."""
+    if os.getenv("ROUTER_FAST_PATH", "true").lower() != "true":
+        return None
+    route = fast_route(question, mode, is_admin)  # type: ignore[arg-type]
+    if route is None and os.getenv("ROUTER_CLASSIFIER", "false").lower() == "true":
+        route = await run_cpu(classify, question, is_admin)
+    return route
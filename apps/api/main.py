@@ -1,19 +1,22 @@
 import os
 import json
+import asyncio
 import logging
 from typing import Optional
 
-from fastapi import FastAPI, Header
+from fastapi import FastAPI, Header, Query
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
-from .deps import init_clients, state
-from .models import ChatRequest, ChatResponse, Source, Metrics, ToolInfo
+from .deps import init_clients, state, run_cpu
+from .models import ChatRequest, ChatResponse, Source, Metrics, ToolInfo, RetrieveBatchRequest
 from .router import pii_filter
-from .rag import retrieve, compute_confidence
-from .generators import llm_answer, llm_stream_answer, sse_from_generator
+from .rag import aretrieve_many, compute_confidence
+from .partitions import partition_for_mode
+from .generators import llm_answer, llm_stream_answer, sse_from_generator, public_sources
 from .db_tool import db_tool_query
-from .agentic import run_agentic
+from .schema_catalog import bump_schema_version
+from .agentic import run_agentic, stream_agentic, single_pass_enabled
 from .admin_api import (
     get_orders,
     get_order,
@@ -21,7 +24,10 @@ from .admin_api import (
     get_customers,
     get_products,
     get_admin_stats,
+    compute_admin_stats,
+    COUNT_MODES,
 )
+from .admin_stats import reconcile_loop
 
 
 logger = logging.getLogger(__name__)
@@ -41,11 +47,26 @@ app.add_middleware(
 )
 
 
+_background: list = []
+
+
 @app.on_event("startup")
 def on_startup():
     init_clients()
 
 
+@app.on_event("startup")
+async def start_background():
+    _background.append(asyncio.create_task(reconcile_loop(compute_admin_stats)))
+
+
+@app.on_event("shutdown")
+async def stop_background():
+    for task in _background:
+        task.cancel()
+    _background.clear()
+
+
 def _public_tool_info(tool_info: Optional[dict]) -> Optional[dict]:
     if not tool_info:
         return None
@@ -71,10 +92,12 @@ async def chat(request: ChatRequest, x_session_id: Optional[str] = Header(None),
     is_admin = x_admin_key and (x_admin_key == os.getenv("ADMIN_PIN"))
     clean = pii_filter(request.text)
 
-    _ans, sources, labels, tool_info = run_agentic(clean, bool(is_admin))
-    answer = llm_answer(clean, sources, tool_info)
+    trace: dict = {}
+    final, sources, labels, tool_info = await run_agentic(clean, bool(is_admin), request.mode, trace=trace)
+    # single-pass mode: the agent's last message already is the answer
+    answer = final or await llm_answer(clean, sources, tool_info)
 
-    metrics = Metrics(confidence=compute_confidence(sources))
+    metrics = Metrics(confidence=compute_confidence(sources), tool_latency_ms=trace.get("tool_latency_ms"))
     resp = ChatResponse(
         answer=answer,
         sources=[Source(**s) for s in sources],
@@ -90,28 +113,68 @@ async def chat_stream(request: ChatRequest, x_session_id: Optional[str] = Header
     is_admin = x_admin_key and (x_admin_key == os.getenv("ADMIN_PIN"))
     clean = pii_filter(request.text)
 
-    _ans, sources, labels, tool_info = run_agentic(clean, bool(is_admin))
+    if single_pass_enabled():
+        return sse_from_generator(stream_agentic(clean, bool(is_admin), request.mode))
+    _ans, sources, labels, tool_info = await run_agentic(clean, bool(is_admin), request.mode)
     gen = llm_stream_answer(clean, sources, tool_info, labels)
     return sse_from_generator(gen)
 
 
+@app.post("/retrieve/batch")
+async def retrieve_batch(request: RetrieveBatchRequest):
+    max_queries = int(os.getenv("RETRIEVE_BATCH_MAX", "64"))
+    if len(request.queries) > max_queries:
+        return JSONResponse({"error": f"Too many queries (max {max_queries})"}, status_code=400)
+    queries = [pii_filter(q) for q in request.queries]
+    results = await aretrieve_many(queries, top_k=request.top_k, partition=partition_for_mode(request.mode, state.partitions))
+    state.metrics["rag_queries"] = state.metrics.get("rag_queries", 0) + len(queries)
+    results = [public_sources(srcs, request.include_content) for srcs in results]
+    return {
+        "results": [
+            {"query": q, "sources": srcs, "confidence": compute_confidence(srcs)}
+            for q, srcs in zip(queries, results)
+        ]
+    }
+
+
 @app.get("/metrics")
 def metrics():
-    return state.metrics
+    out = dict(state.metrics)
+    cache = getattr(state.embedder, "cache", None)
+    if cache is not None:
+        out.update(cache.stats())
+    batcher = getattr(state.embedder, "batcher", None)
+    if batcher is not None:
+        out.update(batcher.stats())
+    if state.sql_cache is not None:
+        out.update(state.sql_cache.stats())
+    prefetches = sum(out.get(k, 0) for k in ("rag_prefetch_hits", "rag_prefetch_misses", "rag_prefetch_wasted"))
+    if prefetches:
+        out["rag_prefetch_hit_rate"] = out.get("rag_prefetch_hits", 0) / prefetches
+    return out
 
 
 # Admin API endpoints
+# List endpoints: `cursor` switches to keyset paging, `count` picks how `total` is computed
+_COUNT_PATTERN = "^(" + "|".join(COUNT_MODES) + ")$"
+
+
 @app.get("/admin/orders")
 async def admin_orders(
     status: Optional[str] = None,
     limit: int = 50,
     offset: int = 0,
+    cursor: Optional[str] = None,
+    count: str = Query("exact", pattern=_COUNT_PATTERN),
     x_admin_key: Optional[str] = Header(None)
 ):
     is_admin = x_admin_key and (x_admin_key == os.getenv("ADMIN_PIN"))
     if not is_admin:
         return JSONResponse({"error": "Unauthorized"}, status_code=401)
-    return get_orders(status, limit, offset)
+    try:
+        return get_orders(status, limit, offset, cursor, count)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
 
 
 @app.get("/admin/orders/{order_id}")
@@ -138,12 +201,17 @@ async def admin_update_order(
 async def admin_customers(
     limit: int = 50,
     offset: int = 0,
+    cursor: Optional[str] = None,
+    count: str = Query("exact", pattern=_COUNT_PATTERN),
     x_admin_key: Optional[str] = Header(None)
 ):
     is_admin = x_admin_key and (x_admin_key == os.getenv("ADMIN_PIN"))
     if not is_admin:
         return JSONResponse({"error": "Unauthorized"}, status_code=401)
-    return get_customers(limit, offset)
+    try:
+        return get_customers(limit, offset, cursor, count)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
 
 
 @app.get("/admin/products")
@@ -151,12 +219,26 @@ async def admin_products(
     category: Optional[str] = None,
     limit: int = 50,
     offset: int = 0,
+    cursor: Optional[str] = None,
+    count: str = Query("exact", pattern=_COUNT_PATTERN),
     x_admin_key: Optional[str] = Header(None)
 ):
     is_admin = x_admin_key and (x_admin_key == os.getenv("ADMIN_PIN"))
     if not is_admin:
         return JSONResponse({"error": "Unauthorized"}, status_code=401)
-    return get_products(category, limit, offset)
+    try:
+        return get_products(category, limit, offset, cursor, count)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+
+@app.post("/admin/schema/refresh")
+async def admin_schema_refresh(x_admin_key: Optional[str] = Header(None)):
+    is_admin = x_admin_key and (x_admin_key == os.getenv("ADMIN_PIN"))
+    if not is_admin:
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    await run_cpu(bump_schema_version)
+    return {"ok": True}
 
 
 @app.get("/admin/stats")
@@ -0,0 +1,111 @@
+import os
+import json
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_FORMAT = 2  # 2: chunks carry a `partition`
+CORPUS_SUFFIXES = {".md", ".txt"}
+
+
+@dataclass
+class ManifestDiff:
+    added: List[str] = field(default_factory=list)
+    changed: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    # files whose stat changed but content did not: rel -> refreshed manifest entry
+    touched: Dict[str, dict] = field(default_factory=dict)
+
+    @property
+    def empty(self) -> bool:
+        return not (self.added or self.changed or self.removed)
+
+
+def new_manifest(params: dict) -> dict:
+    return {"format": MANIFEST_FORMAT, "params": dict(params), "files": {}}
+
+
+def is_compatible(manifest: Optional[dict], params: dict) -> bool:
+    """A manifest can drive incremental updates only if it was built with the same model/chunking."""
+    return bool(manifest) and manifest.get("format") == MANIFEST_FORMAT and manifest.get("params") == params
+
+
+def load_manifest(index_dir: Path) -> Optional[dict]:
+    p = Path(index_dir) / MANIFEST_NAME
+    try:
+        return json.loads(p.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning("Index manifest unreadable (%s): %s", p, e)
+        return None
+
+
+def save_manifest(index_dir: Path, manifest: dict):
+    p = Path(index_dir) / MANIFEST_NAME
+    tmp = p.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=1), encoding="utf-8")
+    os.replace(tmp, p)
+
+
+def scan_corpus(root: Path) -> Dict[str, Path]:
+    """Map of corpus-relative path -> file for every indexable document under root."""
+    out: Dict[str, Path] = {}
+    if not root.exists():
+        return out
+    for p in root.rglob("*"):
+        if p.is_file() and p.suffix.lower() in CORPUS_SUFFIXES:
+            out[p.relative_to(root).as_posix()] = p
+    return out
+
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def file_entry(path: Path, sha256: str, chunk_ids: List[str]) -> dict:
+    st = path.stat()
+    return {"sha256": sha256, "mtime_ns": st.st_mtime_ns, "size": st.st_size, "chunk_ids": list(chunk_ids)}
+
+
+def chunk_id(rel: str, i: int) -> str:
+    return f"{rel}::{i}"
+
+
+def chunk_ids_for(rel: str, n: int) -> List[str]:
+    return [chunk_id(rel, i) for i in range(n)]
+
+
+def diff_corpus(files: Dict[str, dict], corpus: Dict[str, Path], verify_hash: bool = False) -> ManifestDiff:
+    """Compare manifest entries with the files on disk.
+
+    Unchanged (mtime, size) is trusted unless `verify_hash`; otherwise the
+    content hash decides whether a file was really modified.
+    """
+    d = ManifestDiff()
+    for rel in sorted(set(files) - set(corpus)):
+        d.removed.append(rel)
+    for rel, path in sorted(corpus.items()):
+        old = files.get(rel)
+        if old is None:
+            d.added.append(rel)
+            continue
+        st = path.stat()
+        if not verify_hash and old.get("mtime_ns") == st.st_mtime_ns and old.get("size") == st.st_size:
+            continue
+        if file_sha256(path) == old.get("sha256"):
+            if old.get("mtime_ns") != st.st_mtime_ns or old.get("size") != st.st_size:
+                d.touched[rel] = {**old, "mtime_ns": st.st_mtime_ns, "size": st.st_size}
+            continue
+        d.changed.append(rel)
+    return d
@@ -14,7 +14,9 @@ class Source(BaseModel):
 class ToolInfo(BaseModel):
     name: str
     sql: Optional[str] = None
-    rows: Optional[List[dict]] = None
+    # columnar result: rows[i][j] is the value of columns[j]
+    columns: Optional[List[str]] = None
+    rows: Optional[List[List[Any]]] = None
     summary: Optional[str] = None
 
 
@@ -37,3 +39,10 @@ class ChatResponse(BaseModel):
     metrics: Optional[Metrics] = None
     tool_info: Optional[ToolInfo] = None
 
+
+
+class RetrieveBatchRequest(BaseModel):
+    queries: List[str]
+    top_k: Optional[int] = Field(default=None, ge=1, le=50)
+    mode: str = Field(default="faq", pattern=r"^(faq|orders|policies|admin)$")
+    include_content: bool = False
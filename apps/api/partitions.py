@@ -0,0 +1,66 @@
+import os
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+import faiss
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+# ChatRequest.mode -> partition searched; modes not listed search the whole corpus
+DEFAULT_MODE_PARTITIONS = {"policies": "policies", "orders": "orders"}
+
+
+@dataclass
+class Partition:
+    name: str
+    labels: np.ndarray  # int64 positions of the partition's chunks in the vector index
+    bm25_mask: Optional[np.ndarray] = None
+    selector: "faiss.IDSelector" = field(init=False, repr=False)
+
+    def __post_init__(self):
+        # keep the selector on the object: faiss holds a raw pointer to it during search
+        self.selector = faiss.IDSelectorBatch(self.labels)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+
+def build_partitions(metadatas: Sequence[dict], bm25_ids: Optional[List[str]] = None, chunk_ids: Optional[Sequence[str]] = None) -> Dict[str, Partition]:
+    """Group index positions by the `partition` tag written at ingestion."""
+    groups: Dict[str, List[int]] = {}
+    for pos, meta in enumerate(metadatas):
+        groups.setdefault(meta.get("partition") or "faq", []).append(pos)
+    out: Dict[str, Partition] = {}
+    for name, positions in groups.items():
+        part = Partition(name, np.asarray(positions, dtype=np.int64))
+        if bm25_ids is not None and chunk_ids is not None:
+            members = {chunk_ids[p] for p in positions}
+            part.bm25_mask = np.fromiter((i in members for i in bm25_ids), dtype=bool, count=len(bm25_ids))
+        out[name] = part
+    logger.info("Index partitions: %s", {k: len(v) for k, v in out.items()})
+    return out
+
+
+def mode_partitions() -> Dict[str, str]:
+    env = os.getenv("RAG_MODE_PARTITIONS")
+    if not env:
+        return dict(DEFAULT_MODE_PARTITIONS)
+    out = {}
+    for pair in env.split(","):
+        if ":" in pair:
+            mode, part = pair.split(":", 1)
+            out[mode.strip()] = part.strip()
+    return out
+
+
+def partition_for_mode(mode: Optional[str], partitions: Optional[Dict[str, Partition]]) -> Optional[str]:
+    """Partition to search for a chat mode, or None for the whole corpus (also when the shard is absent)."""
+    if not mode or not partitions:
+        return None
+    name = mode_partitions().get(mode)
+    if name in (None, "*") or name not in partitions:
+        return None
+    return name
@@ -1,38 +1,160 @@
 import os
-from typing import List, Tuple
+from typing import List, Tuple, Optional
 
-from .deps import state
+import faiss
+import numpy as np
+
+from .deps import state, run_cpu
+from .partitions import Partition
+from .ingest import split_front_matter
 from pathlib import Path
 from kits.kit_common.highlight import make_snippet
+from kits.kit_bm25 import rrf_fuse
+
+
+def retrieve(query: str, top_k: int | None = None, partition: Optional[str] = None):
+    return retrieve_many([query], top_k=top_k, partition=partition)[0]
+
 
+def retrieve_many(queries: List[str], top_k: int | None = None, partition: Optional[str] = None,
+                  vectors: Optional[List[List[float]]] = None) -> List[List[dict]]:
+    """Retrieve for several queries at once: one encoder call, one batched index search.
 
-def retrieve(query: str, top_k: int | None = None):
+    `partition` restricts the search to one shard tagged at ingestion
+    (unknown partitions search the whole corpus). `vectors` are the query
+    embeddings when the caller already has them.
+    """
+    if not queries:
+        return []
     k = top_k or int(os.getenv("RAG_TOP_K", "5"))
-    docs = state.faiss.similarity_search_with_score(query, k=k)
+    part = state.partitions.get(partition) if partition else None
+    depth = k * int(os.getenv("RAG_HYBRID_DEPTH", "4")) if state.bm25 is not None else k
+    dense = _dense_search_many(queries, depth, part, vectors)
+    out = []
+    for q, hits in zip(queries, dense):
+        if state.bm25 is not None:
+            mask = part.bm25_mask if part is not None else None
+            hits = _fuse(hits, state.bm25.search(q, depth, mask=mask), k)
+        out.append(_build_sources(q, hits[:k]))
+    return out
+
+
+async def aretrieve(query: str, top_k: int | None = None, partition: Optional[str] = None) -> List[dict]:
+    """`retrieve` for the request path: index search runs on the CPU executor."""
+    return (await aretrieve_many([query], top_k=top_k, partition=partition))[0]
+
+
+async def aretrieve_many(queries: List[str], top_k: int | None = None, partition: Optional[str] = None) -> List[List[dict]]:
+    vectors = None
+    if getattr(state.embedder, "batcher", None) is not None and hasattr(state.embedder, "aembed_queries"):
+        # encodes are batched across concurrent requests (EMBED_BATCH_WINDOW_MS)
+        vectors = await state.embedder.aembed_queries(queries)
+    return await run_cpu(retrieve_many, queries, top_k=top_k, partition=partition, vectors=vectors)
+
+
+Hit = Tuple[str, str, dict, float]  # (chunk id, chunk text, metadata, L2 distance)
+
+
+def _embed_queries(queries: List[str]) -> List[List[float]]:
+    if hasattr(state.embedder, "embed_queries"):
+        return state.embedder.embed_queries(queries)
+    return [state.embedder.embed_query(q) for q in queries]
+
+
+def _dense_search_many(queries: List[str], k: int, part: Optional[Partition] = None,
+                       vectors: Optional[List[List[float]]] = None) -> List[List[Hit]]:
+    if vectors is None:
+        vectors = _embed_queries(queries)
+    selector = part.selector if part is not None else None
+    limit = len(part) if part is not None else None
+    if state.engine is not None:
+        return state.engine.search(vectors, k, selector=selector, limit=limit)
+    vs = state.faiss
+    k = max(1, min(k, vs.index.ntotal if limit is None else limit))
+    params = None
+    if selector is not None:
+        params = faiss.SearchParameters()
+        params.sel = selector
+    distances, labels = vs.index.search(np.asarray(vectors, dtype=np.float32), k, params=params)
+    out: List[List[Hit]] = []
+    for row_d, row_l in zip(distances, labels):
+        hits: List[Hit] = []
+        for dist, pos in zip(row_d, row_l):
+            if pos < 0:
+                continue
+            doc_id = vs.index_to_docstore_id[pos]
+            doc = vs.docstore.search(doc_id)
+            if hasattr(doc, "page_content"):
+                hits.append((doc_id, doc.page_content, doc.metadata, float(dist)))
+        out.append(hits)
+    return out
+
+
+def _fuse(dense: List[Hit], lexical: List[Tuple[str, float]], k: int) -> List[Hit]:
+    """Reciprocal rank fusion of dense and BM25 rankings.
+
+    Lexical-only hits get the worst dense distance among the candidates so that
+    confidence is not inflated by chunks the embedding model did not rank.
+    """
+    fused = rrf_fuse([[h[0] for h in dense], [d for d, _ in lexical]], k=int(os.getenv("RAG_RRF_K", "60")))
+    by_id = {h[0]: h for h in dense}
+    worst = max((h[3] for h in dense), default=2.0)
+    out: List[Hit] = []
+    for doc_id, _ in fused:
+        hit = by_id.get(doc_id)
+        if hit is None:
+            found = _lookup_chunk(doc_id)
+            if found is None:
+                continue
+            hit = (doc_id, found[0], found[1], worst)
+        out.append(hit)
+        if len(out) >= k:
+            break
+    return out
+
+
+def _lookup_chunk(doc_id: str) -> Optional[Tuple[str, dict]]:
+    if state.engine is not None:
+        return state.engine.get(doc_id)
+    doc = state.faiss.docstore.search(doc_id)
+    return (doc.page_content, doc.metadata) if hasattr(doc, "page_content") else None
+
+
+def _build_sources(query: str, hits: List[Hit]) -> List[dict]:
     sources = []
-    for i, (doc, score) in enumerate(docs):
-        snippet, hl = make_snippet(doc.page_content, query)
-        # Try to read full document text from metadata.path
-        fulltext = None
-        p = doc.metadata.get("path")
-        try:
-            if p:
-                fulltext = Path(p).read_text(encoding="utf-8", errors="ignore")
-        except Exception:
-            fulltext = None
+    for i, (_id, text, meta, score) in enumerate(hits):
+        snippet, hl = make_snippet(text, query)
+        # Full document text comes from the in-memory docstore (loaded at index time)
+        p = meta.get("path")
+        fulltext = _full_text(p)
         sources.append({
             "id": f"d{i}",
             "score": score_to_similarity(score),
-            "filename": doc.metadata.get("filename", ""),
-            "page": doc.metadata.get("page", 1) or 1,
+            "filename": meta.get("filename", ""),
+            "page": meta.get("page", 1) or 1,
             "snippet": snippet,
             "highlights": hl,
+            "chunk": text,
             "content": fulltext or snippet,
             "path": p or "",
         })
     return sources
 
 
+def _full_text(path: str | None) -> str | None:
+    """Document text for SourceCards, without the front matter used only at ingestion."""
+    if not path:
+        return None
+    if state.docstore is not None:
+        text = state.docstore.get(path)
+    else:
+        try:
+            text = Path(path).read_text(encoding="utf-8", errors="ignore")
+        except Exception:
+            return None
+    return split_front_matter(text)[1] if text else text
+
+
 def score_to_similarity(distance: float) -> float:
     try:
         return 1.0 / (1.0 + float(distance))
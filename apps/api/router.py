@@ -1,5 +1,6 @@
 import re
-from typing import Literal
+from dataclasses import dataclass, field
+from typing import Literal, Optional
 
 
 def pii_filter(text: str) -> str:
@@ -27,3 +28,39 @@ def route_intent(text: str, mode: Literal["faq","orders","policies","admin"], is
         return "delivery_eta"
     return "rag"
 
+
+
+@dataclass
+class Route:
+    """A tool call decided without asking the LLM."""
+    tool: str
+    args: dict = field(default_factory=dict)
+    source: str = "rules"
+
+
+# order numbers look like #A1001 (optional letter prefix, then digits); "#help" is not one
+_ORDER_NO = re.compile(r"#([A-Za-z]{0,3}\d+)\b")
+# informational topics that need the knowledge base (on top of, or instead of, a tool)
+_KB_TOPIC = re.compile(
+    r"\b(цен|тариф|стоимост|стоит|доставк|возврат|гаранти|правил|политик|оплат|срок|обмен)", re.IGNORECASE
+)
+
+
+def fast_route(text: str, mode: Literal["faq","orders","policies","admin"], is_admin: bool) -> Optional[Route]:
+    """Route only high-precision cases straight to a tool.
+
+    An explicit `#order_no` goes to the order lookup; analytics goes to the
+    DB tool only in admin mode. Any knowledge-base topic in the text
+    ("сколько дней на возврат", "сколько стоит доставка") disqualifies both.
+    The loose `route_intent` keywords ("когда", "цена", "сколько") are not
+    confident enough on their own: everything else stays with LLM tool-calling.
+    """
+    m = _ORDER_NO.search(text)
+    if _KB_TOPIC.search(_ORDER_NO.sub(" ", text)):
+        return None
+    intent = route_intent(text, mode, is_admin)
+    if intent == "db_analytics":
+        return Route("db_analytics_query", {"question": text}) if mode == "admin" and not m else None
+    if intent == "order_status" and m:
+        return Route("orders_status", {"order_no": m.group(1)})
+    return None
@@ -0,0 +1,280 @@
+"""Schema catalog for NL->SQL prompts.
+
+Tables, columns, foreign keys and short descriptions (PostgreSQL comments,
+falling back to the built-in notes for the demo tables) are loaded once per
+schema version. A prompt gets only the tables relevant to the question —
+lexical overlap with names/descriptions plus embedding similarity — and the
+tables on the FK paths that join them.
+
+The version is a fingerprint of the catalog itself, so an unchanged schema
+keeps its table embeddings across re-reads. The catalog is re-read every
+SCHEMA_CACHE_TTL_S, or right away once any worker calls
+`bump_schema_version()` (a Redis counter) after a migration.
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from sqlalchemy import text
+
+from kits.kit_bm25 import tokenize
+
+from .deps import state, run_cpu
+from .db import get_async_engine
+from .sql_cache import schema_fingerprint
+
+
+logger = logging.getLogger(__name__)
+
+EPOCH_KEY = "schema_catalog:epoch"
+
+# Descriptions for the demo tables when the database has no COMMENTs
+DEFAULT_DESCRIPTIONS: Dict[str, str] = {
+    "orders": "заказы покупателей: номер, дата, статус, сумма (выручка, средний чек)",
+    "order_items": "позиции заказов: товар, количество, цена; продажи по товарам",
+    "customers": "клиенты: email, город, индекс",
+    "products": "товары каталога: артикул, название, категория, цена",
+}
+
+
+@dataclass
+class TableInfo:
+    name: str
+    columns: List[Tuple[str, str]]
+    description: str = ""
+    # (column, referenced table, referenced column)
+    foreign_keys: List[Tuple[str, str, str]] = field(default_factory=list)
+
+    def render(self) -> str:
+        desc = f" — {self.description}" if self.description else ""
+        cols = ", ".join(f"{c} {t}" for c, t in self.columns)
+        return f"{self.name}{desc}: {cols}"
+
+    def document(self) -> str:
+        """Text matched against questions (lexically and by embedding)."""
+        return " ".join([self.name.replace("_", " "), self.description] + [c for c, _ in self.columns])
+
+
+def _terms(s: str) -> Set[str]:
+    # 5-char prefixes: "заказов"/"заказы", "товаров"/"товары" meet on the same term
+    return {t[:5] for t in tokenize(s) if len(t) >= 3}
+
+
+class SchemaCatalog:
+    def __init__(self, tables: List[TableInfo], embed_documents: Optional[Callable[[List[str]], List[List[float]]]] = None):
+        self.tables: Dict[str, TableInfo] = {t.name: t for t in tables}
+        self.version = schema_fingerprint(self.render())
+        self.embed_documents = embed_documents
+        self._tokens = {t.name: _terms(t.document()) for t in tables}
+        self._names = list(self.tables)
+        self._vectors: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+        self._graph: Dict[str, List[str]] = {name: [] for name in self.tables}
+        for t in tables:
+            for _col, ref, _refcol in t.foreign_keys:
+                if ref in self._graph and ref != t.name:
+                    self._graph[t.name].append(ref)
+                    self._graph[ref].append(t.name)
+
+    def vectors(self) -> Optional[np.ndarray]:
+        """Normalized table embeddings, computed once per catalog (i.e. per schema version)."""
+        if self.embed_documents is None or not self._names:
+            return None
+        with self._lock:
+            if self._vectors is None:
+                m = np.asarray(self.embed_documents([self.tables[n].document() for n in self._names]), dtype=np.float32)
+                self._vectors = m / (np.linalg.norm(m, axis=1, keepdims=True) + 1e-9)
+            return self._vectors
+
+    def relevant(self, question: str, query_vector: Optional[List[float]] = None,
+                 max_tables: int = 4, min_similarity: float = 0.3) -> List[str]:
+        """Tables matching the question, best first; empty when nothing matches."""
+        q_tokens = _terms(question)
+        sims = np.zeros(len(self._names), dtype=np.float32)
+        vecs = self.vectors() if query_vector is not None else None
+        if vecs is not None:
+            q = np.asarray(query_vector, dtype=np.float32)
+            sims = vecs @ (q / (np.linalg.norm(q) or 1.0))
+        scored = []
+        for i, name in enumerate(self._names):
+            lexical = len(q_tokens & self._tokens[name])
+            if lexical or sims[i] >= min_similarity:
+                scored.append((lexical, float(sims[i]), name))
+        scored.sort(key=lambda s: (-s[0], -s[1]))
+        return [name for _, _, name in scored[:max_tables]]
+
+    def join_path(self, a: str, b: str) -> List[str]:
+        """Shortest FK path from `a` to `b` (both ends included), [] if not connected."""
+        prev: Dict[str, Optional[str]] = {a: None}
+        queue = deque([a])
+        while queue:
+            cur = queue.popleft()
+            if cur == b:
+                path = [cur]
+                while prev[path[-1]] is not None:
+                    path.append(prev[path[-1]])  # type: ignore[arg-type]
+                return path[::-1]
+            for nxt in self._graph.get(cur, []):
+                if nxt not in prev:
+                    prev[nxt] = cur
+                    queue.append(nxt)
+        return []
+
+    def with_join_paths(self, names: List[str]) -> List[str]:
+        """`names` plus the intermediate tables needed to join each of them to the first."""
+        out = list(names)
+        for name in names[1:]:
+            for t in self.join_path(names[0], name):
+                if t not in out:
+                    out.append(t)
+        return out
+
+    def render(self, names: Optional[List[str]] = None) -> str:
+        names = list(self.tables) if names is None else names
+        chosen = set(names)
+        lines = [self.tables[n].render() for n in names]
+        joins = [
+            f"{t.name}.{col} = {ref}.{refcol}"
+            for n in names for t in [self.tables[n]]
+            for col, ref, refcol in t.foreign_keys if ref in chosen
+        ]
+        if joins:
+            lines.append("Связи (FK): " + "; ".join(joins))
+        return "\n".join(lines)
+
+    def context(self, question: str, query_vector: Optional[List[float]] = None) -> str:
+        """Prompt schema for `question`; the whole catalog when nothing matched."""
+        names = self.relevant(
+            question,
+            query_vector,
+            max_tables=int(os.getenv("SCHEMA_MAX_TABLES", "4")),
+            min_similarity=float(os.getenv("SCHEMA_MIN_SIMILARITY", "0.3")),
+        )
+        if not names:
+            return self.render()
+        return self.render(self.with_join_paths(names))
+
+
+def default_catalog() -> SchemaCatalog:
+    # Fallback schema (kept in sync with db/init.sql)
+    return SchemaCatalog([
+        TableInfo("orders", [("id", "int"), ("order_no", "text"), ("created_at", "timestamp"), ("status", "text"),
+                             ("total", "numeric"), ("customer_id", "int")],
+                  DEFAULT_DESCRIPTIONS["orders"], [("customer_id", "customers", "id")]),
+        TableInfo("order_items", [("id", "int"), ("order_id", "int"), ("product_id", "int"), ("qty", "int"),
+                                  ("price", "numeric")],
+                  DEFAULT_DESCRIPTIONS["order_items"], [("order_id", "orders", "id"), ("product_id", "products", "id")]),
+        TableInfo("customers", [("id", "int"), ("email", "text"), ("city", "text"), ("zip", "text")],
+                  DEFAULT_DESCRIPTIONS["customers"]),
+        TableInfo("products", [("id", "int"), ("sku", "text"), ("name", "text"), ("category", "text"),
+                               ("price", "numeric"), ("active", "boolean")],
+                  DEFAULT_DESCRIPTIONS["products"]),
+    ], _embed_documents())
+
+
+_COLUMNS_SQL = text(
+    """
+    SELECT c.table_name, c.column_name, c.data_type,
+           obj_description(format('public.%I', c.table_name)::regclass, 'pg_class') AS table_comment
+    FROM information_schema.columns c
+    WHERE c.table_schema = 'public'
+    ORDER BY c.table_name, c.ordinal_position
+    """
+)
+
+_FOREIGN_KEYS_SQL = text(
+    """
+    SELECT kcu.table_name, kcu.column_name, ccu.table_name AS ref_table, ccu.column_name AS ref_column
+    FROM information_schema.table_constraints tc
+    JOIN information_schema.key_column_usage kcu
+      ON tc.constraint_name = kcu.constraint_name AND tc.table_schema = kcu.table_schema
+    JOIN information_schema.constraint_column_usage ccu
+      ON tc.constraint_name = ccu.constraint_name AND tc.table_schema = ccu.table_schema
+    WHERE tc.constraint_type = 'FOREIGN KEY' AND tc.table_schema = 'public'
+    ORDER BY kcu.table_name, kcu.ordinal_position
+    """
+)
+
+
+def _embed_documents() -> Optional[Callable[[List[str]], List[List[float]]]]:
+    return state.embedder.embed_documents if state.embedder is not None else None
+
+
+async def load_catalog() -> SchemaCatalog:
+    tables: Dict[str, TableInfo] = {}
+    async with get_async_engine().connect() as conn:
+        for name, col, dtype, comment in await conn.execute(_COLUMNS_SQL):
+            t = tables.get(name)
+            if t is None:
+                t = tables[name] = TableInfo(name, [], comment or DEFAULT_DESCRIPTIONS.get(name, ""))
+            t.columns.append((col, dtype))
+        for name, col, ref, refcol in await conn.execute(_FOREIGN_KEYS_SQL):
+            if name in tables:
+                tables[name].foreign_keys.append((col, ref, refcol))
+    if not tables:
+        return default_catalog()
+    return SchemaCatalog(list(tables.values()), _embed_documents())
+
+
+_catalog: Optional[SchemaCatalog] = None
+_checked_at = 0.0
+_epoch: Optional[str] = None
+
+
+def _read_epoch() -> Optional[str]:
+    if state.redis is None:
+        return None
+    try:
+        return state.redis.get(EPOCH_KEY)
+    except Exception as e:
+        logger.debug("Schema catalog: epoch read failed: %s", e)
+        return None
+
+
+def bump_schema_version():
+    """Make every worker re-read the catalog on its next analytics question."""
+    global _checked_at
+    _checked_at = 0.0
+    if state.redis is not None:
+        try:
+            state.redis.incr(EPOCH_KEY)
+        except Exception as e:
+            logger.debug("Schema catalog: epoch bump failed: %s", e)
+
+
+async def get_schema_catalog() -> SchemaCatalog:
+    global _catalog, _checked_at, _epoch
+    epoch = await run_cpu(_read_epoch)
+    if _catalog is not None and epoch == _epoch and time.monotonic() - _checked_at < float(os.getenv("SCHEMA_CACHE_TTL_S", "300")):
+        return _catalog
+    if not os.getenv("DB_URL"):
+        fresh = default_catalog()
+    else:
+        try:
+            fresh = await load_catalog()
+        except Exception as e:
+            logger.warning("Schema catalog: load failed, using the built-in schema: %s", e)
+            fresh = default_catalog()
+    # same version: keep the old object and its table embeddings
+    if _catalog is None or fresh.version != _catalog.version:
+        _catalog = fresh
+    _checked_at = time.monotonic()
+    _epoch = epoch
+    return _catalog
+
+
+async def schema_context(question: str) -> str:
+    """Schema text for an NL->SQL prompt: relevant tables plus their join paths."""
+    catalog = await get_schema_catalog()
+    vector = None
+    if state.embedder is not None and catalog.embed_documents is not None:
+        try:
+            vector = await run_cpu(state.embedder.embed_query, question)
+        except Exception as e:
+            logger.debug("Schema catalog: query embedding failed: %s", e)
+    return await run_cpu(catalog.context, question, vector)
@@ -0,0 +1,159 @@
+import re
+import time
+import hashlib
+import logging
+import threading
+from typing import Callable, List, Optional
+
+import numpy as np
+from redis import Redis
+
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(q: str) -> str:
+    """Case, `ё`, whitespace and surrounding punctuation do not change the SQL."""
+    s = (q or "").lower().replace("ё", "е")
+    s = re.sub(r"\s+", " ", s).strip()
+    return s.strip(" ?!.,;:")
+
+
+# Numbers and period words: questions that differ in these need different SQL
+# however close their embeddings are ("топ 10" / "топ 20", "за месяц" / "за неделю")
+_LITERAL_RE = re.compile(
+    r"\d+(?:[.,]\d+)?"
+    r"|\b(?:сегодн|вчера|позавчера|завтра|дн|ден|недел|месяц|квартал|полугоди|год|лет|час|минут"
+    r"|январ|феврал|март|апрел|ма[йя]|июн|июл|август|сентябр|октябр|ноябр|декабр"
+    r"|прошл|текущ|последн|следующ|нынешн|эт(?:от|а|ой|ом|у)\b)"
+)
+
+
+def literal_signature(norm: str) -> str:
+    """Numbers and date/period stems of a normalized question, order-insensitive."""
+    return " ".join(sorted(_LITERAL_RE.findall(norm)))
+
+
+def schema_fingerprint(schema: str) -> str:
+    return hashlib.sha1((schema or "").encode("utf-8")).hexdigest()[:16]
+
+
+class SqlCache:
+    """Redis cache of NL question -> validated SQL.
+
+    Keys combine a schema fingerprint with a hash of the normalized question,
+    so a schema change starts a fresh keyspace (old entries age out by TTL).
+    With an `embed` function, question vectors are kept per fingerprint and
+    literal signature (float16, at most `max_similar`), and a paraphrase whose
+    cosine similarity reaches `min_similarity` reuses the stored SQL. Only
+    questions with the same numbers and date/period words are compared, so
+    "топ 10" never reuses the SQL of "топ 20". Only SQL that passed
+    `safe_sql` and executed is ever `put`. Redis errors back off like the
+    embedding cache.
+    """
+
+    def __init__(
+        self,
+        redis: Optional[Redis],
+        ttl: int = 7 * 24 * 3600,
+        embed: Optional[Callable[[str], List[float]]] = None,
+        min_similarity: float = 0.92,
+        max_similar: int = 500,
+        redis_backoff: float = 30.0,
+    ):
+        self.redis = redis
+        self.ttl = ttl
+        self.embed = embed
+        self.min_similarity = min_similarity
+        self.max_similar = max_similar
+        self.redis_backoff = redis_backoff
+        self._redis_off_until = 0.0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _qhash(norm: str) -> str:
+        return hashlib.sha1(norm.encode("utf-8")).hexdigest()
+
+    def key(self, fp: str, qhash: str) -> str:
+        return f"nl2sql:{fp}:{qhash}"
+
+    def vectors_key(self, fp: str, norm: str) -> str:
+        sig = hashlib.sha1(literal_signature(norm).encode("utf-8")).hexdigest()[:12]
+        return f"nl2sql:{fp}:vectors:{sig}"
+
+    def get(self, question: str, fp: str) -> Optional[str]:
+        norm = normalize_question(question)
+        raw = self._redis_call("get", self.key(fp, self._qhash(norm)))
+        if raw:
+            self._count("hits")
+            return raw.decode("utf-8") if isinstance(raw, bytes) else raw
+        if self.embed is not None:
+            sql = self._get_similar(norm, fp)
+            if sql:
+                self._count("similar_hits")
+                return sql
+        self._count("misses")
+        return None
+
+    def put(self, question: str, fp: str, sql: str):
+        norm = normalize_question(question)
+        qhash = self._qhash(norm)
+        self._redis_call("setex", self.key(fp, qhash), self.ttl, sql)
+        if self.embed is None:
+            return
+        vk = self.vectors_key(fp, norm)
+        if (self._redis_call("hlen", vk) or 0) >= self.max_similar:
+            return
+        vec = np.asarray(self.embed(norm), dtype=np.float16).tobytes()
+        self._redis_call("hset", vk, qhash, vec)
+        self._redis_call("expire", vk, self.ttl)
+
+    def discard(self, question: str, fp: str):
+        """Drop an entry whose SQL stopped working (data-dependent errors, dropped view)."""
+        norm = normalize_question(question)
+        qhash = self._qhash(norm)
+        self._redis_call("delete", self.key(fp, qhash))
+        self._redis_call("hdel", self.vectors_key(fp, norm), qhash)
+
+    def stats(self) -> dict:
+        total = self.hits + self.similar_hits + self.misses
+        return {
+            "sql_cache_hits": self.hits,
+            "sql_cache_similar_hits": self.similar_hits,
+            "sql_cache_misses": self.misses,
+            "sql_cache_hit_rate": round((self.hits + self.similar_hits) / total, 4) if total else 0.0,
+        }
+
+    def _get_similar(self, norm: str, fp: str) -> Optional[str]:
+        stored = self._redis_call("hgetall", self.vectors_key(fp, norm))
+        if not stored:
+            return None
+        ids = list(stored)
+        mat = np.stack([np.frombuffer(stored[i], dtype=np.float16).astype(np.float32) for i in ids])
+        q = np.asarray(self.embed(norm), dtype=np.float32)
+        sims = mat @ q / (np.linalg.norm(mat, axis=1) * (np.linalg.norm(q) or 1.0) + 1e-9)
+        best = int(np.argmax(sims))
+        if sims[best] < self.min_similarity:
+            return None
+        qhash = ids[best].decode("utf-8") if isinstance(ids[best], bytes) else ids[best]
+        raw = self._redis_call("get", self.key(fp, qhash))
+        if not raw:
+            return None
+        return raw.decode("utf-8") if isinstance(raw, bytes) else raw
+
+    def _count(self, attr: str):
+        with self._lock:
+            setattr(self, attr, getattr(self, attr) + 1)
+
+    def _redis_call(self, op: str, *args):
+        if self.redis is None or time.monotonic() < self._redis_off_until:
+            return None
+        try:
+            return getattr(self.redis, op)(*args)
+        except Exception as e:
+            logger.debug("SQL cache: redis %s failed, backing off: %s", op, e)
+            self._redis_off_until = time.monotonic() + self.redis_backoff
+            return None
@@ -116,8 +116,9 @@ async def any_text(m: Message):
         answer = data.get("answer", "")
         if admin and data.get("tool_info"):
             ti = data["tool_info"]
+            cols = ti.get("columns") or []
             rows = ti.get("rows") or []
-            table = "\n".join([str(rows[i]) for i in range(0, min(5, len(rows)))])
+            table = "\n".join([" | ".join(cols)] + [" | ".join(map(str, r)) for r in rows[:5]]) if rows else ""
             answer += f"\n\nSQL: {ti.get('sql')}\n{table}"
         await m.answer(answer)
 
@@ -24,21 +24,21 @@ export default function DbSummary({ tool }: { tool: ToolInfo }) {
         </div>
       )}
 
-      {tool.rows && tool.rows.length > 0 && (
+      {tool.columns && tool.rows && tool.rows.length > 0 && (
         <div className="overflow-x-auto">
           <table className="w-full text-xs border-collapse">
             <thead>
               <tr className="text-left text-neutral-600">
-                {Object.keys(tool.rows[0]).map((k) => (
-                  <th key={k} className="border-b p-1 pr-3 font-medium">{k}</th>
+                {tool.columns.map((c) => (
+                  <th key={c} className="border-b p-1 pr-3 font-medium">{c}</th>
                 ))}
               </tr>
             </thead>
             <tbody>
               {tool.rows.slice(0, 20).map((row, i) => (
                 <tr key={i} className="align-top">
-                  {Object.keys(tool.rows![0]).map((k) => (
-                    <td key={k} className="border-b p-1 pr-3 text-neutral-800">{String((row as any)[k])}</td>
+                  {row.map((v, j) => (
+                    <td key={j} className="border-b p-1 pr-3 text-neutral-800">{String(v)}</td>
                   ))}
                 </tr>
               ))}
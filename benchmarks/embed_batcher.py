@@ -0,0 +1,101 @@
+"""Throughput vs tail latency of EmbeddingBatcher at different window sizes.
+
+Usage:
+    python -m benchmarks.embed_batcher                      # simulated encoder
+    python -m benchmarks.embed_batcher --model sentence-transformers/all-MiniLM-L6-v2
+
+The simulated encoder models a CPU forward pass as a fixed per-call overhead
+plus a small per-item cost, which is what makes batch-of-one encodes wasteful.
+"""
+import argparse
+import statistics
+import threading
+import time
+from typing import Callable, List
+
+from apps.api.embed_batcher import EmbeddingBatcher
+
+
+def simulated_encoder(overhead_ms: float, per_item_ms: float, dim: int = 384) -> Callable[[List[str]], List[List[float]]]:
+    lock = threading.Lock()  # one "CPU": encoder calls do not overlap
+
+    def encode(texts: List[str]) -> List[List[float]]:
+        with lock:
+            time.sleep((overhead_ms + per_item_ms * len(texts)) / 1000.0)
+        return [[float(len(t))] * dim for t in texts]
+
+    return encode
+
+
+def model_encoder(name: str) -> Callable[[List[str]], List[List[float]]]:
+    from sentence_transformers import SentenceTransformer
+
+    m = SentenceTransformer(name)
+    lock = threading.Lock()
+
+    def encode(texts: List[str]) -> List[List[float]]:
+        with lock:
+            return m.encode(texts, normalize_embeddings=True).tolist()
+
+    return encode
+
+
+def run(encode, window_ms: float, clients: int, requests: int, max_batch: int) -> dict:
+    batcher = EmbeddingBatcher(encode, window_ms=window_ms, max_batch=max_batch) if window_ms >= 0 else None
+    latencies: List[float] = []
+    lat_lock = threading.Lock()
+
+    def client(cid: int):
+        local = []
+        for i in range(requests):
+            text = f"как вернуть товар {cid}-{i}"
+            t0 = time.perf_counter()
+            if batcher is not None:
+                batcher.embed(text)
+            else:
+                encode([text])
+            local.append(time.perf_counter() - t0)
+        with lat_lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(clients)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    stats = batcher.stats() if batcher is not None else {"embed_batch_avg": 1.0}
+    if batcher is not None:
+        batcher.close()
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return {
+        "window_ms": "off" if window_ms < 0 else window_ms,
+        "qps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": p99 * 1000,
+        "avg_batch": stats["embed_batch_avg"],
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model", default=None, help="SentenceTransformer model; simulated encoder if omitted")
+    ap.add_argument("--clients", type=int, default=32)
+    ap.add_argument("--requests", type=int, default=20, help="requests per client")
+    ap.add_argument("--max-batch", type=int, default=32)
+    ap.add_argument("--windows", default="-1,0,1,2,5,10,20", help="comma-separated ms; -1 = no batcher")
+    ap.add_argument("--overhead-ms", type=float, default=4.0)
+    ap.add_argument("--per-item-ms", type=float, default=0.3)
+    args = ap.parse_args()
+
+    encode = model_encoder(args.model) if args.model else simulated_encoder(args.overhead_ms, args.per_item_ms)
+    print(f"{'window_ms':>9} {'qps':>9} {'p50_ms':>8} {'p99_ms':>8} {'avg_batch':>9}")
+    for w in (float(x) for x in args.windows.split(",")):
+        r = run(encode, w, args.clients, args.requests, args.max_batch)
+        print(f"{r['window_ms']:>9} {r['qps']:>9.1f} {r['p50_ms']:>8.1f} {r['p99_ms']:>8.1f} {r['avg_batch']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
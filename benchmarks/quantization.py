@@ -0,0 +1,60 @@
+"""recall@k and memory of compressed FAISS engines against the float32 baseline.
+
+Usage:
+    python -m benchmarks.quantization                          # random unit vectors
+    python -m benchmarks.quantization --faiss-dir data/copilot/faiss
+    python -m benchmarks.quantization --n 20000 --dim 384 --k 5
+"""
+import argparse
+
+import faiss
+import numpy as np
+
+from apps.api.faiss_engine import FaissEngine, IndexSpec, evaluate_recall
+
+
+SPECS = [
+    IndexSpec(kind="flat"),
+    IndexSpec(kind="flat", codec="int8"),
+    IndexSpec(kind="flat", codec="pq", pq_m=48),
+    IndexSpec(kind="flat", codec="pq", pq_m=24),
+    IndexSpec(kind="flat", dim_reduction="pca", target_dim=128),
+    IndexSpec(kind="flat", dim_reduction="pca", target_dim=128, codec="int8"),
+    IndexSpec(kind="flat", dim_reduction="truncate", target_dim=192, codec="int8"),
+    IndexSpec(kind="ivf_flat", codec="int8", nprobe=16),
+    IndexSpec(kind="ivf_pq", pq_m=48, nprobe=16),
+]
+
+
+def load_vectors(args) -> np.ndarray:
+    if args.faiss_dir:
+        index = faiss.read_index(f"{args.faiss_dir}/index.faiss")
+        return index.reconstruct_n(0, index.ntotal)
+    rng = np.random.default_rng(0)
+    # clustered data resembles real embeddings better than isotropic noise
+    centers = rng.normal(size=(max(1, args.n // 50), args.dim)).astype("float32")
+    x = centers[rng.integers(0, len(centers), args.n)] + 0.3 * rng.normal(size=(args.n, args.dim)).astype("float32")
+    faiss.normalize_L2(x)
+    return x
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--faiss-dir", default=None, help="use vectors of a saved langchain index")
+    ap.add_argument("--n", type=int, default=10000)
+    ap.add_argument("--dim", type=int, default=384)
+    ap.add_argument("--k", type=int, default=10)
+    args = ap.parse_args()
+
+    x = load_vectors(args)
+    print(f"{len(x)} vectors, dim {x.shape[1]}, recall@{args.k} vs exact float32")
+    print(f"{'index':<44} {'recall':>7} {'bytes':>12} {'x smaller':>9}")
+    for spec in SPECS:
+        desc = spec.factory(spec.truncate_dim(x.shape[1]) or x.shape[1], len(x))
+        eng = FaissEngine.build(x, [""] * len(x), [{}] * len(x), [str(i) for i in range(len(x))], spec)
+        r = evaluate_recall(eng, x, k=args.k)
+        print(f"{desc:<44} {r['recall']:>7.3f} {r['bytes']:>12} {r['compression']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
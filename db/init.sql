@@ -31,7 +31,10 @@ CREATE TABLE IF NOT EXISTS order_items(
   price NUMERIC
 );
 
-CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders(created_at);
+CREATE INDEX IF NOT EXISTS idx_orders_created_at_id ON orders(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_orders_status_created_at_id ON orders(status, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_orders_customer_id ON orders(customer_id);
+CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items(order_id);
 CREATE INDEX IF NOT EXISTS idx_order_items_product_id ON order_items(product_id);
 
 -- Create RO role
@@ -0,0 +1 @@
+from .bm25 import BM25Index, tokenize, rrf_fuse
@@ -0,0 +1,149 @@
+import re
+import json
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+_TOKEN_RE = re.compile(r"\w+(?:[-_/.]\w+)*", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens. Composite codes (SKU-123, A1001, pro_plan) are kept
+    whole and also split into parts; long alphabetic words are truncated to a
+    6-char prefix as a cheap stemmer for Russian/English inflections."""
+    out: List[str] = []
+    for m in _TOKEN_RE.finditer((text or "").lower()):
+        tok = m.group(0)
+        parts = re.split(r"[-_/.]", tok)
+        if len(parts) > 1:
+            out.append(tok)
+            out.extend(_stem(p) for p in parts if p)
+        else:
+            out.append(_stem(tok))
+    return out
+
+
+def _stem(tok: str) -> str:
+    return tok[:6] if tok.isalpha() and len(tok) > 6 else tok
+
+
+class BM25Index:
+    """Compact in-memory inverted index with Okapi BM25 scoring.
+
+    Postings are stored as flat numpy arrays (doc ids and term frequencies
+    concatenated per term, addressed by offsets), IDF and document lengths are
+    precomputed at build time, so a query is a handful of vectorized adds.
+    """
+
+    def __init__(self, ids: List[str], vocab: Dict[str, int], offsets: np.ndarray, post_docs: np.ndarray,
+                 post_tf: np.ndarray, idf: np.ndarray, doc_len: np.ndarray, k1: float = 1.2, b: float = 0.75):
+        self.ids = ids
+        self.vocab = vocab
+        self.offsets = offsets
+        self.post_docs = post_docs
+        self.post_tf = post_tf
+        self.idf = idf
+        self.doc_len = doc_len
+        self.k1 = k1
+        self.b = b
+        avgdl = float(doc_len.mean()) if len(doc_len) else 1.0
+        # per-document length normalization term of the BM25 denominator
+        self._norm = (k1 * (1 - b + b * doc_len / max(avgdl, 1e-9))).astype(np.float32)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, docs: Iterable[Tuple[str, str]], k1: float = 1.2, b: float = 0.75) -> "BM25Index":
+        ids: List[str] = []
+        lengths: List[int] = []
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        for doc_no, (doc_id, text) in enumerate(docs):
+            toks = tokenize(text)
+            ids.append(doc_id)
+            lengths.append(len(toks))
+            tf: Dict[str, int] = {}
+            for t in toks:
+                tf[t] = tf.get(t, 0) + 1
+            for t, c in tf.items():
+                postings.setdefault(t, []).append((doc_no, c))
+        vocab = {t: i for i, t in enumerate(sorted(postings))}
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        for t, i in vocab.items():
+            offsets[i + 1] = len(postings[t])
+        offsets = np.cumsum(offsets)
+        post_docs = np.empty(int(offsets[-1]), dtype=np.int32)
+        post_tf = np.empty(int(offsets[-1]), dtype=np.uint16)
+        for t, i in vocab.items():
+            plist = postings[t]
+            s = offsets[i]
+            post_docs[s : s + len(plist)] = [d for d, _ in plist]
+            post_tf[s : s + len(plist)] = [min(c, 65535) for _, c in plist]
+        n = len(ids)
+        df = np.diff(offsets).astype(np.float32)
+        idf = np.log(1.0 + (n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        return cls(ids, vocab, offsets, post_docs, post_tf, idf, np.asarray(lengths, dtype=np.float32), k1, b)
+
+    def search(self, query: str, k: int, mask: Optional[np.ndarray] = None) -> List[Tuple[str, float]]:
+        """Top-k (doc id, score); `mask` is an optional boolean array of allowed documents."""
+        scores = self.scores(query)
+        if scores is None:
+            return []
+        if mask is not None:
+            scores = np.where(mask, scores, 0.0)
+        nz = np.flatnonzero(scores)
+        if not len(nz):
+            return []
+        k = min(k, len(nz))
+        top = nz[np.argpartition(-scores[nz], k - 1)[:k]]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.ids[i], float(scores[i])) for i in top]
+
+    def scores(self, query: str):
+        if not self.ids:
+            return None
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for t in set(tokenize(query)):
+            ti = self.vocab.get(t)
+            if ti is None:
+                continue
+            s, e = self.offsets[ti], self.offsets[ti + 1]
+            docs = self.post_docs[s:e]
+            tf = self.post_tf[s:e].astype(np.float32)
+            scores[docs] += self.idf[ti] * tf * (self.k1 + 1) / (tf + self._norm[docs])
+        return scores
+
+    def save(self, directory: Path, **meta):
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        np.savez(
+            directory / "bm25.npz",
+            offsets=self.offsets, post_docs=self.post_docs, post_tf=self.post_tf, idf=self.idf, doc_len=self.doc_len,
+        )
+        terms = [""] * len(self.vocab)
+        for t, i in self.vocab.items():
+            terms[i] = t
+        info = {"ids": self.ids, "terms": terms, "k1": self.k1, "b": self.b, **meta}
+        (directory / "bm25.json").write_text(json.dumps(info, ensure_ascii=False), encoding="utf-8")
+
+    @classmethod
+    def load(cls, directory: Path) -> Tuple["BM25Index", dict]:
+        directory = Path(directory)
+        info = json.loads((directory / "bm25.json").read_text(encoding="utf-8"))
+        arr = np.load(directory / "bm25.npz")
+        vocab = {t: i for i, t in enumerate(info.pop("terms"))}
+        idx = cls(info.pop("ids"), vocab, arr["offsets"], arr["post_docs"], arr["post_tf"], arr["idf"], arr["doc_len"],
+                  info.pop("k1"), info.pop("b"))
+        return idx, info
+
+
+def rrf_fuse(rankings: Sequence[Sequence[str]], k: int = 60, weights: Sequence[float] | None = None) -> List[Tuple[str, float]]:
+    """Reciprocal rank fusion: score(d) = sum_i w_i / (k + rank_i(d)), rank starting at 1."""
+    fused: Dict[str, float] = {}
+    for r_i, ranking in enumerate(rankings):
+        w = weights[r_i] if weights else 1.0
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + w / (k + rank)
+    return sorted(fused.items(), key=lambda kv: kv[1], reverse=True)
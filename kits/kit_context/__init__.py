@@ -0,0 +1,2 @@
+from .packer import count_tokens, truncate_tokens, pack_texts, cap_json, load_encoder
+from .columnar import to_columnar, from_columnar, compact_rows
@@ -0,0 +1,36 @@
+from typing import Any, Dict, Iterable, List, Optional
+
+
+def to_columnar(records: Iterable[Dict[str, Any]]) -> Dict[str, list]:
+    """`[{"a": 1, "b": 2}, ...]` -> `{"columns": ["a", "b"], "rows": [[1, 2], ...]}`.
+
+    Columns follow first appearance; a key missing from a record becomes None.
+    """
+    records = list(records)
+    columns: List[str] = []
+    for r in records:
+        for k in r:
+            if k not in columns:
+                columns.append(k)
+    return {"columns": columns, "rows": [[r.get(c) for c in columns] for r in records]}
+
+
+def from_columnar(table: Dict[str, list]) -> List[Dict[str, Any]]:
+    columns = table.get("columns") or []
+    return [dict(zip(columns, row)) for row in table.get("rows") or []]
+
+
+def _compact_value(v: Any, digits: Optional[int], max_text: Optional[int]) -> Any:
+    if isinstance(v, float) and digits is not None:
+        v = round(v, digits)
+        return int(v) if v.is_integer() and abs(v) < 2 ** 53 else v
+    if isinstance(v, str) and max_text is not None and len(v) > max_text:
+        return v[: max(0, max_text - 1)] + "…"
+    return v
+
+
+def compact_rows(rows: List[list], digits: Optional[int] = None, max_text: Optional[int] = None) -> List[list]:
+    """Round floats to `digits` and cut strings longer than `max_text` characters."""
+    if digits is None and max_text is None:
+        return rows
+    return [[_compact_value(v, digits, max_text) for v in row] for row in rows]
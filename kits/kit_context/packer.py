@@ -0,0 +1,175 @@
+import re
+import json
+import math
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple, TypeVar
+
+try:  # exact counts for OpenAI models when tiktoken (and its BPE files) are available
+    import tiktoken  # type: ignore
+except ImportError:  # pragma: no cover - optional dependency
+    tiktoken = None
+
+
+T = TypeVar("T")
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# model -> encoder, filled by load_encoder(); counting never loads (or downloads) anything itself
+_encoders: Dict[str, Any] = {}
+
+
+class _HFEncoder:
+    """tiktoken-style encode/decode over a Hugging Face tokenizer."""
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+
+    def encode(self, text: str, disallowed_special=()) -> List[int]:
+        return self.tokenizer.encode(text, add_special_tokens=False)
+
+    def decode(self, ids: List[int]) -> str:
+        return self.tokenizer.decode(ids)
+
+
+def load_encoder(model: Optional[str], tokenizer: Optional[str] = None):
+    """Load the tokenizer behind `model` counts; returns None when none fits.
+
+    tiktoken's encoding for `model` comes first (OpenAI models, no network
+    when its BPE files are cached); the Hugging Face tokenizer `tokenizer`
+    (default: `model`) is tried when one is named explicitly or tiktoken does
+    not know the model. Either may download files, so call this at startup,
+    not on the request path. Until it succeeds counts are estimates.
+    """
+    enc = None
+    known = False
+    if tiktoken is not None and model and not tokenizer:
+        try:
+            encoding = tiktoken.encoding_name_for_model(model)  # KeyError: not an OpenAI model
+            known = True
+            enc = tiktoken.get_encoding(encoding)
+        except Exception:  # unknown model, or its BPE files cannot be downloaded
+            enc = None
+    name = tokenizer or model
+    if enc is None and not known and name:
+        try:
+            from transformers import AutoTokenizer  # type: ignore
+
+            enc = _HFEncoder(AutoTokenizer.from_pretrained(name))
+        except Exception:
+            enc = None
+    if enc is not None:
+        _encoders[model or ""] = enc
+    return enc
+
+
+def _encoder(model: Optional[str]):
+    return _encoders.get(model or "")
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """Token count for `model` with its loaded encoder (see `load_encoder`); otherwise
+    ~4 UTF-8 bytes per token (about 4 Latin or 2 Cyrillic characters), which errs on the high side."""
+    if not text:
+        return 0
+    enc = _encoder(model)
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return math.ceil(len(text.encode("utf-8")) / 4)
+
+
+def truncate_tokens(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    if max_tokens <= 0:
+        return ""
+    enc = _encoder(model)
+    if enc is not None:
+        ids = enc.encode(text, disallowed_special=())
+        return text if len(ids) <= max_tokens else enc.decode(ids[:max_tokens])
+    raw = text.encode("utf-8")
+    if len(raw) <= max_tokens * 4:
+        return text
+    return raw[: max_tokens * 4].decode("utf-8", errors="ignore")
+
+
+def _shingles(text: str, n: int = 3) -> Set[Tuple[str, ...]]:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < n:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i : i + n]) for i in range(len(words) - n + 1)}
+
+
+def pack_texts(
+    items: Sequence[T],
+    text_of: Callable[[T], str],
+    budget: int,
+    per_item: int,
+    model: Optional[str] = None,
+    dedupe: float = 0.8,
+    min_tail: int = 32,
+) -> List[Tuple[T, str]]:
+    """Greedy packing of `items` (most relevant first) into `budget` tokens.
+
+    Each text is capped at `per_item` tokens. An item whose word 3-grams are
+    mostly (>= `dedupe`) contained in already packed text is skipped, which
+    drops overlapping neighbour chunks. The last item may be truncated to fill
+    the budget if at least `min_tail` tokens remain.
+    Returns (item, packed text) pairs in input order.
+    """
+    out: List[Tuple[T, str]] = []
+    seen: Set[Tuple[str, ...]] = set()
+    used = 0
+    for item in items:
+        remaining = budget - used
+        if remaining <= 0:
+            break
+        text = truncate_tokens(text_of(item) or "", per_item, model)
+        if not text.strip():
+            continue
+        sh = _shingles(text)
+        if sh and len(sh & seen) / len(sh) >= dedupe:
+            continue
+        cost = count_tokens(text, model)
+        if cost > remaining:
+            if remaining < min_tail:
+                break
+            text = truncate_tokens(text, remaining, model)
+            cost = remaining
+        out.append((item, text))
+        seen |= sh
+        used += cost
+    return out
+
+
+def cap_json(payload: Any, max_tokens: int, model: Optional[str] = None) -> str:
+    """JSON-encode a tool result within `max_tokens`.
+
+    List values (rows, sources) are shortened from the end first and the number
+    of dropped entries is reported as `truncated`; `columns` of a columnar
+    result is never shortened. Anything still too large is cut as text.
+    """
+    def dump(obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False, default=str)
+
+    s = dump(payload)
+    if count_tokens(s, model) <= max_tokens:
+        return s
+    if isinstance(payload, dict):
+        lists = [k for k, v in payload.items() if isinstance(v, list) and v and k != "columns"]
+        if lists:
+            obj = dict(payload)
+            total = {k: len(payload[k]) for k in lists}
+            for k in lists:
+                lo, hi = 0, total[k]
+                # largest prefix of this list that fits
+                while lo < hi:
+                    mid = (lo + hi + 1) // 2
+                    obj[k] = payload[k][:mid]
+                    obj["truncated"] = {kk: total[kk] - len(obj[kk]) for kk in lists if len(obj[kk]) < total[kk]}
+                    if count_tokens(dump(obj), model) <= max_tokens:
+                        lo = mid
+                    else:
+                        hi = mid - 1
+                obj[k] = payload[k][:lo]
+                obj["truncated"] = {kk: total[kk] - len(obj[kk]) for kk in lists if len(obj[kk]) < total[kk]}
+                s = dump(obj)
+                if count_tokens(s, model) <= max_tokens:
+                    return s
+    return truncate_tokens(s, max_tokens, model)
@@ -2,13 +2,14 @@ from fastapi.testclient import TestClient
 
 
 class FakeStream:
-    def __enter__(self):
-        return self
+    """Async chunk stream as returned by `create(stream=True)`."""
 
-    def __exit__(self, exc_type, exc, tb):
-        return False
+    closed = False
 
-    def __iter__(self):
+    async def close(self):
+        self.closed = True
+
+    async def __aiter__(self):
         class C:  # minimal chunk with delta
             class Choice:
                 class Delta:
@@ -24,7 +25,9 @@ class FakeStream:
 class FakeOpenAI:
     class Chat:
         class Completions:
-            def create(self, **kwargs):
+            async def create(self, **kwargs):
+                if kwargs.get("stream"):
+                    return FakeStream()
                 class Resp:
                     class Choice:
                         class Message:
@@ -36,9 +39,6 @@ class FakeOpenAI:
 
                 return Resp()
 
-            def stream(self, **kwargs):
-                return FakeStream()
-
         completions = Completions()
 
     chat = Chat()
@@ -89,6 +89,29 @@ def test_chat_rag(monkeypatch):
     assert "answer" in j and j["labels"]
 
 
+def test_chat_retrieval_goes_through_embed_batcher(monkeypatch):
+    import numpy as np
+    from apps.api import deps
+    from apps.api.embed_batcher import EmbeddingBatcher
+
+    app = setup_app(monkeypatch)
+
+    class Model:
+        def encode(self, texts, normalize_embeddings=True):
+            return np.asarray([[float(len(t))] for t in texts])
+
+    embedder = deps.STEmbedding.__new__(deps.STEmbedding)
+    embedder.m, embedder.cache = Model(), None
+    embedder.batcher = EmbeddingBatcher(lambda texts: embedder.m.encode(texts).tolist(), window_ms=1)
+    monkeypatch.setattr(deps.state, "embedder", embedder)
+    try:
+        r = TestClient(app).post("/chat", json={"text": "как вернуть товар?", "mode": "faq", "strict": False, "lang": "ru"})
+    finally:
+        embedder.batcher.close()
+    assert r.status_code == 200 and r.json()["labels"]
+    assert embedder.batcher.items >= 1
+
+
 def test_chat_stream_basic(monkeypatch):
     app = setup_app(monkeypatch)
     client = TestClient(app)
@@ -96,3 +119,19 @@ def test_chat_stream_basic(monkeypatch):
         assert r.status_code == 200
         # event-stream content-type
         assert "text/event-stream" in r.headers.get("content-type", "")
+        body = "".join(r.iter_text())
+    assert "event: token" in body and "event: done" in body
+
+
+def test_retrieve_batch(monkeypatch):
+    app = setup_app(monkeypatch)
+    from apps.api import deps
+    monkeypatch.setattr(deps.state, "bm25", None)
+    monkeypatch.setattr(deps.state, "engine", None)
+    client = TestClient(app)
+    r = client.post("/retrieve/batch", json={"queries": ["возврат", "доставка"], "top_k": 1})
+    assert r.status_code == 200
+    res = r.json()["results"]
+    assert [x["query"] for x in res] == ["возврат", "доставка"]
+    assert len(res[0]["sources"]) == 1 and "content" not in res[0]["sources"][0]
+    assert "chunk" not in res[0]["sources"][0]
@@ -0,0 +1,78 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from apps.api import admin_api
+from apps.api.admin_api import encode_cursor, decode_cursor
+
+
+class _Result(list):
+    def scalar(self):
+        return self[0]
+
+
+class _Conn:
+    def __init__(self, rows, scalars):
+        self.rows = rows
+        self.scalars = scalars
+        self.queries = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, stmt, params=None):
+        sql = str(stmt)
+        self.queries.append((sql, dict(params or {})))
+        if sql.lstrip().startswith("SELECT COUNT(*)") or "reltuples" in sql or sql.startswith("EXPLAIN"):
+            return _Result([self.scalars.pop(0)])
+        return _Result(self.rows)
+
+
+def _order(i, created_at):
+    return SimpleNamespace(id=i, order_no=f"A{i}", created_at=created_at, status="new", total=10,
+                           customer_email="a@b.c", customer_city="Москва", items_count=1)
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    c = _Conn([], [])
+    monkeypatch.setattr(admin_api, "engine", SimpleNamespace(connect=lambda: c))
+    monkeypatch.setattr(admin_api, "_count_cache", {})
+    return c
+
+
+def test_cursor_round_trip_and_validation():
+    ts = datetime(2025, 8, 1, 12, 30, 5, 123456)
+    assert decode_cursor(encode_cursor(ts, 42), 2) == [ts.isoformat(), 42]
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor", 2)
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor(1), 2)
+
+
+def test_orders_keyset_page(conn):
+    ts = datetime(2025, 8, 1, 12, 0)
+    conn.rows = [_order(7, ts), _order(6, ts)]
+    first = admin_api.get_orders(limit=2, count="none")
+    assert first["total"] is None and decode_cursor(first["next_cursor"], 2) == [ts.isoformat(), 6]
+
+    conn.rows = [_order(5, ts)]
+    page = admin_api.get_orders(status="new", limit=2, offset=40, cursor=first["next_cursor"], count="none")
+    sql, params = conn.queries[-1]
+    assert "(o.created_at, o.id) < (:c_created_at, :c_id)" in sql and "o.status = :status" in sql
+    assert params["c_created_at"] == ts and params["c_id"] == 6 and params["offset"] == 0
+    assert page["next_cursor"] is None  # short page: nothing more to fetch
+
+
+def test_exact_totals_are_cached_and_estimates_use_statistics(conn):
+    conn.scalars = [120, 5000, [{"Plan": {"Plan Rows": 300}}]]
+    assert admin_api.get_products(count="exact")["total"] == 120
+    assert admin_api.get_products(count="exact")["total"] == 120  # served from the TTL cache
+    assert admin_api.get_customers(count="estimate")["total"] == 5000
+    assert admin_api.get_products(category="Kitchen", count="estimate")["total"] == 300
+    counted = [q for q, _ in conn.queries if "COUNT(*) FROM products" in q]
+    assert len(counted) == 1 and any(q.startswith("EXPLAIN") for q, _ in conn.queries)
@@ -0,0 +1,154 @@
+import json
+
+from apps.api import admin_stats, deps
+
+
+class HashRedis:
+    """Just enough of redis-py (decode_responses=True) for the stats hash."""
+
+    def __init__(self):
+        self.h = {}
+        self.kv = {}
+
+    def set(self, k, v, nx=False, px=None):
+        if nx and k in self.kv:
+            return None
+        self.kv[k] = v
+        return True
+
+    def eval(self, script, numkeys, key, token):
+        assert "redis.call('get'" in script  # compare-and-delete
+        if self.kv.get(key) != token:
+            return 0
+        del self.kv[key]
+        return 1
+
+    def delete(self, k):
+        self.kv.pop(k, None)
+        self.h.pop(k, None)
+
+    def exists(self, k):
+        return int(k in self.h)
+
+    def hgetall(self, k):
+        return dict(self.h.get(k, {}))
+
+    def hget(self, k, f):
+        return self.h.get(k, {}).get(f)
+
+    def hset(self, k, f=None, v=None, mapping=None):
+        d = self.h.setdefault(k, {})
+        d.update(mapping or {f: v})
+
+    def hincrby(self, k, f, n):
+        d = self.h.setdefault(k, {})
+        d[f] = str(int(d.get(f, 0)) + n)
+        return int(d[f])
+
+    def hincrbyfloat(self, k, f, n):
+        d = self.h.setdefault(k, {})
+        d[f] = repr(float(d.get(f, 0)) + n)
+        return float(d[f])
+
+    def transaction(self, func, *watches):
+        """WATCH/MULTI/EXEC: commands run immediately until `multi()`, then queue until exec."""
+        redis, ops = self, []
+
+        class Txn:
+            queued = False
+
+            def multi(self):
+                self.queued = True
+
+            def __getattr__(self, name):
+                fn = getattr(redis, name)
+                return (lambda *a, **kw: ops.append((fn, a, kw))) if self.queued else fn
+
+        func(Txn())
+        return [fn(*a, **kw) for fn, a, kw in ops]
+
+    def pipeline(self, transaction=True):
+        redis, ops = self, []
+
+        class Pipe:
+            def __getattr__(self, name):
+                return lambda *a, **kw: ops.append((name, a, kw))
+
+            def execute(self):
+                return [getattr(redis, name)(*a, **kw) for name, a, kw in ops]
+
+        return Pipe()
+
+
+def _stats(total_orders=3):
+    return {
+        "total_orders": total_orders,
+        "total_revenue": 30.5,
+        "orders_today": 1,
+        "orders_by_status": {"new": 2, "shipped": 1},
+        "top_products": [{"name": "Чайник", "sku": "SKU-001", "orders_count": 2}],
+        "recent_orders": [{"order_no": "A1", "status": "new", "total": 10.0, "customer_email": "a@b.c"}],
+    }
+
+
+def test_read_serves_hash_and_applies_deltas(monkeypatch):
+    r = HashRedis()
+    monkeypatch.setattr(deps.state, "redis", r)
+    computed = []
+
+    def compute():
+        computed.append(1)
+        return _stats()
+
+    first = admin_stats.read(compute)
+    assert first["total_orders"] == 3 and first["orders_by_status"] == {"new": 2, "shipped": 1}
+    admin_stats.on_status_change("A1", "new", "shipped")
+    second = admin_stats.read(compute)
+    assert len(computed) == 1  # constant-time reads between reconciles
+    assert second["orders_by_status"] == {"new": 1, "shipped": 2}
+    assert second["total_orders"] == 3 and second["total_revenue"] == 30.5
+    assert second["recent_orders"][0]["status"] == "shipped"
+
+
+def test_reconcile_skips_a_fresh_hash(monkeypatch):
+    r = HashRedis()
+    monkeypatch.setattr(deps.state, "redis", r)
+    assert admin_stats.reconcile(lambda: _stats(3), min_age=60)["total_orders"] == 3
+    # another worker's loop tick within the interval does not recompute
+    assert admin_stats.reconcile(lambda: _stats(7), min_age=60) is None
+    assert admin_stats.LOCK_KEY not in r.kv
+    r.h[admin_stats.KEY]["reconciled_at"] = "0"
+    assert admin_stats.reconcile(lambda: _stats(7), min_age=60)["total_orders"] == 7
+
+
+def test_stale_hash_is_reconciled(monkeypatch):
+    r = HashRedis()
+    monkeypatch.setattr(deps.state, "redis", r)
+    monkeypatch.setenv("ADMIN_STATS_MAX_STALENESS_S", "60")
+    admin_stats.reconcile(lambda: _stats(3))
+    r.h[admin_stats.KEY]["reconciled_at"] = "0"
+    assert admin_stats.read(lambda: _stats(7))["total_orders"] == 7
+    # while another worker holds the lock, a stale hash is still served
+    r.h[admin_stats.KEY]["reconciled_at"] = "0"
+    r.set(admin_stats.LOCK_KEY, "1")
+    assert admin_stats.read(lambda: _stats(9))["total_orders"] == 7
+    assert json.loads(r.hget(admin_stats.KEY, "top_products"))[0]["sku"] == "SKU-001"
+
+
+def test_without_redis_computes_live(monkeypatch):
+    monkeypatch.setattr(deps.state, "redis", None)
+    admin_stats.on_status_change("A1", "new", "shipped")  # no-op
+    assert admin_stats.read(lambda: _stats(5))["total_orders"] == 5
+
+
+def test_reconcile_keeps_a_lock_it_no_longer_owns(monkeypatch):
+    r = HashRedis()
+    monkeypatch.setattr(deps.state, "redis", r)
+
+    def slow_compute():
+        # our lock expired mid-compute and another worker took it
+        r.kv[admin_stats.LOCK_KEY] = "other-worker"
+        return _stats()
+
+    assert admin_stats.reconcile(slow_compute) is not None
+    assert r.kv[admin_stats.LOCK_KEY] == "other-worker"
@@ -0,0 +1,293 @@
+import asyncio
+import json
+import types
+
+
+def _tool_call(i, name, args):
+    fn = types.SimpleNamespace(name=name, arguments=json.dumps(args))
+    return types.SimpleNamespace(id=f"call_{i}", function=fn)
+
+
+class ScriptedClient:
+    """Returns the scripted tool calls on the first turn, then a plain answer."""
+
+    def __init__(self, tool_calls, content=""):
+        self.turns = [tool_calls, None]
+        self.content = content
+        self.requests = []
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self.create))
+
+    async def create(self, **kwargs):
+        self.requests.append(kwargs)
+        calls = self.turns.pop(0) if self.turns else None
+        msg = types.SimpleNamespace(content=self.content, tool_calls=calls)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=msg)])
+
+
+async def test_tools_of_one_turn_run_concurrently(monkeypatch):
+    from apps.api import agentic, deps
+
+    events = []
+
+    async def slow_retrieve(q, top_k=None, partition=None):
+        events.append(("start", q))
+        await asyncio.sleep(0.2)
+        events.append(("end", q))
+        return [{"id": "d0", "snippet": q}]
+
+    async def slow_order(question):
+        events.append(("start", question))
+        await asyncio.sleep(0.2)
+        events.append(("end", question))
+        return {"name": "orders.status", "rows": [], "summary": question}
+
+    client = ScriptedClient([
+        _tool_call(0, "rag_read", {"question": "возврат"}),
+        _tool_call(1, "orders_status", {"order_no": "A1001"}),
+        _tool_call(2, "rag_read", {"question": "ещё раз"}),
+    ])
+    monkeypatch.setattr(deps.state, "client", client)
+    monkeypatch.setattr(agentic, "aretrieve", slow_retrieve)
+    monkeypatch.setattr(agentic, "order_status_tool", slow_order)
+
+    trace: dict = {}
+    _ans, sources, labels, tool_info = await agentic.run_agentic("вопрос", False, trace=trace)
+    # both tools started before either finished
+    tools = [e for e in events if e[1] in ("возврат", "#A1001")]
+    assert [kind for kind, _ in tools[:2]] == ["start", "start"] and len(tools) == 4
+    assert labels == ["RAG", "Tool-call"]
+    assert sources[0]["snippet"] == "возврат" and tool_info["summary"] == "#A1001"
+    assert [t["name"] for t in trace["tools"]] == ["rag_read", "orders_status"]
+    assert trace["tool_latency_ms"] >= 200
+    # every tool call of the turn is answered, in order
+    tool_msgs = [m for m in client.requests[1]["messages"] if m["role"] == "tool"]
+    assert [m["tool_call_id"] for m in tool_msgs] == ["call_0", "call_1", "call_2"]
+    assert json.loads(tool_msgs[2]["content"]) == {"error": "already_executed"}
+
+
+async def test_tool_timeout_is_reported_to_model(monkeypatch):
+    from apps.api import agentic, deps
+
+    async def hang(question):
+        await asyncio.sleep(10)
+
+    client = ScriptedClient([_tool_call(0, "orders_status", {"order_no": "A1"})])
+    monkeypatch.setattr(deps.state, "client", client)
+    monkeypatch.setattr(agentic, "order_status_tool", hang)
+    monkeypatch.setenv("TOOL_TIMEOUT_ORDERS_STATUS_S", "0.05")
+
+    async def no_sources(*a, **kw):
+        return []
+
+    monkeypatch.setattr(agentic, "aretrieve", no_sources)
+    _ans, _sources, labels, tool_info = await agentic.run_agentic("где заказ", False)
+    assert tool_info is None and "Tool-call" not in labels
+    tool_msgs = [m for m in client.requests[1]["messages"] if m["role"] == "tool"]
+    assert json.loads(tool_msgs[0]["content"]) == {"error": "timeout"}
+
+
+async def test_fast_path_skips_tool_selection(monkeypatch):
+    from apps.api import agentic, deps
+
+    async def order(question):
+        return {"name": "orders.status", "rows": [], "summary": question}
+
+    client = ScriptedClient([])
+    monkeypatch.setattr(deps.state, "client", client)
+    monkeypatch.setattr(agentic, "order_status_tool", order)
+    trace: dict = {}
+    _ans, _sources, labels, tool_info = await agentic.run_agentic("где заказ #A1001?", False, trace=trace)
+    assert client.requests == []
+    assert labels == ["Tool-call"] and tool_info["summary"] == "#A1001"
+    assert trace["route"] == "rules"
+
+
+def test_centroid_classifier():
+    from apps.api.intent import CentroidClassifier
+
+    axes = {"a": [1.0, 0.0], "b": [0.0, 1.0]}
+
+    def embed(texts):
+        return [axes[t[0]] for t in texts]
+
+    clf = CentroidClassifier(embed, {"x": ["a1", "a2"], "y": ["b1"]})
+    label, sim, margin = clf.classify([0.9, 0.1])
+    assert label == "x" and sim > 0.9 and margin > 0.5
+
+
+async def test_rag_read_reuses_prefetch(monkeypatch):
+    from apps.api import agentic, deps
+
+    calls = []
+
+    async def retrieve(q, top_k=None, partition=None):
+        calls.append(q)
+        await asyncio.sleep(0.05)
+        return [{"id": f"d{i}", "snippet": f"{q} {i}"} for i in range(top_k)]
+
+    client = ScriptedClient([_tool_call(0, "rag_read", {"question": "Как вернуть товар"})])
+    monkeypatch.setattr(deps.state, "client", client)
+    monkeypatch.setattr(deps.state, "metrics", {})
+    monkeypatch.setattr(agentic, "aretrieve", retrieve)
+    monkeypatch.setenv("RAG_TOP_K", "3")
+    _ans, sources, labels, _ti = await agentic.run_agentic("как вернуть товар?", False)
+    assert calls == ["как вернуть товар?"] and len(sources) == 3 and labels == ["RAG"]
+    assert deps.state.metrics["rag_prefetch_hits"] == 1
+    assert "rag_prefetch_wasted" not in deps.state.metrics
+
+
+class StreamingClient:
+    """Streams scripted turns; a turn is a list of deltas (SimpleNamespace)."""
+
+    def __init__(self, turns):
+        self.turns = turns
+        self.requests = []
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self.create))
+
+    async def create(self, **kwargs):
+        self.requests.append(kwargs)
+        deltas = self.turns.pop(0)
+
+        class Stream:
+            async def close(self):
+                pass
+
+            async def __aiter__(self):
+                for d in deltas:
+                    yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=d)])
+
+        return Stream()
+
+
+def _delta(content=None, tool=None):
+    calls = None
+    if tool is not None:
+        index, call_id, name, args = tool
+        calls = [types.SimpleNamespace(index=index, id=call_id, function=types.SimpleNamespace(name=name, arguments=args))]
+    return types.SimpleNamespace(content=content, tool_calls=calls)
+
+
+async def test_stream_agentic_streams_final_turn(monkeypatch):
+    from apps.api import agentic, deps
+
+    async def retrieve(q, top_k=None, partition=None):
+        return [{"id": "d0", "snippet": q, "filename": "returns.md"}]
+
+    client = StreamingClient([
+        [_delta(tool=(0, "call_0", "rag_read", '{"quest')), _delta(tool=(0, None, None, 'ion": "возврат"}'))],
+        [_delta(content="Можно вернуть "), _delta(content="за 14 дней [d0].")],
+    ])
+    monkeypatch.setattr(deps.state, "client", client)
+    monkeypatch.setattr(agentic, "aretrieve", retrieve)
+    monkeypatch.setenv("AGENT_STREAM_HOLDBACK_CHARS", "0")
+
+    events = [ev async for ev in agentic.stream_agentic("как вернуть?", False)]
+    assert [e["event"] for e in events] == ["context", "token", "token", "done"]
+    ctx = json.loads(events[0]["data"])
+    assert ctx["labels"] == ["RAG"] and ctx["sources"][0]["id"] == "d0"
+    assert "".join(json.loads(e["data"])["t"] for e in events[1:3]).endswith("[d0].")
+    assert len(client.requests) == 2 and client.requests[0]["stream"] is True
+    tool_msg = client.requests[1]["messages"][-1]
+    assert tool_msg["role"] == "tool" and tool_msg["tool_call_id"] == "call_0"
+
+
+async def test_stream_agentic_drops_preamble_before_tool_calls(monkeypatch):
+    from apps.api import agentic, deps
+
+    async def retrieve(q, top_k=None, partition=None):
+        return [{"id": "d0", "snippet": q, "chunk": "Возврат в течение 14 дней.", "filename": "returns.md"}]
+
+    client = StreamingClient([
+        [_delta(content="Сейчас проверю. "), _delta(tool=(0, "call_0", "rag_read", '{"question": "возврат"}'))],
+        [_delta(content="Можно вернуть за 14 дней [d0].")],
+    ])
+    monkeypatch.setattr(deps.state, "client", client)
+    monkeypatch.setattr(agentic, "aretrieve", retrieve)
+
+    events = [ev async for ev in agentic.stream_agentic("как вернуть?", False)]
+    assert [e["event"] for e in events] == ["context", "token", "done"]
+    assert "chunk" not in json.loads(events[0]["data"])["sources"][0]
+    assert json.loads(events[1]["data"])["t"] == "Можно вернуть за 14 дней [d0]."
+    assert client.requests[1]["messages"][-1]["tool_call_id"] == "call_0"
+
+
+async def test_single_pass_first_turn_sees_retrieved_context(monkeypatch):
+    from apps.api import agentic, deps
+
+    async def retrieve(q, top_k=None, partition=None):
+        return [{"id": "d0", "chunk": "Возврат в течение 14 дней.", "filename": "returns.md"}]
+
+    client = ScriptedClient(None, content="Можно вернуть за 14 дней [d0].")
+    monkeypatch.setattr(deps.state, "client", client)
+    monkeypatch.setattr(agentic, "aretrieve", retrieve)
+    monkeypatch.setenv("AGENT_SINGLE_PASS", "true")
+    final, sources, labels, _ti = await agentic.run_agentic("как вернуть товар?", False)
+    assert final.endswith("[d0].") and len(client.requests) == 1
+    assert labels == ["RAG"] and sources[0]["id"] == "d0"
+    messages = client.requests[0]["messages"]
+    assert messages[-1]["role"] == "user"
+    assert any(m["role"] == "system" and "Возврат в течение 14 дней." in m["content"] for m in messages)
+
+
+async def test_single_pass_rag_read_sources_get_fresh_ids(monkeypatch):
+    from apps.api import agentic, deps
+
+    docs = {
+        "как вернуть товар?": [{"id": "d0", "chunk": "Возврат в течение 14 дней.", "filename": "returns.md"}],
+        "сроки доставки": [{"id": "d0", "chunk": "Доставка 2-5 дней.", "filename": "delivery.md"},
+                           {"id": "d1", "chunk": "Возврат в течение 14 дней.", "filename": "returns.md"}],
+    }
+
+    async def retrieve(q, top_k=None, partition=None):
+        return docs[q]
+
+    client = ScriptedClient([_tool_call(0, "rag_read", {"question": "сроки доставки"})], content="Ответ [d1].")
+    monkeypatch.setattr(deps.state, "client", client)
+    monkeypatch.setattr(agentic, "aretrieve", retrieve)
+    monkeypatch.setenv("AGENT_SINGLE_PASS", "true")
+    monkeypatch.setenv("RAG_PREFETCH", "false")
+    _final, sources, labels, _ti = await agentic.run_agentic("как вернуть товар?", False)
+    assert [(s["id"], s["filename"]) for s in sources] == [("d0", "returns.md"), ("d1", "delivery.md")]
+    tool_msg = client.requests[1]["messages"][-1]
+    shown = json.loads(tool_msg["content"])["sources"]
+    assert [(s["id"], s["filename"]) for s in shown] == [("d1", "delivery.md"), ("d0", "returns.md")]
+
+
+async def test_run_agentic_single_pass_returns_answer(monkeypatch):
+    from apps.api import agentic, deps
+
+    async def retrieve(q, top_k=None, partition=None):
+        return []
+
+    client = ScriptedClient(None, content="Здравствуйте!")
+    monkeypatch.setattr(deps.state, "client", client)
+    monkeypatch.setattr(agentic, "aretrieve", retrieve)
+    monkeypatch.setenv("AGENT_SINGLE_PASS", "true")
+    final, _sources, _labels, _ti = await agentic.run_agentic("привет", False)
+    assert final == "Здравствуйте!" and len(client.requests) == 1
+    assert "[d0]" in client.requests[0]["messages"][1]["content"]
+
+
+async def test_prefetch_released_when_completion_fails(monkeypatch):
+    import pytest
+    from apps.api import agentic, deps
+
+    started = asyncio.Event()
+
+    async def retrieve(q, top_k=None, partition=None):
+        started.set()
+        await asyncio.sleep(10)
+
+    async def boom(**kwargs):
+        await started.wait()
+        raise RuntimeError("upstream down")
+
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=boom)))
+    monkeypatch.setattr(deps.state, "client", client)
+    monkeypatch.setattr(deps.state, "metrics", {})
+    monkeypatch.setattr(agentic, "aretrieve", retrieve)
+    with pytest.raises(RuntimeError):
+        await agentic.run_agentic("как вернуть товар?", False)
+    assert deps.state.metrics["rag_prefetch_wasted"] == 1
+    await asyncio.sleep(0)  # let the cancellation land
+    assert not [t for t in asyncio.all_tasks() if t is not asyncio.current_task() and not t.done()]
@@ -0,0 +1,28 @@
+from kits.kit_bm25 import BM25Index, tokenize, rrf_fuse
+
+
+def test_tokenize_keeps_codes():
+    toks = tokenize("Заказ #A1001, артикул SKU-42 и тариф Pro")
+    assert "a1001" in toks and "sku-42" in toks and "sku" in toks and "42" in toks
+
+
+def test_bm25_ranks_exact_code_first(tmp_path):
+    docs = [
+        ("d0", "Политика возврата: 14 дней на возврат товара"),
+        ("d1", "Тариф Pro стоит 990 рублей, тариф Basic бесплатный"),
+        ("d2", "Артикул SKU-42 снят с продажи"),
+    ]
+    idx = BM25Index.build(docs)
+    assert idx.search("что с SKU-42?", 2)[0][0] == "d2"
+    assert idx.search("тариф pro", 1)[0][0] == "d1"
+    assert idx.search("несуществующее", 3) == []
+
+    idx.save(tmp_path, source_version="v1")
+    loaded, meta = BM25Index.load(tmp_path)
+    assert meta["source_version"] == "v1"
+    assert loaded.search("возвраты", 1)[0][0] == "d0"
+
+
+def test_rrf_fuse():
+    fused = rrf_fuse([["a", "b", "c"], ["c", "a"]], k=60)
+    assert [d for d, _ in fused][:2] == ["a", "c"]
@@ -0,0 +1,95 @@
+import json
+
+from kits.kit_context import count_tokens, truncate_tokens, pack_texts, cap_json, to_columnar, from_columnar
+
+
+def test_truncate_respects_budget():
+    text = "доставка занимает от двух до пяти рабочих дней " * 50
+    out = truncate_tokens(text, 20)
+    assert count_tokens(out) <= 20 and text.startswith(out)
+
+
+def test_pack_texts_budget_and_dedupe():
+    a = "возврат товара возможен в течение 14 дней с момента получения заказа"
+    b = "товара возможен в течение 14 дней с момента получения заказа"  # overlapping neighbour chunk
+    c = "оплата картой или переводом через СБП"
+    packed = pack_texts([a, b, c], lambda t: t, budget=1000, per_item=100)
+    assert [t for _, t in packed] == [a, c]
+    tight = pack_texts([a, c], lambda t: t, budget=count_tokens(a) + 5, per_item=100, min_tail=32)
+    assert [t for _, t in tight] == [a]
+
+
+def test_cap_json_shortens_lists_first():
+    payload = {"name": "db_analytics.query", "rows": [{"id": i, "city": "Москва"} for i in range(200)]}
+    out = json.loads(cap_json(payload, 200))
+    assert out["name"] == "db_analytics.query"
+    assert 0 < len(out["rows"]) < 200 and out["truncated"] == {"rows": 200 - len(out["rows"])}
+    assert cap_json({"a": 1}, 200) == '{"a": 1}'
+
+
+def test_columnar_round_trip_and_token_savings(monkeypatch):
+    from apps.api.context import tool_content
+    records = [{"city": "Москва", "orders": i, "revenue": 1234.5678 + i, "comment": "x" * 300} for i in range(20)]
+    table = to_columnar(records)
+    assert table["columns"] == ["city", "orders", "revenue", "comment"] and from_columnar(table) == records
+    monkeypatch.setenv("TOOL_RESULT_MAX_TOKENS", "100000")
+    compact = json.loads(tool_content({"name": "db_analytics.query", **table}))
+    assert compact["rows"][0][2] == 1234.57 and len(compact["rows"][0][3]) == 200
+    assert count_tokens(tool_content(table)) < count_tokens(json.dumps({"rows": records}, ensure_ascii=False)) * 0.8
+
+
+def test_cap_json_keeps_columns():
+    table = {"columns": ["id", "city"], "rows": [[i, "Москва"] for i in range(200)]}
+    out = json.loads(cap_json(table, 100))
+    assert out["columns"] == ["id", "city"] and out["truncated"] == {"rows": 200 - len(out["rows"])}
+
+
+def test_counts_use_only_a_loaded_encoder(monkeypatch):
+    from kits.kit_context import packer
+
+    class Boom:
+        def __getattr__(self, name):
+            raise AssertionError("tiktoken touched on the request path")
+
+    class WordEncoder:
+        def encode(self, text, disallowed_special=()):
+            return text.split()
+
+        def decode(self, ids):
+            return " ".join(ids)
+
+    monkeypatch.setattr(packer, "tiktoken", Boom())
+    monkeypatch.setattr(packer, "_encoders", {})
+    assert count_tokens("привет мир", "qwen/qwen3") == 5  # 19 UTF-8 bytes, estimated
+    packer._encoders["qwen/qwen3"] = WordEncoder()
+    assert count_tokens("привет мир", "qwen/qwen3") == 2
+    assert truncate_tokens("один два три", 2, "qwen/qwen3") == "один два"
+
+
+def test_load_encoder_prefers_tiktoken_for_openai_models(monkeypatch):
+    import sys
+    import types
+    from kits.kit_context import packer, load_encoder
+
+    hf_calls = []
+
+    class AutoTokenizer:
+        @staticmethod
+        def from_pretrained(name):
+            hf_calls.append(name)
+            raise OSError("offline")
+
+    def encoding_name_for_model(model):
+        if model.startswith("gpt-"):
+            return "o200k_base"
+        raise KeyError(model)
+
+    fake_tiktoken = types.SimpleNamespace(encoding_name_for_model=encoding_name_for_model,
+                                          get_encoding=lambda name: f"enc:{name}")
+    monkeypatch.setattr(packer, "tiktoken", fake_tiktoken)
+    monkeypatch.setattr(packer, "_encoders", {})
+    monkeypatch.setitem(sys.modules, "transformers", types.SimpleNamespace(AutoTokenizer=AutoTokenizer))
+
+    assert load_encoder("gpt-4o-mini") == "enc:o200k_base" and hf_calls == []
+    assert load_encoder("qwen/qwen3") is None and hf_calls == ["qwen/qwen3"]
+    assert load_encoder("gpt-4o-mini", "Qwen/Qwen3-4B") is None and hf_calls[-1] == "Qwen/Qwen3-4B"
@@ -0,0 +1,45 @@
+import os
+
+from apps.api.docstore import DocStore
+
+
+def test_docstore_serves_from_memory_and_refreshes(tmp_path):
+    p = tmp_path / "a.md"
+    p.write_text("первая версия", encoding="utf-8")
+    ds = DocStore(check_interval=0.0)
+    assert ds.put(str(p)) == "первая версия"
+
+    p.write_text("вторая версия!", encoding="utf-8")
+    os.utime(p, ns=(1, 1))
+    assert ds.get(str(p)) == "вторая версия!"
+
+
+def test_docstore_no_fs_access_within_interval(tmp_path):
+    p = tmp_path / "a.md"
+    p.write_text("text", encoding="utf-8")
+    ds = DocStore(check_interval=3600)
+    ds.put(str(p))
+    p.unlink()
+    assert ds.get(str(p)) == "text"
+
+
+def test_docstore_lru_eviction(tmp_path):
+    paths = []
+    for i in range(3):
+        p = tmp_path / f"{i}.md"
+        p.write_text("x" * 100, encoding="utf-8")
+        paths.append(str(p))
+    ds = DocStore(max_bytes=250)
+    for p in paths:
+        ds.put(p)
+    assert paths[0] not in ds
+    assert paths[2] in ds and ds.nbytes <= 250
+
+
+def test_docstore_mmap(tmp_path):
+    p = tmp_path / "a.md"
+    p.write_text("mapped text", encoding="utf-8")
+    ds = DocStore(use_mmap=True)
+    assert ds.put(str(p)) == "mapped text"
+    ds.clear()
+    assert len(ds) == 0
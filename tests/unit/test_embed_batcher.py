@@ -0,0 +1,51 @@
+import threading
+
+import pytest
+
+from apps.api.embed_batcher import EmbeddingBatcher
+
+
+def test_batcher_coalesces_concurrent_calls():
+    calls = []
+
+    def encode(texts):
+        calls.append(len(texts))
+        return [[float(len(t))] for t in texts]
+
+    b = EmbeddingBatcher(encode, window_ms=50, max_batch=8)
+    out = {}
+
+    def worker(i):
+        out[i] = b.embed("x" * i)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(1, 9)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    b.close()
+    assert out == {i: [float(i)] for i in range(1, 9)}
+    assert len(calls) < 8 and sum(calls) == 8
+
+
+def test_batcher_propagates_errors():
+    def encode(texts):
+        raise RuntimeError("boom")
+
+    b = EmbeddingBatcher(encode, window_ms=1)
+    with pytest.raises(RuntimeError):
+        b.embed("q")
+    b.close()
+
+
+def test_batcher_fails_short_encoder_output():
+    b = EmbeddingBatcher(lambda ts: [[1.0]] * (len(ts) - 1), window_ms=1)
+    with pytest.raises(ValueError):
+        b.embed("q")  # would otherwise wait forever on an unresolved future
+    b.close()
+
+
+async def test_batcher_async():
+    b = EmbeddingBatcher(lambda ts: [[1.0] for _ in ts], window_ms=1)
+    assert await b.aembed("q") == [1.0]
+    b.close()
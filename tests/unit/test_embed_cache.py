@@ -0,0 +1,51 @@
+import numpy as np
+
+from apps.api.embed_cache import EmbeddingCache
+
+
+class BytesRedis:
+    def __init__(self):
+        self.d = {}
+
+    def get(self, k):
+        return self.d.get(k)
+
+    def setex(self, k, ttl, v):
+        self.d[k] = v
+
+
+def test_embedding_cache_lru_and_redis_tiers():
+    r = BytesRedis()
+    c = EmbeddingCache("m", redis=r, max_items=1)
+    norm = c.normalize("  Как   вернуть товар? ")
+    assert c.get(norm) is None
+    c.put(norm, [0.5, -0.25, 1.0])
+    assert c.get(norm) == [0.5, -0.25, 1.0]
+
+    # evicted from LRU by another key, then served from redis as float16
+    c.put(c.normalize("другой"), [0.1, 0.2, 0.3])
+    vec = c.get(norm)
+    assert np.allclose(vec, [0.5, -0.25, 1.0])
+    s = c.stats()
+    assert s["embed_cache_hits"] == 1 and s["embed_cache_redis_hits"] == 1 and s["embed_cache_misses"] == 1
+
+
+def test_embedding_cache_key_includes_model_and_version():
+    c = EmbeddingCache("m", version="v1")
+    k1 = c.key("q")
+    c.version = "v2"
+    assert c.key("q") != k1 and "m" in k1
+
+
+def test_embedding_cache_survives_redis_errors():
+    class Broken:
+        def get(self, k):
+            raise ConnectionError("down")
+
+        def setex(self, *a):
+            raise ConnectionError("down")
+
+    c = EmbeddingCache("m", redis=Broken())
+    c.put("q", [1.0])
+    assert c.get("q") == [1.0]
+    assert c.get("missing") is None
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+from langchain_community.vectorstores import FAISS
+
+from apps.api.faiss_engine import FaissEngine, IndexSpec, ensure_engine
+
+
+def _unit(n, d, seed=0):
+    x = np.random.default_rng(seed).normal(size=(n, d)).astype("float32")
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("kind", ["flat", "hnsw", "ivf_flat", "ivf_pq"])
+def test_engine_build_save_mmap_search(tmp_path, kind):
+    x = _unit(400, 32)
+    texts = [f"t{i}" for i in range(400)]
+    metas = [{"filename": f"{i}.md", "path": f"/x/{i}.md"} for i in range(400)]
+    spec = IndexSpec(kind=kind, nprobe=64, ef_search=128, pq_m=8, pq_nbits=4)
+    FaissEngine.build(x, texts, metas, [f"id{i}" for i in range(400)], spec, "v1").save(tmp_path)
+
+    assert FaissEngine.is_current(tmp_path, spec, "v1")
+    assert not FaissEngine.is_current(tmp_path, spec, "v2")
+    eng = FaissEngine.load(tmp_path, spec, mmap=True)
+    hits = eng.search(x[:3], 2)
+    assert len(hits) == 3
+    if kind != "ivf_pq":
+        assert [h[0][1] for h in hits] == ["t0", "t1", "t2"]
+        assert hits[0][0][0] == "id0" and hits[0][0][3] == pytest.approx(0.0, abs=1e-4)
+    assert hits[0][0][2]["filename"].endswith(".md")
+    assert eng.get("id5") == ("t5", metas[5])
+
+
+def test_unknown_index_type():
+    with pytest.raises(ValueError):
+        IndexSpec(kind="lsh")
+
+
+def test_retrieve_through_engine(tmp_path, monkeypatch, unit_embed):
+    from apps.api import deps, rag
+
+    embed = unit_embed
+    vs = FAISS.from_texts(["возвраты товар в 14 дней", "доставка 2-5 дней"], embed,
+                          metadatas=[{"filename": "a.md"}, {"filename": "b.md"}])
+    eng = ensure_engine(vs, tmp_path, "v1", IndexSpec(kind="flat"))
+    assert eng.ntotal == 2 and sorted(eng.ids) == sorted(vs.index_to_docstore_id.values())
+
+    monkeypatch.setattr(deps.state, "embedder", embed)
+    monkeypatch.setattr(deps.state, "engine", eng)
+    monkeypatch.setattr(deps.state, "faiss", None)
+    sources = rag.retrieve("доставка", top_k=2)
+    assert len(sources) == 2 and 0 <= sources[0]["score"] <= 1
+
+
+@pytest.mark.parametrize("spec", [
+    IndexSpec(kind="flat", codec="int8"),
+    IndexSpec(kind="flat", dim_reduction="truncate", target_dim=16),
+    IndexSpec(kind="hnsw", dim_reduction="pca", target_dim=16, codec="int8"),
+])
+def test_lossy_engine_reports_recall(tmp_path, spec):
+    x = _unit(500, 32, seed=1)
+    eng = FaissEngine.build(x, [str(i) for i in range(500)], [{}] * 500, [str(i) for i in range(500)], spec, "v1")
+    r = eng.report
+    assert 0.0 < r["recall"] <= 1.0 and r["bytes"] > 0
+    if spec.kind == "flat":
+        assert r["compression"] > 1.0
+    eng.save(tmp_path)
+    loaded = FaissEngine.load(tmp_path, spec)
+    assert loaded.truncate == eng.truncate and loaded.report == r
+    assert loaded.search(x[:1], 1)[0]
+
+
+def test_factory_strings():
+    assert IndexSpec(kind="flat", codec="int8").factory(384, 10000) == "IDMap2,SQ8"
+    assert IndexSpec(kind="flat", codec="pq", pq_m=16).factory(384, 10000) == "IVF1,PQ16x8"
+    assert IndexSpec(kind="hnsw", dim_reduction="pca", target_dim=128).factory(384, 10000) == "IDMap2,PCA128,L2norm,HNSW32"
+    assert IndexSpec(kind="ivf_flat", codec="int8", nlist=64).factory(384, 10000).endswith("IVF64,SQ8")
+
+
+@pytest.mark.parametrize("reduction", ["none", "pca", "truncate"])
+def test_flat_pq_partition_filtered_search(reduction):
+    import faiss
+
+    x = _unit(400, 32, seed=2)
+    spec = IndexSpec(kind="flat", codec="pq", dim_reduction=reduction, target_dim=16, pq_m=8, pq_nbits=4)
+    eng = FaissEngine.build(x, [str(i) for i in range(400)], [{}] * 400, [str(i) for i in range(400)], spec, "v1")
+    selector = faiss.IDSelectorBatch(np.arange(0, 400, 3, dtype=np.int64))
+    hits = eng.search(x[:4], 5, selector=selector, limit=134)
+    assert all(len(row) == 5 and all(int(h[0]) % 3 == 0 for h in row) for row in hits)
+
+
+def test_selector_on_index_without_search_params_post_filters():
+    import faiss
+
+    x = _unit(300, 16, seed=3)
+    index = faiss.index_factory(16, "IDMap2,PQ4x4", faiss.METRIC_INNER_PRODUCT)  # layout saved by older builds
+    index.train(x)
+    index.add_with_ids(x, np.arange(300, dtype=np.int64))
+    eng = FaissEngine(index, [str(i) for i in range(300)], [{}] * 300, [str(i) for i in range(300)], IndexSpec(kind="flat", codec="pq"))
+    selector = faiss.IDSelectorBatch(np.arange(0, 300, 2, dtype=np.int64))
+    hits = eng.search(x[:3], 4, selector=selector, limit=150)
+    assert all(len(row) == 4 and all(int(h[0]) % 2 == 0 for h in row) for row in hits)
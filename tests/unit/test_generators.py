@@ -0,0 +1,57 @@
+import asyncio
+import types
+
+
+class SlowStream:
+    """Streams one token, then blocks like an LLM that is still generating."""
+
+    def __init__(self):
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+    async def __aiter__(self):
+        delta = types.SimpleNamespace(content="a")
+        yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=delta)])
+        await asyncio.sleep(3600)
+
+
+def _client(stream):
+    async def create(**kwargs):
+        assert kwargs.get("stream") is True
+        return stream
+
+    return types.SimpleNamespace(chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=create)))
+
+
+async def test_stream_closed_when_consumer_stops(monkeypatch):
+    from apps.api import deps, generators
+
+    stream = SlowStream()
+    monkeypatch.setattr(deps.state, "client", _client(stream))
+    monkeypatch.setattr(deps.state, "metrics", {})
+    gen = generators.llm_stream_answer("q", [])
+    assert (await gen.__anext__())["event"] == "context"
+    assert (await gen.__anext__())["event"] == "token"
+    await gen.aclose()
+    assert stream.closed
+    assert deps.state.metrics["streams_cancelled"] == 1
+
+
+async def test_stream_closed_on_task_cancel(monkeypatch):
+    from apps.api import deps, generators
+
+    stream = SlowStream()
+    monkeypatch.setattr(deps.state, "client", _client(stream))
+    monkeypatch.setattr(deps.state, "metrics", {})
+
+    async def consume():
+        async for _ in generators.llm_stream_answer("q", []):
+            pass
+
+    task = asyncio.ensure_future(consume())
+    await asyncio.sleep(0.05)  # parked waiting for the next token
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    assert stream.closed
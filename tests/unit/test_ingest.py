@@ -0,0 +1,39 @@
+from apps.api.ingest import ingest
+from apps.api.manifest import chunk_id, scan_corpus
+
+
+PARAMS = {"embed_model": "dummy", "chunk_max_tokens": 40, "chunk_overlap": 8}
+
+
+def _corpus(tmp_path, n=6):
+    for i in range(n):
+        (tmp_path / f"f{i}.md").write_text(f"# Раздел {i}\n" + "текст " * 30, encoding="utf-8")
+    return sorted(scan_corpus(tmp_path).items())
+
+
+def _run(items, workers):
+    batches = []
+
+    def sink(texts, metas, ids):
+        assert len(texts) == len(metas) == len(ids) <= 5
+        batches.append(list(ids))
+
+    entries, n = ingest(items, PARAMS, sink, chunk_id, workers=workers, batch_size=5, queue_size=2)
+    return entries, n, batches
+
+
+def test_ingest_streams_batches_and_records_files(tmp_path):
+    items = _corpus(tmp_path)
+    entries, n, batches = _run(items, workers=1)
+    ids = [i for b in batches for i in b]
+    assert n == len(ids) and len(batches) > 1
+    assert set(entries) == {rel for rel, _ in items}
+    assert sum(len(e["chunk_ids"]) for e in entries.values()) == n
+    assert all(e["sha256"] for e in entries.values())
+
+
+def test_ingest_process_pool_matches_serial(tmp_path):
+    items = _corpus(tmp_path)
+    serial = _run(items, workers=1)
+    parallel = _run(items, workers=2)
+    assert serial[0] == parallel[0] and serial[2] == parallel[2]
@@ -0,0 +1,72 @@
+import os
+
+from langchain_community.vectorstores import FAISS
+
+from apps.api import deps
+from apps.api.ingest import prepare_document
+from apps.api.manifest import (
+    new_manifest, scan_corpus, diff_corpus, file_entry, chunk_ids_for, file_sha256, load_manifest,
+)
+
+
+PARAMS = {"embed_model": "dummy", "chunk_max_tokens": 512, "chunk_overlap": 64}
+
+
+def _build(faq, embed):
+    manifest = new_manifest(PARAMS)
+    texts, metas, ids = [], [], []
+    for rel, p in scan_corpus(faq).items():
+        _, path, entry, chunks = prepare_document(rel, str(p), 512, 64)
+        cids = chunk_ids_for(rel, len(chunks))
+        texts += chunks
+        metas += [{"filename": p.name, "path": path}] * len(chunks)
+        ids += cids
+        manifest["files"][rel] = {**entry, "chunk_ids": cids}
+    return FAISS.from_texts(texts, embed, metadatas=metas, ids=ids), manifest
+
+
+def test_diff_corpus_detects_changes(tmp_path):
+    (tmp_path / "a.md").write_text("# A\nтекст", encoding="utf-8")
+    (tmp_path / "b.txt").write_text("b", encoding="utf-8")
+    corpus = scan_corpus(tmp_path)
+    files = {rel: file_entry(p, file_sha256(p), ["x"]) for rel, p in corpus.items()}
+    files["gone.md"] = {"sha256": "0", "chunk_ids": []}
+
+    (tmp_path / "a.md").write_text("# A\nновый текст", encoding="utf-8")
+    os.utime(tmp_path / "b.txt", ns=(1, 1))  # touched, same content
+    (tmp_path / "c.md").write_text("c", encoding="utf-8")
+
+    d = diff_corpus(files, scan_corpus(tmp_path))
+    assert d.added == ["c.md"] and d.changed == ["a.md"] and d.removed == ["gone.md"]
+    assert "b.txt" in d.touched
+
+
+def test_sync_index_reembeds_only_changed_files(tmp_path, monkeypatch, dummy_embed):
+    faq = tmp_path / "faq"
+    idx = tmp_path / "idx"
+    faq.mkdir()
+    idx.mkdir()
+    (faq / "a.md").write_text("# Возвраты\n14 дней", encoding="utf-8")
+    (faq / "b.md").write_text("# Доставка\n2-5 дней", encoding="utf-8")
+    (faq / "c.md").write_text("# Удалить\nстарое", encoding="utf-8")
+    monkeypatch.setattr(deps.state, "docstore", None)
+
+    embed = dummy_embed
+    monkeypatch.setattr(deps.state, "embedder", embed)
+    vs, manifest = _build(faq, embed)
+    embed.calls = 0
+
+    (faq / "a.md").write_text("# Возвраты\n30 дней", encoding="utf-8")
+    (faq / "c.md").unlink()
+    (faq / "d.md").write_text("# Новое\nправило", encoding="utf-8")
+
+    assert deps._sync_index(vs, idx, faq, manifest)
+    assert embed.calls == 2  # a.md and d.md only
+    ids = set(vs.index_to_docstore_id.values())
+    assert ids == {"a.md::0", "b.md::0", "d.md::0"}
+    assert vs.index.ntotal == 3
+    assert set(load_manifest(idx)["files"]) == {"a.md", "b.md", "d.md"}
+
+    embed.calls = 0
+    assert not deps._sync_index(vs, idx, faq, load_manifest(idx))
+    assert embed.calls == 0
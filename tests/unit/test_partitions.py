@@ -0,0 +1,53 @@
+from langchain_community.vectorstores import FAISS
+
+from apps.api.ingest import split_front_matter, partition_of, prepare_document
+from apps.api.partitions import build_partitions, partition_for_mode
+
+
+def test_front_matter_and_partition_tagging(tmp_path):
+    fields, body = split_front_matter("---\npartition: Policies\ntitle: 'x'\n---\n# Возвраты\n")
+    assert fields == {"partition": "Policies", "title": "x"} and body.startswith("# Возвраты")
+    assert partition_of("a.md", fields) == "policies"
+    assert partition_of("orders/a.md", {}) == "orders"
+    assert partition_of("a.md", {}) == "faq"
+
+    p = tmp_path / "a.md"
+    p.write_text("---\npartition: policies\n---\n# Возвраты\n14 дней", encoding="utf-8")
+    _, _, entry, chunks = prepare_document("a.md", str(p), 512, 64)
+    assert entry["partition"] == "policies" and "partition" not in chunks[0]
+
+
+def test_retrieve_searches_only_mode_partition(monkeypatch, dummy_embed):
+    from apps.api import deps, rag
+
+    embed = dummy_embed
+    texts = ["возврат 14 дней", "возврат денег 3-5 дней", "тариф Pro"]
+    metas = [{"partition": "policies"}, {"partition": "faq"}, {"partition": "faq"}]
+    vs = FAISS.from_texts(texts, embed, metadatas=metas, ids=["a", "b", "c"])
+    parts = build_partitions(metas)
+
+    monkeypatch.setattr(deps.state, "embedder", embed)
+    monkeypatch.setattr(deps.state, "faiss", vs)
+    monkeypatch.setattr(deps.state, "engine", None)
+    monkeypatch.setattr(deps.state, "bm25", None)
+    monkeypatch.setattr(deps.state, "partitions", parts)
+
+    assert partition_for_mode("policies", parts) == "policies"
+    assert partition_for_mode("faq", parts) is None
+    assert partition_for_mode("orders", parts) is None  # no such shard: whole corpus
+
+    srcs = rag.retrieve("возврат денег 3-5 дней", top_k=3, partition="policies")
+    assert [s["snippet"] for s in srcs] == ["возврат 14 дней"]
+    assert len(rag.retrieve("возврат", top_k=3)) == 3
+
+
+def test_served_content_has_no_front_matter(tmp_path, monkeypatch):
+    from apps.api import deps, rag
+    from apps.api.docstore import DocStore
+
+    p = tmp_path / "a.md"
+    p.write_text("---\npartition: policies\n---\n# Возвраты\n14 дней", encoding="utf-8")
+    monkeypatch.setattr(deps.state, "docstore", DocStore())
+    assert rag._full_text(str(p)) == "# Возвраты\n14 дней"
+    monkeypatch.setattr(deps.state, "docstore", None)
+    assert rag._full_text(str(p)) == "# Возвраты\n14 дней"
@@ -1,21 +1,12 @@
 import types
 from langchain_community.vectorstores import FAISS
-from langchain_core.embeddings import Embeddings
 
 
-class DummyEmbed(Embeddings):
-    def embed_documents(self, texts):
-        return [[float(len(t))] for t in texts]
-
-    def embed_query(self, text):
-        return [float(len(text))]
-
-
-def test_retrieve_and_confidence(monkeypatch):
+def test_retrieve_and_confidence(monkeypatch, dummy_embed):
     from apps.api import deps, rag
 
     # Build tiny FAISS with dummy embedder
-    embed = DummyEmbed()
+    embed = dummy_embed
     vs = FAISS.from_texts(["возвраты товар в 14 дней", "доставка 2-5 дней"], embed)
 
     deps.state.embedder = embed
@@ -27,3 +18,60 @@ def test_retrieve_and_confidence(monkeypatch):
     conf = rag.compute_confidence(sources)
     assert 0 <= conf <= 1
 
+
+def test_retrieve_hybrid_finds_exact_code(monkeypatch, dummy_embed):
+    from apps.api import deps, rag
+    from kits.kit_bm25 import BM25Index
+
+    embed = dummy_embed
+    texts = ["возвраты товар в 14 дней", "доставка 2-5 дней", "артикул SKU-42 снят с продажи", "тариф Pro"]
+    vs = FAISS.from_texts(texts, embed, ids=[f"c{i}" for i in range(len(texts))])
+
+    monkeypatch.setattr(deps.state, "faiss", vs)
+    monkeypatch.setattr(deps.state, "engine", None)
+    monkeypatch.setattr(deps.state, "bm25", BM25Index.build(zip([f"c{i}" for i in range(len(texts))], texts)))
+
+    sources = rag.retrieve("где SKU-42", top_k=1)
+    assert sources[0]["snippet"].startswith("артикул SKU-42")
+
+
+def test_retrieve_many_matches_single(monkeypatch, dummy_embed):
+    from apps.api import deps, rag
+
+    embed = dummy_embed
+    vs = FAISS.from_texts(["возвраты товар в 14 дней", "доставка 2-5 дней", "тариф Pro"], embed)
+    monkeypatch.setattr(deps.state, "embedder", embed)
+    monkeypatch.setattr(deps.state, "faiss", vs)
+    monkeypatch.setattr(deps.state, "engine", None)
+    monkeypatch.setattr(deps.state, "bm25", None)
+
+    queries = ["возвраты", "доставка курьером"]
+    many = rag.retrieve_many(queries, top_k=2)
+    assert len(many) == 2
+    for q, srcs in zip(queries, many):
+        single = rag.retrieve(q, top_k=2)
+        assert [s["snippet"] for s in srcs] == [s["snippet"] for s in single]
+        assert [s["score"] for s in srcs] == [s["score"] for s in single]
+    assert rag.retrieve_many([]) == []
+
+
+async def test_aretrieve_runs_off_loop(monkeypatch, dummy_embed):
+    import threading
+    from apps.api import deps, rag
+
+    embed = dummy_embed
+    vs = FAISS.from_texts(["возвраты товар в 14 дней", "доставка 2-5 дней"], embed)
+    monkeypatch.setattr(deps.state, "embedder", embed)
+    monkeypatch.setattr(deps.state, "faiss", vs)
+    monkeypatch.setattr(deps.state, "engine", None)
+    monkeypatch.setattr(deps.state, "bm25", None)
+    seen = []
+    orig = rag.retrieve_many
+
+    def spy(*a, **kw):
+        seen.append(threading.current_thread().name)
+        return orig(*a, **kw)
+
+    monkeypatch.setattr(rag, "retrieve_many", spy)
+    sources = await rag.aretrieve("возвраты", top_k=1)
+    assert len(sources) == 1 and seen[0].startswith("cpu")
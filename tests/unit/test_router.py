@@ -1,4 +1,4 @@
-from apps.api.router import pii_filter, route_intent
+from apps.api.router import pii_filter, route_intent, fast_route
 
 
 def test_pii_filter_masks_email_phone_card():
@@ -27,3 +27,35 @@ def test_route_intent_delivery():
 def test_route_intent_default_rag():
     assert route_intent("Привет", "faq", False) == "rag"
 
+
+def test_fast_route_order_number():
+    r = fast_route("Где мой заказ #A123?", "orders", False)
+    assert r.tool == "orders_status" and r.args == {"order_no": "A123"}
+
+
+def test_fast_route_ignores_hashtags_that_are_not_order_numbers():
+    for text in ("#help где мой заказ?", "Подскажите #тариф", "#срочно нужна помощь"):
+        assert fast_route(text, "orders", False) is None
+    assert fast_route("Статус #1001", "orders", False).args == {"order_no": "1001"}
+
+
+def test_fast_route_leaves_mixed_requests_to_llm():
+    assert fast_route("Заказ #A123 не пришёл, как оформить возврат?", "orders", False) is None
+    assert fast_route("Привет", "faq", False) is None
+
+
+def test_fast_route_analytics_admin_only():
+    t = "Сколько заказов за день 2025-08-01?"
+    assert fast_route(t, "admin", True).tool == "db_analytics_query"
+    assert fast_route(t, "admin", False) is None
+
+
+def test_fast_route_leaves_kb_questions_to_llm():
+    for text in ("Сколько дней на возврат?", "Сколько стоит доставка?", "Топ причин возврата за день"):
+        assert fast_route(text, "admin", True) is None
+    assert fast_route("Когда привезут?", "faq", False) is None
+    assert fast_route("Какая цена плана Pro?", "faq", False) is None
+
+
+def test_fast_route_analytics_only_in_admin_mode():
+    assert fast_route("Сколько заказов за день 2025-08-01?", "faq", True) is None
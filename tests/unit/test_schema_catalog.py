@@ -0,0 +1,48 @@
+from apps.api import schema_catalog
+from apps.api.schema_catalog import SchemaCatalog, TableInfo, default_catalog
+
+
+def test_relevant_tables_and_join_paths():
+    c = default_catalog()
+    assert c.relevant("средний чек по городам")[:2] == ["orders", "customers"]
+    assert c.relevant("Привет") == []
+    # customers reach products through orders -> order_items
+    assert c.with_join_paths(["customers", "products"]) == ["customers", "products", "orders", "order_items"]
+    ctx = c.context("выручка по городам")
+    assert "customers" in ctx and "orders.customer_id = customers.id" in ctx and "products" not in ctx
+    assert len(ctx) < len(c.render())
+
+
+def test_embedding_similarity_selects_tables():
+    tables = [TableInfo("refunds", [("id", "int")], "returns"), TableInfo("shipments", [("id", "int")], "delivery")]
+    vectors = {"refunds": [1.0, 0.0], "shipments": [0.0, 1.0]}
+    calls = []
+
+    def embed_documents(texts):
+        calls.append(len(texts))
+        return [vectors[t.split()[0]] for t in texts]
+
+    c = SchemaCatalog(tables, embed_documents)
+    assert c.relevant("abc", [0.1, 0.9]) == ["shipments"]
+    assert c.relevant("abc", [0.9, 0.1]) == ["refunds"]
+    assert calls == [2]  # table vectors are computed once per catalog
+
+
+async def test_catalog_version_and_epoch(monkeypatch):
+    epoch = {"v": "1"}
+    loads = []
+
+    async def load():
+        loads.append(1)
+        return default_catalog()
+
+    monkeypatch.setenv("DB_URL", "postgresql://x")
+    monkeypatch.setenv("SCHEMA_CACHE_TTL_S", "300")
+    monkeypatch.setattr(schema_catalog, "load_catalog", load)
+    monkeypatch.setattr(schema_catalog, "_read_epoch", lambda: epoch["v"])
+    monkeypatch.setattr(schema_catalog, "_catalog", None)
+    first = await schema_catalog.get_schema_catalog()
+    assert await schema_catalog.get_schema_catalog() is first and len(loads) == 1
+    epoch["v"] = "2"  # another worker ran bump_schema_version()
+    again = await schema_catalog.get_schema_catalog()
+    assert len(loads) == 2 and again is first  # unchanged version keeps the embedded catalog
@@ -0,0 +1,66 @@
+from apps.api.sql_cache import SqlCache, normalize_question, schema_fingerprint
+
+
+class BytesRedis:
+    def __init__(self):
+        self.d = {}
+
+    def get(self, k):
+        v = self.d.get(k)
+        return v.encode() if isinstance(v, str) else v
+
+    def setex(self, k, ttl, v):
+        self.d[k] = v
+
+    def delete(self, k):
+        self.d.pop(k, None)
+
+    def hset(self, k, f, v):
+        self.d.setdefault(k, {})[f.encode()] = v
+
+    def hgetall(self, k):
+        return dict(self.d.get(k, {}))
+
+    def hlen(self, k):
+        return len(self.d.get(k, {}))
+
+    def hdel(self, k, f):
+        self.d.get(k, {}).pop(f.encode(), None)
+
+    def expire(self, k, ttl):
+        pass
+
+
+def test_normalize_question():
+    assert normalize_question("  Выручка   за СЕГОДНЯ? ") == normalize_question("выручка за сегодня")
+    assert normalize_question("Всё") == "все"
+
+
+def test_sql_cache_exact_and_schema_invalidation():
+    c = SqlCache(BytesRedis())
+    fp = schema_fingerprint("orders:\n- id: integer")
+    assert c.get("Выручка за сегодня?", fp) is None
+    c.put("выручка за сегодня", fp, "SELECT sum(total) FROM orders LIMIT 500")
+    assert c.get("Выручка за  сегодня?", fp) == "SELECT sum(total) FROM orders LIMIT 500"
+    assert c.get("выручка за сегодня", schema_fingerprint("orders:\n- id: bigint")) is None
+    c.discard("выручка за сегодня", fp)
+    assert c.get("выручка за сегодня", fp) is None
+    assert c.stats()["sql_cache_hits"] == 1
+
+
+def test_sql_cache_similar_question():
+    vectors = {"топ товаров": [1.0, 0.0], "самые продаваемые товары": [0.99, 0.05], "заказы по статусам": [0.0, 1.0]}
+    c = SqlCache(BytesRedis(), embed=lambda q: vectors[q], min_similarity=0.95)
+    c.put("топ товаров", "fp", "SELECT name FROM products LIMIT 10")
+    assert c.get("самые продаваемые товары", "fp") == "SELECT name FROM products LIMIT 10"
+    assert c.get("заказы по статусам", "fp") is None
+    assert c.stats()["sql_cache_similar_hits"] == 1
+
+
+def test_sql_cache_similarity_requires_same_numbers_and_periods():
+    c = SqlCache(BytesRedis(), embed=lambda q: [1.0, 0.0], min_similarity=0.95)  # every question looks alike
+    c.put("топ 10 товаров за прошлый месяц", "fp", "SELECT name FROM products LIMIT 10")
+    assert c.get("топ 20 товаров за прошлый месяц", "fp") is None
+    assert c.get("топ 10 товаров за прошлую неделю", "fp") is None
+    assert c.get("10 самых продаваемых товаров за прошлый месяц", "fp") == "SELECT name FROM products LIMIT 10"
+    assert c.stats()["sql_cache_similar_hits"] == 1